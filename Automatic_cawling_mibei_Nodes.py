@@ -10,11 +10,28 @@ import psutil
 import json
 import base64
 import socket
+import ssl
 import struct
+import errno
+import functools
+import hashlib
+import math
+import codecs
+import heapq
+import ipaddress
+import shutil
+import selectors
+import weakref
+import multiprocessing
+import tempfile
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs, unquote
 from bs4 import BeautifulSoup
 from datetime import datetime
 import logging
-from typing import Optional, List, Dict, Any, Set
+from typing import Optional, List, Dict, Any, Set, AsyncIterator, Callable
 
 # === 高级黑客模块导入 ===
 try:
@@ -49,10 +66,76 @@ try:
         def release(self):
             """释放连接资源"""
             self.semaphore.release()
+    
+    class ProbeEngine(ConnectionPool):
+        """单次运行共享的探测引擎：一个会话、一个连接器、一份DNS缓存，退出时统一关闭"""
+        
+        def __init__(self, max_connections: int = 100, limit_per_host: int = 4,
+                     dns_ttl: int = 300, timeout: float = 10):
+            super().__init__(max_connections)
+            self.limit_per_host = limit_per_host
+            self.dns_ttl = dns_ttl
+            self.timeout = timeout
+        
+        async def __aenter__(self):
+            if self.session is None:
+                connector = aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.limit_per_host,
+                    use_dns_cache=True,
+                    ttl_dns_cache=self.dns_ttl,
+                    ssl=False
+                )
+                self.session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=self.timeout)
+                )
+            return self
+        
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+            await self.close()
+        
+        async def close(self):
+            """关闭会话和连接器"""
+            if self.session:
+                await self.session.close()
+                self.session = None
+        
+        async def check_html(self, url: str, proxy: Optional[str] = None, timeout: float = 3.0,
+                             headers: Optional[Dict[str, str]] = None) -> bool:
+            """通过代理请求页面，检查是否返回HTML内容"""
+            try:
+                async with self.session.get(
+                    url,
+                    proxy=proxy,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as resp:
+                    if resp.status != 200:
+                        return False
+                    text = await resp.text()
+                    return "<html" in text.lower()
+            except Exception:
+                return False
+
 except ImportError:
     logging.warning("🚫 异步模块未安装，将使用同步模式运行")
     has_async = False
 
+try:
+    import uvloop
+    has_uvloop = True
+except ImportError:
+    logging.info("🚫 uvloop未安装，将使用标准asyncio事件循环")
+    has_uvloop = False
+
+try:
+    import numpy as np
+    has_numpy = True
+except ImportError:
+    logging.warning("🚫 numpy未安装，批量评分将使用纯Python实现")
+    has_numpy = False
+
 try:
     import win32api
     import win32process
@@ -74,7 +157,8 @@ class Config:
     
     V2RAYN_EXE = "v2rayN.exe"
     CONFIG_FILE = "config.json"
-    NODE_KING_FILE = "config.json"
+    NODE_KING_FILE = "node_king_state.json"
+    LEGACY_NODE_KING_FILE = "config.json"  # 旧版与v2rayN共用的状态文件，仅用于迁移
     NODES_FILE = "nodes.txt"
     CHECK_TIMEOUT = 10
     MAIN_URL = 'https://www.mibei77.com/'
@@ -135,6 +219,88 @@ class Config:
     TEST_TIMEOUT_MIN = 1.0
     TEST_TIMEOUT_MAX = 2.5
     MAX_TEST_LATENCY = 2000
+    PROBE_SAMPLES = 3              # 每轮对每个节点的建连次数
+    PROBE_SAMPLE_INTERVAL = 0.2    # 多次建连之间错开的秒数
+    PROBE_EWMA_ALPHA = 0.3         # 抖动/丢包率的指数平滑系数
+    SCORE_USE_P95 = True           # 速度得分按p95尾延迟计算（有样本时）
+    STAGE_PROBE_ENABLED = True     # TCP连通后继续做TLS握手/WebSocket升级检查，任一阶段失败即视为不可用
+    STAGE_PROBE_TIMEOUT = 3.0      # 每个阶段的超时秒数
+    
+    # 📈 自适应并发配置 (新增)
+    ADAPTIVE_CONCURRENCY = True       # 关闭后并发窗口固定为 MAX_CONCURRENT_REQUESTS
+    CONCURRENCY_MIN = 4
+    CONCURRENCY_MAX = 256
+    CONCURRENCY_INFLATE_RATIO = 1.5   # 建连耗时超过基线多少倍视为拥塞
+    CONCURRENCY_FD_RESERVE = 64       # 距离文件描述符上限的保留余量
+    SCHEDULER_QUEUE_SIZE = 512        # 调度器待测队列长度，节点列表按需惰性读取
+    
+    # 🎯 提前结束测速配置 (新增)
+    EARLY_EXIT_ENABLED = False        # 按历史得分先测强节点，够数或超出时间预算即停止（需完整节点列表，开启后不走流式流水线）
+    EARLY_EXIT_TARGET = 0             # 目标可用节点数，0 表示 MAX_NODES
+    EARLY_EXIT_EXPLORE = 0.25         # 候选序列中穿插未测过的新节点的比例，避免新节点永远轮不到
+    BENCHMARK_TIME_BUDGET = 30.0      # 测速时间预算（秒），0 表示不限
+    
+    # 🧩 多进程分片测速配置 (新增)
+    SHARD_ENABLED = False             # 超大订阅按进程分片测速（分片模式下不提前结束；需完整节点列表，开启后不走流式流水线）
+    SHARD_MIN_NODES = 5000            # 节点数达到此值才分片
+    SHARD_PROCESSES = 0               # 进程数，0 表示CPU核数
+    
+    # ⚙️ 事件循环配置 (新增)
+    EVENT_LOOP = "auto"               # auto: 已安装uvloop时使用uvloop；asyncio: 始终使用标准事件循环
+    
+    # 🔌 探测引擎配置 (新增)
+    PROBE_BACKEND = "batch"     # batch: 共享选择器批量处理半开连接；loop: 每个连接单独注册到事件循环
+    PROBE_LIMIT_PER_HOST = 4    # 同一主机的并发连接上限
+    PROBE_DNS_CACHE_TTL = 300   # 连接器DNS缓存秒数
+    
+    # 🛰️ 本地核心验证配置 (新增)
+    CORE_EXECUTABLES = ["xray", "v2ray"]  # 按顺序查找的代理核心
+    CORE_POOL_SIZE = 4             # 同时运行的核心进程数
+    CORE_NODES_PER_PROCESS = 32    # 每个核心进程承载的节点数
+    CORE_BASE_PORT = 20800         # 本地入站端口起点，每个进程占用一段连续端口
+    CORE_START_TIMEOUT = 5.0       # 等待核心端口就绪的秒数
+    CORE_STANDIN_PROXY = None      # 替身代理(如 "http://127.0.0.1:8080")，设置后不启动核心
+    CORE_CHECK_URL = "https://www.google.com"  # 经节点访问的检查页面，须返回HTML
+    
+    # 📶 带宽测试配置 (新增)
+    BANDWIDTH_TEST_ENABLED = True  # 对排名靠前的节点经本地核心测吞吐，没有可用核心时自动跳过
+    BANDWIDTH_TOP_N = 5            # 参与带宽测试的候选数
+    BANDWIDTH_URL = "https://speed.cloudflare.com/__down?bytes=10000000"
+    BANDWIDTH_MAX_BYTES = 5 * 1024 * 1024  # 单节点最多下载字节数
+    BANDWIDTH_MAX_SECONDS = 8.0    # 单节点最长下载秒数（从首字节起算）
+    THROUGHPUT_SCORE_MAX = 20      # 吞吐得分上限，未测过带宽的节点不加分
+    THROUGHPUT_FULL_MBPS = 50.0    # 达到此吞吐即得满分
+    
+    # 🌐 DNS缓存配置 (新增)
+    DNS_CACHE_TTL = 300            # 解析结果缓存秒数
+    DNS_NEGATIVE_TTL = 30          # 解析失败结果缓存秒数
+    DNS_CACHE_SIZE = 4096          # 最多缓存的主机数，超出按最久未使用淘汰
+    DNS_RESOLVE_CONCURRENCY = 64   # 批量预解析的并发数
+    
+    # ♻️ 测速结果复用配置 (新增)
+    FRESHNESS_ENABLED = True
+    FRESHNESS_FILE = "probe_freshness.json"
+    FRESHNESS_TTL = 1800           # 可用节点的测速结果复用秒数
+    FRESHNESS_NEGATIVE_TTL = 600   # 不可用节点的测速结果复用秒数
+
+    # 🧬 节点解析配置 (新增)
+    NODE_PARSE_CACHE_SIZE = 16384  # 解析结果缓存条数，同一链接只解码一次
+    
+    # 🌊 流式下载配置 (新增)
+    ENABLE_STREAMING_PIPELINE = True  # 边下载边解析边测速
+    STREAM_CHUNK_SIZE = 64 * 1024     # 每次读取的字节数
+    STREAM_QUEUE_SIZE = 1000          # 下载与测速之间的有界队列长度
+    
+    # 🧹 节点去重配置 (新增)
+    DEDUP_BLOOM_ENABLED = False         # 启用后，之前几天见过的节点在解码前直接丢弃
+    DEDUP_BLOOM_FILE = "seen_nodes.bloom"
+    DEDUP_BLOOM_CAPACITY = 200000
+    DEDUP_BLOOM_ERROR_RATE = 0.001
+    DEDUP_BLOOM_MAX_AGE_DAYS = 7        # 过滤器超过该天数后重建，避免饱和
+    
+    # 💾 节点王持久化配置 (新增)
+    NODE_KING_COMPACT_ENTRIES = 20000  # 日志累计记录数超过该值时压缩为快照
+    NODE_KING_SCHEMA_VERSION = 2       # 状态文件格式版本 (1 = 旧版ISO时间戳)
     
     USER_AGENTS = [
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
@@ -182,491 +348,1303 @@ def setup_logging():
         sys.stdout.reconfigure(encoding='utf-8')
 
 
+# === 统一节点解析层 ===
+class ProxyNode:
+    """单次解析后的节点记录，供去重、测速、评分、导出复用"""
+
+    __slots__ = ('raw', 'protocol', 'host', 'port', 'credential', 'remarks', 'fields')
+
+    def __init__(self, raw: str, protocol: str, host: str, port: int,
+                 credential: str = "", remarks: str = "", fields: Optional[Dict[str, Any]] = None):
+        self.raw = raw
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.credential = credential
+        self.remarks = remarks
+        self.fields = fields or {}
+
+    @property
+    def address(self) -> str:
+        """host:port 形式的地址"""
+        return f"{self.host}:{self.port}"
+
+    @property
+    def identity(self) -> tuple:
+        """规范节点身份，用于去重"""
+        return (self.protocol, self.host.lower(), self.port, self.credential)
+
+    def __repr__(self) -> str:
+        return f"ProxyNode({self.protocol}://{self.host}:{self.port})"
+
+
+def _b64decode_padded(content: str) -> bytes:
+    """兼容urlsafe与缺失填充的base64解码"""
+    content = content.strip().replace('-', '+').replace('_', '/')
+    padding = len(content) % 4
+    if padding:
+        content += '=' * (4 - padding)
+    return base64.b64decode(content)
+
+
+def _parse_vmess_link(line: str) -> Optional[ProxyNode]:
+    """解析 vmess://base64(json)"""
+    vmess_json = json.loads(_b64decode_padded(line[8:]).decode('utf-8', errors='ignore'))
+    host = vmess_json.get("add", "")
+    if not host:
+        return None
+    return ProxyNode(line, "vmess", host, int(vmess_json.get("port", 443)),
+                     credential=vmess_json.get("id", ""),
+                     remarks=vmess_json.get("ps", ""),
+                     fields=vmess_json)
+
+
+def _parse_url_link(line: str) -> Optional[ProxyNode]:
+    """解析 vless:// trojan:// hysteria2:// 等标准URL格式"""
+    parts = urlsplit(line)
+    if not parts.hostname:
+        return None
+    protocol = parts.scheme.lower()
+    if protocol == "hy2":
+        protocol = "hysteria2"
+    fields = {k: v[0] for k, v in parse_qs(parts.query).items()}
+    return ProxyNode(line, protocol, parts.hostname, parts.port or 443,
+                     credential=unquote(parts.username or ""),
+                     remarks=unquote(parts.fragment),
+                     fields=fields)
+
+
+def _parse_ss_link(line: str) -> Optional[ProxyNode]:
+    """解析 ss:// (SIP002 与旧版整体base64格式)"""
+    body, _, remarks = line[5:].partition('#')
+    body, _, query = body.partition('?')
+    body = body.rstrip('/')
+
+    if '@' in body:
+        userinfo, hostport = body.rsplit('@', 1)
+        userinfo = unquote(userinfo)
+        if ':' not in userinfo:
+            userinfo = _b64decode_padded(userinfo).decode('utf-8', errors='ignore')
+    else:
+        decoded = _b64decode_padded(body).decode('utf-8', errors='ignore')
+        userinfo, hostport = decoded.rsplit('@', 1)
+
+    method, _, password = userinfo.partition(':')
+    host, _, port = hostport.rpartition(':')
+    host = host.strip('[]')
+    if not host:
+        return None
+    fields = {k: v[0] for k, v in parse_qs(query).items()}
+    fields['method'] = method
+    return ProxyNode(line, "ss", host, int(port),
+                     credential=password,
+                     remarks=unquote(remarks),
+                     fields=fields)
+
+
+def _parse_ssr_link(line: str) -> Optional[ProxyNode]:
+    """解析 ssr://base64(host:port:protocol:method:obfs:base64pass/?params)"""
+    decoded = _b64decode_padded(line[6:]).decode('utf-8', errors='ignore')
+    main_part, _, query = decoded.partition('/?')
+    host, port, protocol, method, obfs, password_b64 = main_part.rsplit(':', 5)
+    if not host:
+        return None
+    fields = {k: v[0] for k, v in parse_qs(query).items()}
+    for key in ('remarks', 'group', 'obfsparam', 'protoparam'):
+        if key in fields:
+            fields[key] = _b64decode_padded(fields[key]).decode('utf-8', errors='ignore')
+    fields.update({'protocol': protocol, 'method': method, 'obfs': obfs})
+    return ProxyNode(line, "ssr", host, int(port),
+                     credential=_b64decode_padded(password_b64).decode('utf-8', errors='ignore'),
+                     remarks=fields.get('remarks', ''),
+                     fields=fields)
+
+
+_NODE_PARSERS = {
+    "vmess://": _parse_vmess_link,
+    "vless://": _parse_url_link,
+    "trojan://": _parse_url_link,
+    "hysteria2://": _parse_url_link,
+    "hy2://": _parse_url_link,
+    "ssr://": _parse_ssr_link,
+    "ss://": _parse_ss_link,
+}
+
+SUPPORTED_NODE_SCHEMES = tuple(_NODE_PARSERS)
+
+
+@functools.lru_cache(maxsize=Config.NODE_PARSE_CACHE_SIZE)
+def _parse_node_cached(line: str) -> Optional[ProxyNode]:
+    scheme, sep, _ = line.partition('://')
+    parser = _NODE_PARSERS.get(scheme.lower() + sep) if sep else None
+    if parser is None:
+        return None
+    try:
+        return parser(line)
+    except Exception as e:
+        logging.debug(f"[解析] 节点解析失败: {line[:30]}... {e}")
+        return None
+
+
+def parse_node(line: str) -> Optional[ProxyNode]:
+    """将分享链接解析为 ProxyNode，同一链接只解码一次"""
+    if not line:
+        return None
+    return _parse_node_cached(line.strip())
+
+# === 节点去重 ===
+class BloomFilter:
+    """可持久化的布隆过滤器，用于跨天丢弃已见过的节点链接"""
+    
+    MAGIC = b'BLM1'
+    HEADER = struct.Struct('>4sdQI')
+    
+    def __init__(self, capacity: int, error_rate: float = 0.001, created: float = None):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.created = created or time.time()
+    
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+    
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+    
+    @classmethod
+    def load(cls, path: str, capacity: int, error_rate: float, max_age: float) -> 'BloomFilter':
+        """从文件加载；文件不存在、损坏或过期时返回新的空过滤器"""
+        try:
+            with open(path, 'rb') as f:
+                magic, created, num_bits, num_hashes = cls.HEADER.unpack(f.read(cls.HEADER.size))
+                bits = bytearray(f.read())
+            if magic == cls.MAGIC and len(bits) == (num_bits + 7) // 8 and time.time() - created < max_age:
+                bloom = cls.__new__(cls)
+                bloom.num_bits, bloom.num_hashes, bloom.bits, bloom.created = num_bits, num_hashes, bits, created
+                return bloom
+        except (OSError, struct.error):
+            pass
+        return cls(capacity, error_rate)
+    
+    def save(self, path: str):
+        """原子写入文件"""
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.created, self.num_bits, self.num_hashes))
+            f.write(self.bits)
+        os.replace(temp_path, path)
+
+class NodeDeduplicator:
+    """基于规范节点身份 (协议, 主机, 端口, 凭据) 的哈希集合去重，可选跨天布隆过滤"""
+    
+    def __init__(self, use_bloom: bool = None):
+        self.seen: Set[tuple] = set()
+        self.duplicates = 0
+        self.cross_day = 0
+        self.bloom = None
+        if Config.DEDUP_BLOOM_ENABLED if use_bloom is None else use_bloom:
+            self.bloom_path = os.path.join(Config.BASE_DIR, Config.DEDUP_BLOOM_FILE)
+            self.bloom = BloomFilter.load(self.bloom_path, Config.DEDUP_BLOOM_CAPACITY,
+                                          Config.DEDUP_BLOOM_ERROR_RATE,
+                                          Config.DEDUP_BLOOM_MAX_AGE_DAYS * 86400)
+    
+    def accept(self, line: str) -> bool:
+        """首次出现的节点返回 True；布隆过滤命中时在解码之前就丢弃"""
+        if self.bloom is not None:
+            if line in self.bloom:
+                self.cross_day += 1
+                return False
+            self.bloom.add(line)
+        
+        parsed = parse_node(line)
+        key = parsed.identity if parsed else ('raw', line)
+        if key in self.seen:
+            self.duplicates += 1
+            return False
+        self.seen.add(key)
+        return True
+    
+    def close(self, save: bool = True):
+        """持久化布隆过滤器；save=False 时丢弃本次新增的记录"""
+        if self.bloom is not None and save:
+            try:
+                self.bloom.save(self.bloom_path)
+            except OSError as e:
+                logging.warning(f"[⚠️] 保存去重过滤器失败: {e}")
+        if self.cross_day:
+            logging.info(f"[🧹] 跨天去重丢弃 {self.cross_day} 个已见过的节点")
+
+
 # === 节点王残酷淘汰系统 ===
+INF = float('inf')
+STATUS_NORMAL = 0
+STATUS_KING = 1
+
+
+def _to_epoch(value) -> float:
+    """将旧版ISO字符串/None/数字统一转换为epoch浮点时间戳（仅在加载时使用）"""
+    if not value:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LatencySketch:
+    """对数分桶的延迟直方图：每个节点固定 BINS 个计数，分位数相对误差约 ±7%"""
+    
+    BINS = 64
+    GAMMA = 1.15       # 相邻桶边界的比例
+    MIN_MS = 1.0       # 第0桶收纳小于1ms的样本，最后一桶收纳约6.6s以上的样本
+    MAX_COUNT = 2000   # 单节点样本总数超过后整体减半，让旧样本逐渐淡出
+    _LOG_GAMMA = math.log(GAMMA)
+    
+    @classmethod
+    def bin_of(cls, ms: float) -> int:
+        if ms < cls.MIN_MS:
+            return 0
+        return min(cls.BINS - 1, int(math.log(ms / cls.MIN_MS) / cls._LOG_GAMMA) + 1)
+    
+    @classmethod
+    def value_of(cls, index: int) -> float:
+        """桶的几何中点"""
+        if index == 0:
+            return cls.MIN_MS / 2
+        return cls.MIN_MS * cls.GAMMA ** (index - 0.5)
+    
+    @classmethod
+    def quantile(cls, counts, q: float) -> float:
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * (total - 1)
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen > rank:
+                return cls.value_of(index)
+        return cls.value_of(cls.BINS - 1)
+
+
+class NodeStatsStore:
+    """紧凑列式节点统计存储：并行类型数组 + 节点ID行索引，O(1)增删改
+    
+    平均延迟、成功率和 p50 不单独存储，按需由累计值或直方图推导。
+    内存：每行数值列固定 7×8 + 8×4 + 4×4 + 4×2 = 112 字节，其余是节点ID、链接字符串和行索引。
+    实测 10 万行（链接约 110 字符，一成节点有延迟样本）约 47MB：数值列 11MB、链接 16MB、
+    节点ID与行索引约 12MB；延迟直方图按需分配，只有收到过成功样本的行才占用约 190 字节，
+    keep_sketch=False 的存储（淘汰节点）完全不保存直方图。
+    """
+    
+    # 时间戳、延迟累加和与得分用 double（精度），延迟/比例类指标用 float，计数用 int32，小整数用 int16
+    COLUMNS = (
+        ('create_time', 'd'), ('last_success', 'd'), ('last_fail', 'd'), ('last_active', 'd'),
+        ('death_time', 'd'), ('total_latency', 'd'), ('score', 'd'),
+        ('best_latency', 'f'), ('worst_latency', 'f'), ('p95_latency', 'f'), ('jitter', 'f'),
+        ('loss_rate', 'f'), ('tls_latency', 'f'), ('ws_latency', 'f'), ('throughput_mbps', 'f'),
+        ('tests', 'i'), ('success', 'i'), ('fails', 'i'), ('latency_count', 'i'),
+        ('consecutive_fails', 'h'), ('age_days', 'h'), ('king_days', 'h'), ('status', 'h'),
+    )
+    FIELDS = tuple(name for name, _ in COLUMNS)
+    TIME_FIELDS = ('create_time', 'last_success', 'last_fail', 'last_active', 'death_time')
+    DEFAULTS = {'best_latency': INF, 'score': 50.0}
+    
+    def __init__(self, keep_sketch: bool = True):
+        self.keep_sketch = keep_sketch
+        self._index: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.links: List[str] = []
+        self.reasons: List[str] = []
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.sketches: List[Optional[array]] = []  # 每行的直方图桶计数，无样本时为 None
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._index
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def row_of(self, node_id: str) -> int:
+        """返回节点所在行号，不存在时返回 -1"""
+        return self._index.get(node_id, -1)
+
+    def add(self, node_id: str, link: str, now: float) -> int:
+        """追加一条默认统计记录并返回行号"""
+        row = len(self.ids)
+        self._index[node_id] = row
+        self.ids.append(node_id)
+        self.links.append(link)
+        self.reasons.append('')
+        for name in self.FIELDS:
+            getattr(self, name).append(self.DEFAULTS.get(name, 0))
+        self.create_time[row] = self.last_active[row] = now
+        self.sketches.append(None)
+        return row
+    
+    def avg_latency(self, row: int) -> float:
+        """平均延迟 = 延迟累加和 / 成功样本数，无样本时为 inf"""
+        count = self.latency_count[row]
+        return self.total_latency[row] / count if count else INF
+    
+    def success_rate(self, row: int) -> float:
+        tests = self.tests[row]
+        return self.success[row] / tests if tests else 0.0
+    
+    def _sketch_for_write(self, row: int) -> Optional[array]:
+        """返回该行的直方图，首次写入时才分配"""
+        if not self.keep_sketch:
+            return None
+        sketch = self.sketches[row]
+        if sketch is None:
+            sketch = self.sketches[row] = array('H', [0]) * LatencySketch.BINS
+        return sketch
+    
+    def record_latency(self, row: int, ms: float):
+        """把一次成功样本计入该行的延迟直方图"""
+        sketch = self._sketch_for_write(row)
+        if sketch is None:
+            return
+        sketch[LatencySketch.bin_of(ms)] += 1
+        if sum(sketch) > LatencySketch.MAX_COUNT:
+            for i in range(LatencySketch.BINS):
+                sketch[i] >>= 1
+    
+    def latency_quantile(self, row: int, q: float) -> float:
+        """从直方图估算分位数延迟，无样本时返回0"""
+        sketch = self.sketches[row]
+        return LatencySketch.quantile(sketch, q) if sketch is not None else 0.0
+
+    def copy_from(self, other: 'NodeStatsStore', node_id: str) -> int:
+        """从另一个存储复制整行（用于 活跃→淘汰 迁移）"""
+        src = other._index[node_id]
+        row = self.row_of(node_id)
+        if row < 0:
+            row = self.add(node_id, other.links[src], 0.0)
+        self.links[row] = other.links[src]
+        self.reasons[row] = other.reasons[src]
+        for name in self.FIELDS:
+            getattr(self, name)[row] = getattr(other, name)[src]
+        sketch = other.sketches[src]
+        self.sketches[row] = array('H', sketch) if sketch is not None and self.keep_sketch else None
+        return row
+
+    def remove(self, node_id: str):
+        """交换删除：用最后一行覆盖被删行，保持数组紧凑"""
+        row = self._index.pop(node_id)
+        last = len(self.ids) - 1
+        columns = [self.ids, self.links, self.reasons, self.sketches]
+        columns.extend(getattr(self, name) for name in self.FIELDS)
+        if row != last:
+            moved_id = self.ids[last]
+            for col in columns:
+                col[row] = col[last]
+            self._index[moved_id] = row
+        for col in columns:
+            col.pop()
+
+    def to_dict(self, node_id: str) -> dict:
+        """导出单行为可序列化字典"""
+        row = self._index[node_id]
+        data = {'node': self.links[row]}
+        for name, typecode in self.COLUMNS:
+            value = getattr(self, name)[row]
+            # float32 列取9位有效数字即可无损往返，避免日志里写出17位的double尾数
+            data[name] = float(f"{value:.9g}") if typecode == 'f' else value
+        data['status'] = 'king' if data['status'] == STATUS_KING else 'normal'
+        if self.reasons[row]:
+            data['death_reason'] = self.reasons[row]
+        sketch = self.sketches[row]
+        buckets = [[i, c] for i, c in enumerate(sketch) if c] if sketch is not None else []
+        if buckets:
+            data['sketch'] = buckets
+        return data
+
+    def load_dict(self, node_id: str, data: dict) -> int:
+        """从字典加载单行，兼容旧版ISO字符串时间戳"""
+        row = self.row_of(node_id)
+        if row < 0:
+            row = self.add(node_id, data.get('node', ''), 0.0)
+        self.links[row] = data.get('node', '')
+        self.reasons[row] = data.get('death_reason', '') or ''
+        # 旧版文件里的 avg_latency / success_rate / p50_latency 可由其余字段推导，直接忽略
+        for name, typecode in self.COLUMNS:
+            if name in self.TIME_FIELDS:
+                getattr(self, name)[row] = _to_epoch(data.get(name))
+            elif typecode in 'df':
+                getattr(self, name)[row] = float(data.get(name, getattr(self, name)[row]))
+            elif name != 'status':
+                getattr(self, name)[row] = int(data.get(name, 0))
+        self.status[row] = STATUS_KING if data.get('status') == 'king' else STATUS_NORMAL
+        self.sketches[row] = None
+        buckets = data.get('sketch')
+        sketch = self._sketch_for_write(row) if buckets else None
+        if sketch is not None:
+            for index, count in buckets:
+                if 0 <= index < LatencySketch.BINS:
+                    sketch[index] = min(int(count), 0xFFFF)
+        return row
+
+
+class KingRecord:
+    """历史节点王记录（时间戳为epoch浮点）"""
+
+    __slots__ = ('node', 'score', 'avg_latency', 'best_latency', 'worst_latency', 'success_rate',
+                 'age_days', 'king_days', 'start_time', 'end_time', 'last_active', 'reason',
+                 'revived', 'revive_time', 'revive_count')
+
+    def __init__(self, node: str, score: float = 0, avg_latency: float = INF,
+                 best_latency: float = INF, worst_latency: float = 0.0, success_rate: float = 0,
+                 age_days: int = 0, king_days: int = 0, start_time: float = 0.0,
+                 end_time: float = 0.0, last_active: float = 0.0, reason: str = '',
+                 revived: bool = False, revive_time: float = 0.0, revive_count: int = 0):
+        self.node = node
+        self.score = score
+        self.avg_latency = avg_latency
+        self.best_latency = best_latency
+        self.worst_latency = worst_latency
+        self.success_rate = success_rate
+        self.age_days = age_days
+        self.king_days = king_days
+        self.start_time = start_time
+        self.end_time = end_time
+        self.last_active = last_active
+        self.reason = reason
+        self.revived = revived
+        self.revive_time = revive_time
+        self.revive_count = revive_count
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'KingRecord':
+        """从字典恢复，兼容旧版ISO字符串时间戳"""
+        avg_latency = float(data.get('avg_latency', INF))
+        return cls(
+            node=data.get('node', ''),
+            score=float(data.get('score', 0)),
+            avg_latency=avg_latency,
+            best_latency=float(data.get('best_latency', avg_latency)),
+            worst_latency=float(data.get('worst_latency', avg_latency)),
+            success_rate=float(data.get('success_rate', 0)),
+            age_days=int(data.get('age_days', 0)),
+            king_days=int(data.get('king_days', 0)),
+            start_time=_to_epoch(data.get('start_time')),
+            end_time=_to_epoch(data.get('end_time')),
+            last_active=_to_epoch(data.get('last_active')),
+            reason=data.get('reason', ''),
+            revived=bool(data.get('revived', False)),
+            revive_time=_to_epoch(data.get('revive_time')),
+            revive_count=int(data.get('revive_count', 0)),
+        )
+
+
+def _score_values(tests: int, success_rate: float, avg_latency: float, best_latency: float,
+                  worst_latency: float, age_days: int, consecutive_fails: int,
+                  p95_latency: float = 0.0, throughput_mbps: float = 0.0) -> float:
+    """单节点得分公式（成功率/速度/稳定性/持久度/吞吐/惩罚），与批量引擎逐位一致"""
+    success_score = success_rate * 40 if tests > 0 else 0
+    
+    # 有直方图样本时按尾延迟计算速度分
+    speed_latency = p95_latency if Config.SCORE_USE_P95 and p95_latency > 0 else avg_latency
+    speed_score = 0
+    if speed_latency < INF:
+        if speed_latency <= 100:
+            speed_score = 30
+        elif speed_latency <= 500:
+            speed_score = 30 * (1 - (speed_latency - 100) / 400)
+
+    stability_score = 0
+    if (best_latency < INF and
+        worst_latency > 0 and
+        worst_latency - best_latency <= 100):
+        stability_score = 20
+    elif (best_latency < INF and
+          worst_latency > 0):
+        latency_range = worst_latency - best_latency
+        if latency_range <= 300:
+            stability_score = 20 * (1 - (latency_range - 100) / 200)
+
+    persistence_score = min(10, age_days)
+    penalty = consecutive_fails * 5
+    score = success_score + speed_score + stability_score + persistence_score - penalty
+    # 吞吐项只在测过带宽时加入，未测节点的得分与原公式完全相同
+    if throughput_mbps > 0:
+        score += min(Config.THROUGHPUT_SCORE_MAX,
+                     Config.THROUGHPUT_SCORE_MAX * throughput_mbps / Config.THROUGHPUT_FULL_MBPS)
+    return max(0, score)
+
+
+class BatchScorer:
+    """列式批量评分引擎：NumPy可用时整列向量化计算，否则退回纯Python逐列计算"""
+
+    @staticmethod
+    def _column(col):
+        """零拷贝读取数组列；float32 列提升为 float64，保证与纯Python路径逐位一致"""
+        column = np.frombuffer(col, dtype=np.dtype(col.typecode))
+        return column.astype(np.float64) if col.typecode == 'f' else column
+    
+    @classmethod
+    def _rates(cls, s: NodeStatsStore):
+        """整列推导成功率与平均延迟"""
+        if has_numpy:
+            col = cls._column
+            tests = col(s.tests)
+            count = col(s.latency_count)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rate = np.where(tests > 0, col(s.success) / tests, 0.0)
+                avg = np.where(count > 0, col(s.total_latency) / count, INF)
+            return rate, avg
+        return ([success / tests if tests else 0.0 for success, tests in zip(s.success, s.tests)],
+                [total / count if count else INF for total, count in zip(s.total_latency, s.latency_count)])
+
+    @classmethod
+    def score_all(cls, s: NodeStatsStore) -> list:
+        """一次性计算所有节点得分并写回 score 列"""
+        if not len(s):
+            return []
+
+        if has_numpy:
+            col = cls._column
+            tests = col(s.tests)
+            rate, avg = cls._rates(s)
+            best = col(s.best_latency)
+            worst = col(s.worst_latency)
+            if Config.SCORE_USE_P95:
+                p95 = col(s.p95_latency)
+                avg = np.where(p95 > 0, p95, avg)
+            
+            with np.errstate(invalid='ignore', over='ignore'):
+                success_score = np.where(tests > 0, rate * 40, 0.0)
+                speed_score = np.where(avg <= 100, 30.0,
+                                       np.where(avg <= 500, 30 * (1 - (avg - 100) / 400), 0.0))
+                valid = (best < INF) & (worst > 0)
+                latency_range = worst - best
+                stability_score = np.where(valid & (latency_range <= 100), 20.0,
+                                           np.where(valid & (latency_range <= 300),
+                                                    20 * (1 - (latency_range - 100) / 200), 0.0))
+                persistence_score = np.minimum(10, col(s.age_days))
+                penalty = col(s.consecutive_fails) * 5
+                scores = success_score + speed_score + stability_score + persistence_score - penalty
+                throughput = col(s.throughput_mbps)
+                scores = np.where(throughput > 0,
+                                  scores + np.minimum(Config.THROUGHPUT_SCORE_MAX,
+                                                      Config.THROUGHPUT_SCORE_MAX * throughput
+                                                      / Config.THROUGHPUT_FULL_MBPS),
+                                  scores)
+                scores = np.maximum(0, scores)
+
+            col(s.score)[:] = scores
+            return scores.tolist()
+
+        rate, avg = cls._rates(s)
+        scores = [_score_values(*values) for values in zip(
+            s.tests, rate, avg, s.best_latency,
+            s.worst_latency, s.age_days, s.consecutive_fails, s.p95_latency, s.throughput_mbps)]
+        s.score = array('d', scores)
+        return scores
+
+    @classmethod
+    def top_k(cls, s: NodeStatsStore, scores: list, k: int = 1) -> List[int]:
+        """用堆从满足节点王条件的行中取得分最高的 k 行"""
+        threshold = Config.SCORE_THRESHOLD
+        rates, _ = cls._rates(s)
+        if has_numpy and len(s):
+            col = cls._column
+            tests = col(s.tests)
+            mask = ((np.asarray(scores) >= threshold) & (col(s.consecutive_fails) == 0)
+                    & ~((tests >= 5) & (rates < 0.8)))
+            eligible = np.flatnonzero(mask).tolist()
+        else:
+            eligible = (row for row, (score, cf, tests, rate) in enumerate(
+                            zip(scores, s.consecutive_fails, s.tests, rates))
+                        if score >= threshold and cf == 0 and not (tests >= 5 and rate < 0.8))
+        return heapq.nlargest(k, eligible, key=scores.__getitem__)
+
+    @staticmethod
+    def king_composite(king: KingRecord) -> tuple:
+        """历史节点王综合评分，返回 (加成后得分, 综合得分)"""
+        score = king.score
+        if Config.ENABLE_KING_REVIVAL:
+            score = score * Config.KING_REVIVAL_SCORE_BOOST
+        latency_bonus = max(0, 100 - (king.avg_latency / 10))
+        return score, score + latency_bonus * 0.3
+
+
 class NodeKingSystem:
     """节点王残酷淘汰系统 - 最小入侵版"""
-    
+
+    JOURNAL_SUFFIX = ".journal"
+
     def __init__(self, data_file: str = None):
         self.data_file = os.path.join(Config.BASE_DIR, data_file or Config.NODE_KING_FILE)
-        self.nodes = {}      # 活跃节点 {node_id: data}
-        self.kings = {}      # 节点王记录
-        self.dead = {}       # 淘汰节点
-        self._load()
-    
-    def _load(self):
-        """加载数据"""
+        self.journal_file = self.data_file + self.JOURNAL_SUFFIX
+        self._nodes = NodeStatsStore()           # 活跃节点
+        self._kings: Dict[str, KingRecord] = {}  # 节点王记录
+        self._dead = NodeStatsStore(keep_sketch=False)  # 淘汰节点，不保留延迟直方图
+        self._dirty: Set[tuple] = set()          # 待写入日志的 (分区, 节点ID)
+        self._journal_entries = 0
+        self._loaded = False
+        self._read_only = False                  # 遇到更高版本的状态文件时禁止写回
+
+    # --- 延迟加载 ---
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+    @property
+    def nodes(self) -> NodeStatsStore:
+        self._ensure_loaded()
+        return self._nodes
+
+    @property
+    def kings(self) -> Dict[str, KingRecord]:
+        self._ensure_loaded()
+        return self._kings
+
+    @property
+    def dead(self) -> NodeStatsStore:
+        self._ensure_loaded()
+        return self._dead
+
+    def _mark(self, section: str, node_id: str):
+        """标记记录已变更，下次 save() 仅写入这些记录"""
+        self._dirty.add((section, node_id))
+
+    # --- 持久化：快照 + 追加日志 ---
+    def _load_snapshot(self, data: dict):
+        for node_id, node_data in data.get('nodes', {}).items():
+            self._nodes.load_dict(node_id, node_data)
+        for node_id, king_data in data.get('kings', {}).items():
+            self._kings[node_id] = KingRecord.from_dict(king_data)
+        for node_id, node_data in data.get('dead', {}).items():
+            self._dead.load_dict(node_id, node_data)
+
+    def _migrate_legacy(self) -> bool:
+        """从旧版共用的 config.json 导入节点王状态（原文件保持不动）"""
+        legacy_file = os.path.join(Config.BASE_DIR, Config.LEGACY_NODE_KING_FILE)
+        if os.path.abspath(legacy_file) == os.path.abspath(self.data_file) or not os.path.exists(legacy_file):
+            return False
         try:
-            if os.path.exists(self.data_file):
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.debug(f"[迁移] 跳过旧版状态文件: {e}")
+            return False
+        if not isinstance(data, dict) or not any(k in data for k in ('nodes', 'kings', 'dead')):
+            return False
+
+        self._load_snapshot(data)
+        logging.info(f"[迁移] 已从 {legacy_file} 导入节点王状态: "
+                     f"{len(self._nodes)}个活跃, {len(self._kings)}个节点王, {len(self._dead)}个淘汰")
+        return True
+
+    def _load(self):
+        """加载快照并重放日志；损坏的文件会被移到旁边保留，绝不清空历史"""
+        if not os.path.exists(self.data_file):
+            if self._migrate_legacy():
+                self._replay_journal()
+                self._clean_old()
+                self.compact()
+                return
+        else:
+            try:
                 with open(self.data_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    self.nodes = data.get('nodes', {})
-                    self.kings = data.get('kings', {})
-                    self.dead = data.get('dead', {})
-                self._clean_old()
-        except Exception:
-            self.nodes = {}
-            self.kings = {}
-            self.dead = {}
-    
+                version = data.get('schema_version', 1)
+                if version > Config.NODE_KING_SCHEMA_VERSION:
+                    logging.error(f"[加载失败] 状态文件版本 {version} 高于当前支持的 "
+                                  f"{Config.NODE_KING_SCHEMA_VERSION}，本次运行不会写回")
+                    self._read_only = True
+                    return
+                self._load_snapshot(data)
+            except Exception as e:
+                backup = f"{self.data_file}.corrupt-{int(time.time())}"
+                logging.error(f"[加载失败] 快照损坏({e})，已保留到 {backup}")
+                try:
+                    os.replace(self.data_file, backup)
+                except OSError:
+                    pass
+                self._nodes, self._kings, self._dead = NodeStatsStore(), {}, NodeStatsStore(keep_sketch=False)
+
+        self._replay_journal()
+        self._clean_old()
+
+    def _apply_entry(self, entry: dict):
+        section, node_id = entry['s'], entry['id']
+        if section == 'kings':
+            if 'd' in entry:
+                self._kings[node_id] = KingRecord.from_dict(entry['d'])
+            else:
+                self._kings.pop(node_id, None)
+            return
+        store = self._nodes if section == 'nodes' else self._dead
+        if 'd' in entry:
+            store.load_dict(node_id, entry['d'])
+        elif node_id in store:
+            store.remove(node_id)
+
+    def _replay_journal(self):
+        """重放日志，只应用带提交标记的完整批次，截掉崩溃留下的半截尾部"""
+        if not os.path.exists(self.journal_file):
+            return
+
+        pending = []
+        committed_offset = 0
+        applied = 0
+        with open(self.journal_file, 'rb') as f:
+            offset = 0
+            for raw in f:
+                offset += len(raw)
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    break
+                if 'commit' in entry:
+                    for item in pending:
+                        self._apply_entry(item)
+                    applied += len(pending)
+                    pending = []
+                    committed_offset = offset
+                else:
+                    pending.append(entry)
+
+        if committed_offset < os.path.getsize(self.journal_file):
+            logging.warning("[加载] 日志尾部存在未提交的写入，已丢弃")
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(committed_offset)
+
+        self._journal_entries = applied
+        if applied:
+            logging.debug(f"[加载] 已重放 {applied} 条日志记录")
+
+    def _entry_for(self, section: str, node_id: str) -> dict:
+        if section == 'kings':
+            king = self._kings.get(node_id)
+            return {'s': section, 'id': node_id, 'd': king.to_dict()} if king else {'s': section, 'id': node_id}
+        store = self._nodes if section == 'nodes' else self._dead
+        if node_id in store:
+            return {'s': section, 'id': node_id, 'd': store.to_dict(node_id)}
+        return {'s': section, 'id': node_id}
+
     def save(self):
-        """保存数据"""
+        """增量保存：只把变更记录作为一个原子批次追加到日志"""
+        if not self._loaded or self._read_only or not self._dirty:
+            return
         try:
-            data = {
-                'nodes': self.nodes,
-                'kings': self.kings,
-                'dead': self.dead,
-                'update_time': datetime.now().isoformat()
-            }
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
+            lines = [json.dumps(self._entry_for(section, node_id), ensure_ascii=False)
+                     for section, node_id in self._dirty]
+            lines.append(json.dumps({'commit': time.time()}))
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_entries += len(self._dirty)
+            self._dirty.clear()
+
+            if self._journal_entries >= Config.NODE_KING_COMPACT_ENTRIES:
+                self.compact()
         except Exception as e:
             logging.error(f"[保存失败] {e}")
-    
+
+    def compact(self):
+        """压缩：原子替换快照后清空日志"""
+        self._ensure_loaded()
+        if self._read_only:
+            return
+        data = {
+            'schema_version': Config.NODE_KING_SCHEMA_VERSION,
+            'nodes': {nid: self._nodes.to_dict(nid) for nid in self._nodes.ids},
+            'kings': {kid: king.to_dict() for kid, king in self._kings.items()},
+            'dead': {nid: self._dead.to_dict(nid) for nid in self._dead.ids},
+            'update_time': datetime.now().isoformat()
+        }
+        temp_path = self.data_file + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.data_file)
+        # 快照已包含全部记录，日志即使未清空重放也是幂等的
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+        self._journal_entries = 0
+        logging.debug(f"[压缩] 快照已更新: {len(self._nodes)}个活跃, {len(self._dead)}个淘汰")
+
     def _clean_old(self):
         """清理30天前的淘汰记录"""
         cutoff = time.time() - 30 * 86400
-        to_remove = [nid for nid, data in self.dead.items() 
-                    if data.get('death_time', 0) < cutoff]
-        
+        dead = self._dead
+        to_remove = [dead.ids[row] for row in range(len(dead)) if dead.death_time[row] < cutoff]
+
         for nid in to_remove:
-            del self.dead[nid]
-        
+            dead.remove(nid)
+            self._mark('dead', nid)
+
         if to_remove:
             logging.debug(f"[清理] 删除{len(to_remove)}条旧记录")
-    
+
     def get_id(self, node_str: str) -> str:
         """生成节点ID"""
         import hashlib
         content = node_str.strip().replace('\n', '').replace('\r', '').replace(' ', '')
         return hashlib.md5(content.encode()).hexdigest()[:12]
-    
-    def _create_data(self, node_str: str) -> dict:
-        """创建节点数据"""
-        return {
-            'node': node_str,
-            'create_time': datetime.now().isoformat(),
-            'tests': 0,
-            'success': 0,
-            'fails': 0,
-            'consecutive_fails': 0,
-            'total_latency': 0,
-            'latency_count': 0,
-            'avg_latency': float('inf'),
-            'best_latency': float('inf'),
-            'worst_latency': 0,
-            'success_rate': 0,
-            'last_success': None,
-            'last_fail': None,
-            'last_active': datetime.now().isoformat(),
-            'age_days': 0,
-            'king_days': 0,
-            'score': 50,
-            'status': 'normal'
-        }
-    
-    def update(self, node_str: str, latency: float, success: bool):
-        """更新节点状态"""
-        node_id = self.get_id(node_str)
+
+    def update(self, node_str: str, latency: float, success: bool, samples: Optional[List[float]] = None,
+               stages: Optional[Dict[str, float]] = None):
+        """更新节点状态；samples 为本轮多次建连的延迟（失败为inf），默认即单次的 latency
         
+        stages 为分层探测各阶段耗时 {'tls': ms, 'ws': ms}，成功的阶段平滑计入对应指标列。
+        """
+        node_id = self.get_id(node_str)
+
         if node_id in self.dead:
             return
-        
-        if node_id not in self.nodes:
-            self.nodes[node_id] = self._create_data(node_str)
-        
-        data = self.nodes[node_id]
-        data['tests'] += 1
-        
+
+        s = self.nodes
+        now = time.time()
+        row = s.row_of(node_id)
+        if row < 0:
+            row = s.add(node_id, node_str, now)
+
+        s.tests[row] += 1
+
         if success:
-            data['success'] += 1
-            data['consecutive_fails'] = 0
-            data['last_success'] = datetime.now().isoformat()
-            
-            if latency < float('inf'):
-                data['total_latency'] += latency
-                data['latency_count'] += 1
-                data['avg_latency'] = data['total_latency'] / data['latency_count']
-                data['best_latency'] = min(data['best_latency'], latency)
-                data['worst_latency'] = max(data['worst_latency'], latency)
+            s.success[row] += 1
+            s.consecutive_fails[row] = 0
+            s.last_success[row] = now
+
+            if latency < INF:
+                s.total_latency[row] += latency
+                s.latency_count[row] += 1
+                if latency < s.best_latency[row]:
+                    s.best_latency[row] = latency
+                if latency > s.worst_latency[row]:
+                    s.worst_latency[row] = latency
         else:
-            data['fails'] += 1
-            data['consecutive_fails'] += 1
-            data['last_fail'] = datetime.now().isoformat()
-        
-        if data['tests'] > 0:
-            data['success_rate'] = data['success'] / data['tests']
-        
-        data['last_active'] = datetime.now().isoformat()
-        create_time = datetime.fromisoformat(data['create_time'])
-        data['age_days'] = (datetime.now() - create_time).days
-        
-        self._check_eliminate(node_id, data)
+            s.fails[row] += 1
+            s.consecutive_fails[row] += 1
+            s.last_fail[row] = now
+
+        s.last_active[row] = now
+        s.age_days[row] = int((now - s.create_time[row]) // 86400)
+        self._record_samples(row, samples if samples else [latency if success else INF])
+        if stages:
+            self._record_stages(row, stages)
+        self._mark('nodes', node_id)
+
+        self._check_eliminate(node_id, row)
+
+    def mark_seen(self, nodes: List[str]):
+        """刷新本轮仍在订阅中但未被测速的已知节点的活跃时间，不计入测速统计
+        
+        提前结束测速时排名靠后的节点测不到，不刷新会被每日检查按"未活跃"误淘汰。
+        """
+        s = self.nodes
+        now = time.time()
+        for node in nodes:
+            node_id = self.get_id(node)
+            row = s.row_of(node_id)
+            if row >= 0:
+                s.last_active[row] = now
+                self._mark('nodes', node_id)
+    
+    def update_many(self, entries: List[tuple]):
+        """批量合并测速结果 [(node, latency, success, samples, stages), ...]，最后统一写日志"""
+        for entry in entries:
+            self.update(*entry)
+        self.save()
     
-    def _check_eliminate(self, node_id: str, data: dict):
+    def record_throughput(self, node_str: str, mbps: float):
+        """记录带宽测试结果(Mbps，失败为0)，多次测量平滑合并"""
+        node_id = self.get_id(node_str)
+        s = self.nodes
+        row = s.row_of(node_id)
+        if row < 0:
+            return
+        alpha = Config.PROBE_EWMA_ALPHA
+        previous = s.throughput_mbps[row]
+        s.throughput_mbps[row] = mbps if not previous else alpha * mbps + (1 - alpha) * previous
+        self._mark('nodes', node_id)
+    
+    def _record_stages(self, row: int, stages: Dict[str, float]):
+        s = self.nodes
+        alpha = Config.PROBE_EWMA_ALPHA
+        for name, column in (('tls', s.tls_latency), ('ws', s.ws_latency)):
+            ms = stages.get(name, INF)
+            if ms < INF:
+                column[row] = ms if not column[row] else alpha * ms + (1 - alpha) * column[row]
+    
+    def _record_samples(self, row: int, samples: List[float]):
+        """把本轮样本计入直方图，并刷新 p95、抖动与丢包率"""
+        s = self.nodes
+        ok = [ms for ms in samples if ms < INF]
+        for ms in ok:
+            s.record_latency(row, ms)
+        s.p95_latency[row] = s.latency_quantile(row, 0.95)
+        
+        alpha = Config.PROBE_EWMA_ALPHA
+        first = s.tests[row] <= 1
+        loss = 1 - len(ok) / len(samples)
+        s.loss_rate[row] = loss if first else alpha * loss + (1 - alpha) * s.loss_rate[row]
+        if len(ok) >= 2:
+            jitter = sum(abs(b - a) for a, b in zip(ok, ok[1:])) / (len(ok) - 1)
+            s.jitter[row] = jitter if first or not s.jitter[row] else alpha * jitter + (1 - alpha) * s.jitter[row]
+    
+    def _check_eliminate(self, node_id: str, row: int):
         """检查是否需要淘汰"""
-        eliminate = False
+        s = self.nodes
         reason = ""
-        
-        if data['consecutive_fails'] >= Config.MAX_CONSECUTIVE_FAILS:
-            eliminate = True
-            reason = f"连续失败{data['consecutive_fails']}次"
-        
-        elif data['tests'] >= 10 and data['success_rate'] < Config.MIN_SUCCESS_RATE:
-            eliminate = True
-            reason = f"成功率{data['success_rate']:.1%}过低"
-        
-        elif data.get('status') == 'king' and data['king_days'] >= Config.KING_MAX_DAYS:
-            eliminate = True
-            reason = f"节点王在位{data['king_days']}天到期"
-        
-        elif self._days_inactive(data['last_active']) >= Config.NODE_INACTIVE_DAYS:
-            eliminate = True
-            reason = f"连续{self._days_inactive(data['last_active'])}天未活跃"
-        
-        if eliminate:
-            self._eliminate(node_id, data, reason)
-    
-    def _days_inactive(self, time_str: str) -> int:
+
+        if s.consecutive_fails[row] >= Config.MAX_CONSECUTIVE_FAILS:
+            reason = f"连续失败{s.consecutive_fails[row]}次"
+
+        elif s.tests[row] >= 10 and s.success_rate(row) < Config.MIN_SUCCESS_RATE:
+            reason = f"成功率{s.success_rate(row):.1%}过低"
+
+        elif s.status[row] == STATUS_KING and s.king_days[row] >= Config.KING_MAX_DAYS:
+            reason = f"节点王在位{s.king_days[row]}天到期"
+
+        else:
+            inactive_days = self._days_inactive(s.last_active[row])
+            if inactive_days >= Config.NODE_INACTIVE_DAYS:
+                reason = f"连续{inactive_days}天未活跃"
+
+        if reason:
+            self._eliminate(node_id, reason)
+
+    def _days_inactive(self, timestamp: float) -> int:
         """计算未活跃天数"""
-        try:
-            if not time_str:
-                return 999
-            last = datetime.fromisoformat(time_str)
-            return (datetime.now() - last).days
-        except:
+        if not timestamp:
             return 999
-    
-    def _eliminate(self, node_id: str, data: dict, reason: str):
+        return int((time.time() - timestamp) // 86400)
+
+    def _eliminate(self, node_id: str, reason: str):
         """淘汰节点"""
-        if data.get('status') == 'king':
+        s = self.nodes
+        row = s.row_of(node_id)
+        now = time.time()
+
+        if s.status[row] == STATUS_KING:
             # 保存到历史节点王记录
-            self.kings[node_id] = {
-                'node': data['node'],
-                'king_days': data['king_days'],
-                'best_latency': data['best_latency'],
-                'avg_latency': data['avg_latency'],
-                'worst_latency': data['worst_latency'],
-                'success_rate': data['success_rate'],
-                'score': data['score'],
-                'end_time': datetime.now().isoformat(),
-                'reason': reason,
-                'last_active': data['last_active']
-            }
-        
-        self.dead[node_id] = {
-            **data,
-            'death_time': time.time(),
-            'death_reason': reason
-        }
-        
-        del self.nodes[node_id]
+            self.kings[node_id] = KingRecord(
+                node=s.links[row],
+                king_days=s.king_days[row],
+                best_latency=s.best_latency[row],
+                avg_latency=s.avg_latency(row),
+                worst_latency=s.worst_latency[row],
+                success_rate=s.success_rate(row),
+                score=s.score[row],
+                end_time=now,
+                reason=reason,
+                last_active=s.last_active[row]
+            )
+            self._mark('kings', node_id)
+
+        dead_row = self.dead.copy_from(s, node_id)
+        self.dead.death_time[dead_row] = now
+        self.dead.reasons[dead_row] = reason
+
+        s.remove(node_id)
+        self._mark('nodes', node_id)
+        self._mark('dead', node_id)
         logging.info(f"[淘汰] {node_id[:8]}: {reason}")
-    
-    def _calculate_score(self, data: dict) -> float:
-        """计算节点得分"""
-        success_score = data['success_rate'] * 40 if data['tests'] > 0 else 0
-        
-        speed_score = 0
-        if data['avg_latency'] < float('inf'):
-            if data['avg_latency'] <= 100:
-                speed_score = 30
-            elif data['avg_latency'] <= 500:
-                speed_score = 30 * (1 - (data['avg_latency'] - 100) / 400)
-        
-        stability_score = 0
-        if (data['best_latency'] < float('inf') and 
-            data['worst_latency'] > 0 and
-            data['worst_latency'] - data['best_latency'] <= 100):
-            stability_score = 20
-        elif (data['best_latency'] < float('inf') and 
-              data['worst_latency'] > 0):
-            latency_range = data['worst_latency'] - data['best_latency']
-            if latency_range <= 300:
-                stability_score = 20 * (1 - (latency_range - 100) / 200)
-        
-        persistence_score = min(10, data['age_days'])
-        penalty = data['consecutive_fails'] * 5
-        score = max(0, success_score + speed_score + stability_score + persistence_score - penalty)
-        data['score'] = score
-        
-        return score
-    
+
+    def order_by_prior(self, nodes: List[str], explore: float = 0.0) -> List[str]:
+        """按历史得分从高到低排列待测节点，新节点按 explore 比例穿插其中，已淘汰节点排在最后"""
+        s = self.nodes
+        scores = BatchScorer.score_all(s)
+        known, fresh, dead = [], [], []
+        for node in nodes:
+            node_id = self.get_id(node)
+            row = s.row_of(node_id)
+            if row >= 0:
+                known.append((scores[row], node))
+            elif node_id in self.dead:
+                dead.append(node)
+            else:
+                fresh.append(node)
+        known.sort(key=lambda item: item[0], reverse=True)
+        
+        if not (0 < explore < 1) or not fresh:
+            return [node for _, node in known] + fresh + dead
+        
+        # 每 step 个已知节点后插入一个新节点
+        step = max(1, round((1 - explore) / explore))
+        fresh_iter = iter(fresh)
+        ordered = []
+        for i, (_, node) in enumerate(known, 1):
+            ordered.append(node)
+            if i % step == 0:
+                new_node = next(fresh_iter, None)
+                if new_node is not None:
+                    ordered.append(new_node)
+        ordered.extend(fresh_iter)
+        return ordered + dead
+    
+    def rank(self, k: int = 1) -> List[tuple]:
+        """批量评分后返回前 k 名候选 [(node_id, score), ...]"""
+        s = self.nodes
+        scores = BatchScorer.score_all(s)
+        return [(s.ids[row], scores[row]) for row in BatchScorer.top_k(s, scores, k)]
+
     def select_king(self) -> Optional[dict]:
         """选择节点王"""
-        if not self.nodes:
+        s = self.nodes
+        if not s:
             return None
-        
-        candidates = []
-        for node_id, data in self.nodes.items():
-            score = self._calculate_score(data)
-            
-            if (score < Config.SCORE_THRESHOLD or 
-                data['consecutive_fails'] > 0 or
-                (data['tests'] >= 5 and data['success_rate'] < 0.8)):
-                continue
-            
-            candidates.append({
-                'node_id': node_id,
-                'data': data,
-                'score': score
-            })
-        
-        if not candidates:
+
+        scores = BatchScorer.score_all(s)
+        top = BatchScorer.top_k(s, scores, 1)
+        if not top:
             return None
-        
-        candidates.sort(key=lambda x: x['score'], reverse=True)
-        winner = candidates[0]
-        node_id = winner['node_id']
-        data = winner['data']
-        
-        old_kings = [nid for nid, ndata in self.nodes.items() 
-                    if ndata.get('status') == 'king']
-        for old_id in old_kings:
-            self.nodes[old_id]['status'] = 'normal'
-            self.nodes[old_id]['king_days'] = 0
-        
-        self.nodes[node_id]['status'] = 'king'
-        self.nodes[node_id]['king_days'] = self.nodes[node_id].get('king_days', 0) + 1
-        
-        self.kings[node_id] = {
-            'node': data['node'],
-            'score': winner['score'],
-            'avg_latency': data['avg_latency'],
-            'success_rate': data['success_rate'],
-            'age_days': data['age_days'],
-            'start_time': datetime.now().isoformat(),
-            'best_latency': data['best_latency'],
-            'worst_latency': data['worst_latency'],
-            'last_active': datetime.now().isoformat()
-        }
-        
-        logging.info(f"[节点王] {node_id[:8]} 得分:{winner['score']:.1f} 延迟:{data['avg_latency']:.1f}ms")
-        
+
+        best_row = top[0]
+        best_score = scores[best_row]
+        node_id = s.ids[best_row]
+
+        for row in range(len(s)):
+            if s.status[row] == STATUS_KING:
+                s.status[row] = STATUS_NORMAL
+                s.king_days[row] = 0
+                self._mark('nodes', s.ids[row])
+
+        s.status[best_row] = STATUS_KING
+        s.king_days[best_row] += 1
+        self._mark('nodes', node_id)
+        self._mark('kings', node_id)
+
+        now = time.time()
+        self.kings[node_id] = KingRecord(
+            node=s.links[best_row],
+            score=best_score,
+            avg_latency=s.avg_latency(best_row),
+            success_rate=s.success_rate(best_row),
+            age_days=s.age_days[best_row],
+            start_time=now,
+            best_latency=s.best_latency[best_row],
+            worst_latency=s.worst_latency[best_row],
+            last_active=now
+        )
+
+        logging.info(f"[节点王] {node_id[:8]} 得分:{best_score:.1f} 延迟:{s.avg_latency(best_row):.1f}ms "
+                     f"p50:{s.latency_quantile(best_row, 0.5):.1f}ms p95:{s.p95_latency[best_row]:.1f}ms "
+                     f"抖动:{s.jitter[best_row]:.1f}ms 丢包:{s.loss_rate[best_row]:.0%} "
+                     f"TLS:{s.tls_latency[best_row]:.1f}ms WS:{s.ws_latency[best_row]:.1f}ms "
+                     f"吞吐:{s.throughput_mbps[best_row]:.1f}Mbps")
+
         return {
-            'node': data['node'],
+            'node': s.links[best_row],
             'node_id': node_id,
-            'score': winner['score'],
-            'latency': data['avg_latency']
+            'score': best_score,
+            'latency': s.avg_latency(best_row)
         }
-    
+
     def get_king(self) -> Optional[dict]:
         """获取当前节点王"""
-        for node_id, data in self.nodes.items():
-            if data.get('status') == 'king':
-                return {
-                    'node': data['node'],
-                    'node_id': node_id,
-                    'score': data['score'],
-                    'latency': data['avg_latency'],
-                    'king_days': data['king_days']
-                }
-        return None
-    
+        s = self.nodes
+        try:
+            row = s.status.index(STATUS_KING)
+        except ValueError:
+            return None
+        return {
+            'node': s.links[row],
+            'node_id': s.ids[row],
+            'score': s.score[row],
+            'latency': s.avg_latency(row),
+            'king_days': s.king_days[row]
+        }
+
     def daily_check(self):
         """每日检查"""
         logging.info("[每日检查] 开始执行")
-        
+
+        s = self.nodes
         to_eliminate = []
-        now = datetime.now()
-        
-        for node_id, data in self.nodes.items():
-            last_active = data.get('last_active')
-            if last_active:
-                try:
-                    last = datetime.fromisoformat(last_active)
-                    inactive_days = (now - last).days
-                    
-                    if inactive_days >= Config.NODE_INACTIVE_DAYS:
-                        to_eliminate.append((node_id, data, f"连续{inactive_days}天未活跃"))
-                except:
-                    pass
-            
-            if data.get('status') == 'king':
-                data['king_days'] = data.get('king_days', 0) + 1
-        
-        for node_id, data, reason in to_eliminate:
-            self._eliminate(node_id, data, reason)
-        
+
+        for row in range(len(s)):
+            if s.last_active[row]:
+                inactive_days = self._days_inactive(s.last_active[row])
+                if inactive_days >= Config.NODE_INACTIVE_DAYS:
+                    to_eliminate.append((s.ids[row], f"连续{inactive_days}天未活跃"))
+
+            if s.status[row] == STATUS_KING:
+                s.king_days[row] += 1
+                self._mark('nodes', s.ids[row])
+
+        for node_id, reason in to_eliminate:
+            self._eliminate(node_id, reason)
+
         self.save()
-        
-        king_count = len([n for n in self.nodes.values() if n.get('status') == 'king'])
-        total = len(self.nodes)
+
+        king_count = s.status.count(STATUS_KING)
+        total = len(s)
         dead = len(self.dead)
-        
+
         logging.info(f"[每日检查] 完成: {king_count}个节点王, {total}个活跃节点, {dead}个淘汰节点")
-    
+
     def stats(self) -> dict:
         """获取统计信息"""
-        kings = [n for n in self.nodes.values() if n.get('status') == 'king']
-        
-        avg_latency = float('inf')
+        s = self.nodes
+
+        avg_latency = INF
         avg_success = 0
-        
-        if self.nodes:
-            latencies = [n['avg_latency'] for n in self.nodes.values() 
-                        if n['avg_latency'] < float('inf')]
-            successes = [n['success_rate'] for n in self.nodes.values()]
-            
+
+        if s:
+            latencies = [lat for lat in map(s.avg_latency, range(len(s))) if lat < INF]
             if latencies:
                 avg_latency = sum(latencies) / len(latencies)
-            if successes:
-                avg_success = sum(successes) / len(successes)
-        
+            avg_success = sum(map(s.success_rate, range(len(s)))) / len(s)
+
         return {
-            'active_nodes': len(self.nodes),
-            'kings': len(kings),
+            'active_nodes': len(s),
+            'kings': s.status.count(STATUS_KING),
             'dead_nodes': len(self.dead),
             'avg_latency': avg_latency,
             'avg_success': avg_success,
-            'oldest_node': max([n['age_days'] for n in self.nodes.values()], default=0)
+            'oldest_node': max(s.age_days, default=0)
         }
-    
-    def _is_king_still_valid(self, king_id: str, king_data: dict) -> bool:
+
+    def _is_king_still_valid(self, king_id: str, king: KingRecord) -> bool:
         """检查历史节点王是否仍然有效 - 新增方法"""
         if not Config.HISTORY_KING_ENABLED:
             return False
-        
-        try:
-            # 1. 检查节点字符串是否有效
-            node_str = king_data.get('node', '')
-            if not node_str:
-                return False
-            
-            # 2. 检查是否已被淘汰
-            if king_id in self.dead:
-                return False
-            
-            # 3. 检查得分阈值
-            score = king_data.get('score', 0)
-            if score < Config.HISTORY_KING_MIN_SCORE:
-                return False
-            
-            # 4. 检查最近是否活跃（避免过时的节点王）
-            last_active = king_data.get('last_active')
-            if last_active:
-                try:
-                    last_time = datetime.fromisoformat(last_active)
-                    inactive_days = (datetime.now() - last_time).days
-                    if inactive_days > Config.MAX_KING_INACTIVE_DAYS:
-                        return False
-                except:
-                    return False
-            else:
-                return False
-            
-            # 5. 检查延迟是否仍然优秀
-            latency = king_data.get('avg_latency', float('inf'))
-            if latency > Config.MAX_TEST_LATENCY * 0.7:  # 历史节点王要求更严格
-                return False
-            
-            return True
-        except Exception as e:
-            logging.debug(f"[历史节点王检查] {king_id[:8]} 检查失败: {e}")
+
+        # 1. 检查节点字符串是否有效
+        if not king.node:
             return False
-    
+
+        # 2. 检查是否已被淘汰
+        if king_id in self.dead:
+            return False
+
+        # 3. 检查得分阈值
+        if king.score < Config.HISTORY_KING_MIN_SCORE:
+            return False
+
+        # 4. 检查最近是否活跃（避免过时的节点王）
+        if not king.last_active or self._days_inactive(king.last_active) > Config.MAX_KING_INACTIVE_DAYS:
+            return False
+
+        # 5. 检查延迟是否仍然优秀
+        if king.avg_latency > Config.MAX_TEST_LATENCY * 0.7:  # 历史节点王要求更严格
+            return False
+
+        return True
+
     def get_best_king_overall(self) -> Optional[dict]:
         """获取所有节点王中性能最好的（包括历史和当前）- 新增方法"""
         if not Config.HISTORY_KING_ENABLED:
             return self.get_king()
-        
+
         best_king = None
         best_score = -1
-        
+
         # 1. 检查当前节点王
         current_king = self.get_king()
         if current_king:
             best_king = current_king
             best_score = current_king['score']
             logging.debug(f"[历史节点王对比] 当前节点王: {current_king['node_id'][:8]} 得分:{current_king['score']:.1f}")
-        
+
         # 2. 检查历史节点王
-        for king_id, king_data in self.kings.items():
+        for king_id, king in self.kings.items():
             # 检查历史节点王是否仍然有效
-            if not self._is_king_still_valid(king_id, king_data):
+            if not self._is_king_still_valid(king_id, king):
                 continue
-            
-            score = king_data.get('score', 0)
-            latency = king_data.get('avg_latency', float('inf'))
-            
+
+            latency = king.avg_latency
+
             # 对历史节点王给予额外加分（因为它们曾经是王者）
-            if Config.ENABLE_KING_REVIVAL:
-                score = score * Config.KING_REVIVAL_SCORE_BOOST
-            
             # 综合评分：得分 + (100 - 延迟/10)
-            latency_bonus = max(0, 100 - (latency / 10))
-            composite_score = score + latency_bonus * 0.3
-            
-            logging.debug(f"[历史节点王对比] 历史节点王: {king_id[:8]} 原始得分:{king_data.get('score', 0):.1f} "
+            score, composite_score = BatchScorer.king_composite(king)
+
+            logging.debug(f"[历史节点王对比] 历史节点王: {king_id[:8]} 原始得分:{king.score:.1f} "
                          f"加成后:{score:.1f} 延迟:{latency:.1f}ms 综合得分:{composite_score:.1f}")
-            
+
             if composite_score > best_score:
                 best_score = composite_score
                 best_king = {
-                    'node': king_data['node'],
+                    'node': king.node,
                     'node_id': king_id,
-                    'score': king_data.get('score', 0),
+                    'score': king.score,
                     'latency': latency,
                     'is_history': True,
-                    'king_data': king_data,
+                    'king_data': king,
                     'composite_score': composite_score
                 }
-        
+
         # 3. 如果历史节点王更好，且允许重新激活
         if best_king and best_king.get('is_history') and Config.ENABLE_KING_REVIVAL:
             logging.info(f"[🏆] 历史节点王 {best_king['node_id'][:8]} 比当前节点王更优秀 "
                         f"(得分:{best_king['composite_score']:.1f} vs {current_king['score'] if current_king else 0:.1f})")
-            
+
             # 重新激活历史节点王
             self._revive_history_king(best_king['node_id'], best_king['king_data'])
-            
+
             # 更新返回信息
             best_king['is_revived'] = True
-        
+
         return best_king
-    
-    def _revive_history_king(self, king_id: str, king_data: dict):
+
+    def _revive_history_king(self, king_id: str, king: KingRecord):
         """重新激活历史节点王 - 新增方法"""
         try:
-            node_str = king_data.get('node', '')
-            if not node_str:
+            if not king.node:
                 return
-            
+
             # 1. 如果历史节点王在淘汰记录中，移除它
             if king_id in self.dead:
                 logging.info(f"[🔄] 从淘汰记录中恢复历史节点王: {king_id[:8]}")
-                del self.dead[king_id]
-            
+                self.dead.remove(king_id)
+                self._mark('dead', king_id)
+
             # 2. 添加到活跃节点中
-            self.nodes[king_id] = {
-                **self._create_data(node_str),
-                'status': 'king',
-                'score': king_data.get('score', 0),
-                'avg_latency': king_data.get('avg_latency', float('inf')),
-                'best_latency': king_data.get('best_latency', king_data.get('avg_latency', float('inf'))),
-                'worst_latency': king_data.get('worst_latency', king_data.get('avg_latency', float('inf'))),
-                'success_rate': king_data.get('success_rate', 0),
-                'total_latency': king_data.get('avg_latency', 100) * 10,  # 估算总延迟
-                'latency_count': 10,
-                'king_days': 1,  # 重新开始计算在位天数
-                'age_days': 0,   # 重新计算节点年龄
-                'create_time': datetime.now().isoformat(),
-                'last_active': datetime.now().isoformat(),
-                'tests': 10,     # 给予一定的测试次数
-                'success': int(king_data.get('success_rate', 0.8) * 10),
-                'fails': int((1 - king_data.get('success_rate', 0.8)) * 10)
-            }
-            
-            # 3. 更新历史记录
-            self.kings[king_id]['revived'] = True
-            self.kings[king_id]['revive_time'] = datetime.now().isoformat()
-            self.kings[king_id]['revive_count'] = self.kings[king_id].get('revive_count', 0) + 1
-            
-            logging.info(f"[🔄] 历史节点王 {king_id[:8]} 已重新激活，延迟:{king_data.get('avg_latency', 'N/A')}ms "
-                        f"成功率:{king_data.get('success_rate', 0):.1%}")
-            
+            s = self.nodes
+            now = time.time()
+            if king_id in s:
+                s.remove(king_id)
+            row = s.add(king_id, king.node, now)
+            s.status[row] = STATUS_KING
+            s.score[row] = king.score
+            s.best_latency[row] = king.best_latency
+            s.worst_latency[row] = king.worst_latency
+            s.total_latency[row] = (king.avg_latency if king.avg_latency < INF else 100) * 10  # 估算总延迟
+            s.latency_count[row] = 10
+            s.king_days[row] = 1   # 重新开始计算在位天数
+            s.tests[row] = 10      # 给予一定的测试次数
+            s.success[row] = round(king.success_rate * 10)
+            s.fails[row] = 10 - s.success[row]
+
+            # 3. 更新历史记录
+            king.revived = True
+            king.revive_time = now
+            king.revive_count += 1
+            self._mark('nodes', king_id)
+            self._mark('kings', king_id)
+
+            logging.info(f"[🔄] 历史节点王 {king_id[:8]} 已重新激活，延迟:{king.avg_latency}ms "
+                        f"成功率:{king.success_rate:.1%}")
+
             # 4. 保存更改
             self.save()
-            
+
         except Exception as e:
             logging.error(f"[❌] 重新激活历史节点王失败: {e}")
 
@@ -715,6 +1693,27 @@ def smart_retry(max_retries=Config.RETRY_ATTEMPTS):
         return wrapper
     return decorator
 
+def smart_retry_async(max_retries=Config.RETRY_ATTEMPTS):
+    """smart_retry 的协程版本，等待时不阻塞事件循环"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_retries):
+                try:
+                    if Config.ENABLE_STEALTH and attempt > 0:
+                        sleep_time = (2 ** attempt) + random.uniform(0, 1)
+                        logging.info(f"[🔄] 第{attempt+1}次重试，等待 {sleep_time:.2f} 秒...")
+                        await asyncio.sleep(sleep_time)
+                    
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    if attempt == max_retries - 1:
+                        logging.error(f"[❌] 所有 {max_retries} 次重试都失败了: {e}")
+                        raise
+                    logging.warning(f"[⚠️] 第 {attempt+1} 次尝试失败: {e}，准备重试...")
+        return wrapper
+    return decorator
+
 async def fetch_page_async(session, url, headers=None):
     """异步获取页面内容"""
     if headers is None:
@@ -865,9 +1864,10 @@ def safe_file_operations(file_path, operation="write", content=None):
         if operation == "write" and content is not None:
             with open(temp_path, "w", encoding="utf-8") as f:
                 f.write(content)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            os.rename(temp_path, file_path)
+                f.flush()
+                os.fsync(f.fileno())
+            # 原子替换，写入中途失败也不会留下半个文件
+            os.replace(temp_path, file_path)
             return True
             
         elif operation == "read":
@@ -1021,32 +2021,129 @@ def restart_v2rayn() -> bool:
     terminate_v2rayn()
     return start_v2rayn()
 
+class V2rayNConfigTransaction:
+    """v2rayN config.json 事务：只定位和读取一次，汇总分组替换、默认节点和订阅修改，最后一次性原子写回"""
+    
+    def __init__(self, config_path: str, config_data: dict):
+        self.config_path = config_path
+        self.data = config_data
+        self.data.setdefault("servers", [])
+        self.dirty = False
+        self._positions = {}
+        self._reindex()
+    
+    @classmethod
+    def open(cls, v2rayn_dir: Optional[str] = None) -> Optional['V2rayNConfigTransaction']:
+        """定位并加载配置文件，找不到或无法解析时返回None"""
+        config_path = get_config_path(v2rayn_dir or find_v2rayn_installation())
+        if not config_path or not os.path.exists(config_path):
+            logging.info(f"[ℹ️] 找不到 config.json：{config_path}")
+            return None
+        try:
+            with open(config_path, "r", encoding="utf-8") as f:
+                return cls(config_path, json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"[❌] 解析配置文件失败: {str(e)}")
+            return None
+    
+    def _reindex(self):
+        """(分组, 地址, 端口) 与服务器ID -> 服务器下标，重复时保留第一个"""
+        self._positions = {}
+        self._ids = {}
+        for i, server in enumerate(self.data["servers"]):
+            self._positions.setdefault((server.get("group"), server.get("address"), server.get("port")), i)
+            self._ids.setdefault(server.get("id"), i)
+    
+    def find_server(self, group_name: str, address: str, port: int) -> int:
+        return self._positions.get((group_name, address, port), -1)
+    
+    def _selected_id(self) -> Optional[str]:
+        index = self.data.get("index")
+        servers = self.data["servers"]
+        if isinstance(index, int) and 0 <= index < len(servers):
+            return servers[index].get("id")
+        return None
+    
+    def sync_group(self, group_name: str, servers: List[dict]) -> tuple:
+        """按稳定ID比较分组内容，只增删改有变化的服务器，返回 (新增, 移除, 更新) 数量
+        
+        旧版带随机后缀的同名分组(group_name_xxxx)一并收敛；当前选中的服务器在重排后仍保持选中。
+        """
+        incoming = {}
+        for server in servers:
+            incoming.setdefault(server["id"], server)
+        
+        selected = self._selected_id()
+        merged, seen = [], set()
+        removed = updated = 0
+        for server in self.data["servers"]:
+            group = server.get("group") or ""
+            if group != group_name and not group.startswith(group_name + "_"):
+                merged.append(server)
+                continue
+            server_id = server.get("id")
+            new = incoming.get(server_id)
+            if new is None or server_id in seen:
+                removed += 1
+                continue
+            seen.add(server_id)
+            if new != server:
+                updated += 1
+            merged.append(new)
+        added = [server for server_id, server in incoming.items() if server_id not in seen]
+        merged.extend(added)
+        
+        if added or removed or updated:
+            self.data["servers"] = merged
+            self._reindex()
+            index = self._ids.get(selected) if selected is not None else None
+            if index is not None and index != self.data.get("index"):
+                self.data["index"] = index
+            elif isinstance(self.data.get("index"), int) and self.data["index"] >= len(merged):
+                self.data["index"] = max(0, len(merged) - 1)
+            self.dirty = True
+        return len(added), removed, updated
+    
+    def set_default(self, index: int):
+        if self.data.get("index") != index:
+            self.data["index"] = index
+            self.dirty = True
+    
+    def set_subscription(self, url: str, remarks: str):
+        if Config.ENABLE_STEALTH:
+            self.data["lastUpdateTime"] = int(time.time() * 1000)
+            self.data["autoUpdateCore"] = False
+            self.data["logLevel"] = "none"
+            self.data["guiType"] = 0
+        self.data["subscriptions"] = [{"url": url, "enabled": True, "remarks": remarks}]
+        self.dirty = True
+    
+    def commit(self) -> bool:
+        """有修改时一次性原子写回"""
+        if not self.dirty:
+            return True
+        content = json.dumps(self.data, indent=4, ensure_ascii=False)
+        if not safe_file_operations(self.config_path, "write", content):
+            return False
+        self.dirty = False
+        logging.info(f"[💾] 配置已写回: {self.config_path}")
+        return True
+
 @smart_retry(max_retries=3)
-def update_v2rayn_subscription(new_url: str) -> bool:
-    """替换 v2rayN config.json 的订阅链接为新的 URL"""
+def update_v2rayn_subscription(new_url: str, tx: Optional[V2rayNConfigTransaction] = None) -> bool:
+    """替换 v2rayN config.json 的订阅链接为新的 URL；传入事务时只记录修改，由调用方统一写回"""
     fake_logging()
-    config_path = get_config_path()
-    if not config_path or not os.path.exists(config_path):
-        logging.error(f"[❌] 找不到 config.json：{config_path}")
-        return False
+    own = tx is None
+    if own:
+        tx = V2rayNConfigTransaction.open()
+        if tx is None:
+            return False
     
     try:
-        time.sleep(random.uniform(0.1, 0.3))
-        with open(config_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
-        
-        if Config.ENABLE_STEALTH:
-            config_data["lastUpdateTime"] = int(time.time() * 1000)
-            config_data["autoUpdateCore"] = False
-            config_data["logLevel"] = "none"
-            config_data["guiType"] = 0
-        
         subscription_remarks = "Auto Imported" if not Config.ENABLE_STEALTH else generate_random_string(8)
-        config_data["subscriptions"] = [{"url": new_url, "enabled": True, "remarks": subscription_remarks}]
-        
-        time.sleep(random.uniform(0.1, 0.3))
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, indent=4, ensure_ascii=False)
+        tx.set_subscription(new_url, subscription_remarks)
+        if own and not tx.commit():
+            return False
         
         masked_url = new_url[:10] + "..." + new_url[-10:] if len(new_url) > 20 else new_url
         logging.info(f"[✅] 成功替换订阅链接: {masked_url}")
@@ -1056,213 +2153,354 @@ def update_v2rayn_subscription(new_url: str) -> bool:
         logging.error(f"[❌] 更新订阅失败: {type(e).__name__}: {e}")
         raise
 
-def set_best_node_as_default(best_node: str, group_name: str = "米贝") -> bool:
-    """将最优节点设置为v2rayN的默认节点"""
+def set_best_node_as_default(best_node: str, group_name: str = "米贝",
+                             tx: Optional[V2rayNConfigTransaction] = None) -> bool:
+    """将最优节点设置为v2rayN的默认节点；传入事务时只记录修改，由调用方统一写回"""
     fake_logging()
-    
-    v2rayn_dir = find_v2rayn_installation()
-    if not v2rayn_dir:
-        logging.info("[ℹ️] 找不到v2rayN安装目录，跳过设置默认节点步骤")
-        return True
-    
-    config_path = get_config_path(v2rayn_dir)
-    if not config_path or not os.path.exists(config_path):
-        logging.info("[ℹ️] 找不到config.json文件，跳过设置默认节点步骤")
-        return True
+    own = tx is None
+    if own:
+        tx = V2rayNConfigTransaction.open()
+        if tx is None:
+            logging.info("[ℹ️] 找不到config.json文件，跳过设置默认节点步骤")
+            return True
     
     try:
-        with open(config_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
-        
-        if "servers" not in config_data:
-            config_data["servers"] = []
-        
-        best_node_address = None
-        best_node_port = None
-        
-        if best_node and best_node.startswith("vmess://"):
-            try:
-                vmess_content = best_node[8:]
-                padding = len(vmess_content) % 4
-                if padding:
-                    vmess_content += '=' * (4 - padding)
-                vmess_json = json.loads(base64.b64decode(vmess_content).decode('utf-8'))
-                best_node_address = vmess_json.get("add", "")
-                best_node_port = int(vmess_json.get("port", 443))
-            except Exception as e:
-                logging.error(f"[❌] 解析最优节点失败: {str(e)}")
-                return False
-        
-        best_node_index = -1
-        for i, server in enumerate(config_data["servers"]):
-            if server.get("group") == group_name and server.get("address") == best_node_address and server.get("port") == best_node_port:
-                best_node_index = i
-                break
+        parsed = parse_node(best_node)
+        if parsed is None:
+            logging.error(f"[❌] 解析最优节点失败: {str(best_node)[:30]}...")
+            return False
         
+        best_node_index = tx.find_server(group_name, parsed.host, parsed.port)
         if best_node_index != -1:
-            config_data["index"] = best_node_index
+            tx.set_default(best_node_index)
             logging.info(f"[🏆] 已将最优节点设置为默认节点（索引: {best_node_index}）")
-            
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(config_data, f, indent=4, ensure_ascii=False)
-            
-            return True
+            return tx.commit() if own else True
         else:
             logging.warning("[⚠️] 在配置文件中未找到最优节点，无法设置为默认节点")
             return False
             
-    except json.JSONDecodeError as e:
-        logging.error(f"[❌] 解析配置文件失败: {str(e)}")
-        return False
     except Exception as e:
         logging.error(f"[❌] 设置默认节点失败: {str(e)}")
         return False
 
-def add_nodes_to_mibei_group(best_node: str = None) -> bool:
-    """在v2rayN中创建名为"米贝"的分组，并将节点粘贴到该分组中"""
+def get_export_group_name() -> str:
+    """导出分组名；隐身模式的后缀由安装目录派生，每次运行保持不变"""
+    if not Config.ENABLE_STEALTH:
+        return "米贝"
+    return f"米贝_{hashlib.md5(Config.BASE_DIR.encode()).hexdigest()[:4]}"
+
+def build_export_servers(node_lines: List[str], group_name: str,
+                         latencies: Optional[Dict[str, float]] = None) -> List[dict]:
+    """把节点批量转换为v2rayN服务器条目，延迟复用测速阶段的结果（latencies 或测速结果缓存），不再逐个连接"""
+    check_latency = Config.ENABLE_SPEED_TEST and not Config.IGNORE_LATENCY_TEST
+    index = get_freshness_index() if check_latency and latencies is None else None
+    servers = []
+    too_slow = unsupported = 0
+    for line in node_lines:
+        line = line.strip()
+        if not line:
+            continue
+            
+        if check_latency:
+            latency = latencies.get(line) if latencies is not None else (
+                index.lookup(line) if index else None)
+            # 测速阶段已淘汰不可用节点，没有记录的节点直接保留
+            if latency is not None and latency >= Config.MAX_LATENCY:
+                too_slow += 1
+                continue
+        
+        try:
+            node = parse_node(line)
+            server = build_v2rayn_server(node, group_name) if node else None
+        except (TypeError, ValueError) as e:
+            logging.warning(f"[⚠️] 解析节点失败: {line[:30]}... {str(e)}")
+            continue
+        if server is None:
+            unsupported += 1
+            continue
+        servers.append(server)
+    
+    if unsupported:
+        logging.info(f"[ℹ️] 跳过 {unsupported} 个无法识别或v2rayN不支持的节点")
+    if too_slow:
+        logging.info(f"[🐢] 跳过 {too_slow} 个延迟超过 {Config.MAX_LATENCY}ms 的节点")
+    return servers
+
+def add_nodes_to_mibei_group(best_node: str = None, tx: Optional[V2rayNConfigTransaction] = None,
+                             latencies: Optional[Dict[str, float]] = None) -> bool:
+    """在v2rayN中创建名为"米贝"的分组，并将节点粘贴到该分组中；传入事务时只记录修改，由调用方统一写回"""
     fake_logging()
     
-    v2rayn_dir = find_v2rayn_installation()
-    if not v2rayn_dir:
-        logging.info("[ℹ️] 找不到v2rayN安装目录，跳过节点导入步骤")
-        return True
-    
-    config_path = get_config_path(v2rayn_dir)
-    if not config_path or not os.path.exists(config_path):
-        logging.info("[ℹ️] 找不到config.json文件，跳过节点导入步骤")
-        return True
-    
     nodes_path = get_nodes_path()
     if not os.path.exists(nodes_path):
         logging.error(f"[❌] 找不到节点文件: {nodes_path}")
         return False
     
+    own = tx is None
+    if own:
+        tx = V2rayNConfigTransaction.open()
+        if tx is None:
+            logging.info("[ℹ️] 找不到config.json文件，跳过节点导入步骤")
+            return True
+    
     try:
-        with open(config_path, "r", encoding="utf-8") as f:
-            config_data = json.load(f)
-        
         with open(nodes_path, "r", encoding="utf-8") as f:
             node_lines = f.readlines()
         
         if Config.ENABLE_NODE_FILTERING:
             logging.info("[🧠] 正在筛选高质量节点...")
-            if len(node_lines) > Config.MAX_NODES:
-                node_lines = random.sample(node_lines, Config.MAX_NODES)
+            # 开启节点王时节点文件已按得分排序（见 crown_king），取前 MAX_NODES 个
+            node_lines = node_lines[:Config.MAX_NODES]
             logging.info(f"[✅] 已筛选出 {len(node_lines)} 个节点")
         
-        if "servers" not in config_data:
-            config_data["servers"] = []
-        
-        group_name = "米贝" if not Config.ENABLE_STEALTH else f"米贝_{generate_random_string(4)}"
-        
-        old_nodes = [server for server in config_data["servers"] if server.get("group") == "米贝"]
-        config_data["servers"] = [server for server in config_data["servers"] if server.get("group") != "米贝"]
+        group_name = get_export_group_name()
         
-        logging.info(f"[🧹] 已清除 {len(old_nodes)} 个旧节点")
-        
-        new_server_count = 0
-        for line in node_lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            time.sleep(random.uniform(0.01, 0.05))
-            
-            try:
-                if line.startswith("vmess://"):
-                    vmess_content = line[8:]
-                    padding = len(vmess_content) % 4
-                    if padding:
-                        vmess_content += '=' * (4 - padding)
-                    
-                    vmess_json = json.loads(base64.b64decode(vmess_content).decode('utf-8'))
-                    
-                    server = {
-                        "id": str(random.randint(100000, 999999)),
-                        "remarks": vmess_json.get("ps", f"节点_{generate_random_string(6)}"),
-                        "group": group_name,
-                        "type": "VMess",
-                        "address": vmess_json.get("add", ""),
-                        "port": int(vmess_json.get("port", 443)),
-                        "uuid": vmess_json.get("id", ""),
-                        "alterId": int(vmess_json.get("aid", 0)),
-                        "security": vmess_json.get("scy", "auto"),
-                        "network": vmess_json.get("net", "tcp"),
-                        "headerType": vmess_json.get("type", "none"),
-                        "requestHost": vmess_json.get("host", ""),
-                        "path": vmess_json.get("path", ""),
-                        "streamSecurity": vmess_json.get("tls", ""),
-                        "sni": vmess_json.get("sni", ""),
-                        "fingerprint": vmess_json.get("fp", ""),
-                        "allowInsecure": True
-                    }
-                    
-                    if Config.ENABLE_SPEED_TEST and vmess_json.get("add") and vmess_json.get("port"):
-                        latency = test_latency(vmess_json.get("add"), int(vmess_json.get("port", 443)))
-                        if latency < Config.MAX_LATENCY or Config.IGNORE_LATENCY_TEST:
-                            config_data["servers"].append(server)
-                            new_server_count += 1
-                            if latency < float('inf'):
-                                logging.debug(f"[🚀] 添加高速节点: {latency:.2f}ms")
-                    else:
-                        config_data["servers"].append(server)
-                        new_server_count += 1
-                
-                elif line.startswith("trojan://"):
-                    server = {
-                        "id": str(random.randint(100000, 999999)),
-                        "remarks": f"Trojan_{generate_random_string(6)}",
-                        "group": group_name,
-                        "type": "Trojan",
-                        "allowInsecure": True
-                    }
-                    config_data["servers"].append(server)
-                    new_server_count += 1
-                    
-                elif line.startswith("ss://"):
-                    server = {
-                        "id": str(random.randint(100000, 999999)),
-                        "remarks": f"SS_{generate_random_string(6)}",
-                        "group": group_name,
-                        "type": "Shadowsocks",
-                    }
-                    config_data["servers"].append(server)
-                    new_server_count += 1
-            except Exception as e:
-                logging.warning(f"[⚠️] 解析节点失败: {line[:30]}... {str(e)}")
-                continue
-        
-        time.sleep(random.uniform(0.2, 0.5))
-        
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(config_data, f, indent=4, ensure_ascii=False)
-        
-        logging.info(f"[✅] 成功将{new_server_count}个节点添加到 {group_name} 分组")
+        new_servers = build_export_servers(node_lines, group_name, latencies)
+        added, removed, updated = tx.sync_group("米贝", new_servers)
+        unchanged = len(new_servers) - added - updated
+        logging.info(f"[🔁] {group_name} 分组同步: 新增 {added} 个，移除 {removed} 个，"
+                     f"更新 {updated} 个，未变 {unchanged} 个")
         
         if best_node:
             logging.info("[🏆] 正在设置最优节点为默认节点...")
-            if set_best_node_as_default(best_node, group_name):
+            if set_best_node_as_default(best_node, group_name, tx):
                 logging.info("[✅] 已成功将最优节点设置为默认节点")
             else:
                 logging.warning("[⚠️] 设置最优节点为默认节点失败")
         
-        return True
+        return tx.commit() if own else True
         
-    except json.JSONDecodeError as e:
-        logging.error(f"[❌] 解析配置文件失败: {str(e)}")
-        return False
     except Exception as e:
         logging.error(f"[❌] 添加节点到米贝分组失败: {type(e).__name__}: {e}")
         return False
 
+# === DNS解析缓存 ===
+class DNSCache:
+    """带TTL与LRU淘汰的DNS缓存，解析耗时单独记录，测速只计算连接IP的时间"""
+    
+    def __init__(self, ttl: float = 300, negative_ttl: float = 30, max_size: int = 4096):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # host -> (ip, expires, dns_ms)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _literal(host: str) -> Optional[str]:
+        try:
+            return str(ipaddress.ip_address(host.strip('[]')))
+        except ValueError:
+            return None
+    
+    def _lookup(self, host: str) -> Optional[tuple]:
+        entry = self._entries.get(host)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self._entries[host]
+            return None
+        self._entries.move_to_end(host)
+        self.hits += 1
+        return entry
+    
+    def _store(self, host: str, ip: Optional[str], dns_ms: float) -> tuple:
+        ttl = self.ttl if ip else self.negative_ttl
+        entry = (ip, time.monotonic() + ttl, dns_ms)
+        self._entries[host] = entry
+        self._entries.move_to_end(host)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+    
+    def dns_ms(self, host: str) -> float:
+        """该主机最近一次解析耗时(毫秒)，未解析过返回0"""
+        entry = self._entries.get(host)
+        return entry[2] if entry else 0.0
+    
+    def resolve_sync(self, host: str) -> Optional[str]:
+        """同步解析，供线程版测速使用"""
+        literal = self._literal(host)
+        if literal:
+            return literal
+        entry = self._lookup(host)
+        if entry is not None:
+            return entry[0]
+        self.misses += 1
+        start = time.perf_counter()
+        try:
+            ip = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0][4][0]
+        except (OSError, UnicodeError):
+            ip = None
+        return self._store(host, ip, (time.perf_counter() - start) * 1000)[0]
+    
+    async def resolve(self, host: str) -> Optional[str]:
+        """异步解析，同一主机的并发请求只发起一次查询"""
+        literal = self._literal(host)
+        if literal:
+            return literal
+        entry = self._lookup(host)
+        if entry is not None:
+            return entry[0]
+        
+        pending = self._inflight.get(host)
+        if pending is not None:
+            self.hits += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # 发起查询的协程被取消，由当前协程重新解析
+                return await self.resolve(host)
+        
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._inflight[host] = future
+        start = time.perf_counter()
+        try:
+            try:
+                infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+                ip = infos[0][4][0]
+            except (OSError, UnicodeError):
+                ip = None
+            self._store(host, ip, (time.perf_counter() - start) * 1000)
+            future.set_result(ip)
+        finally:
+            del self._inflight[host]
+            if not future.done():
+                # 被取消或意外异常时也要唤醒等待同一主机的协程
+                future.cancel()
+        return ip
+    
+    async def resolve_many(self, hosts, concurrency: int = 64) -> Dict[str, Optional[str]]:
+        """并发批量解析一组主机"""
+        unique = list(dict.fromkeys(hosts))
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def one(host):
+            async with semaphore:
+                return host, await self.resolve(host)
+        
+        return dict(await asyncio.gather(*(one(host) for host in unique)))
+
+
+_dns_cache = None
+
+def get_dns_cache() -> DNSCache:
+    """获取全局DNS缓存实例"""
+    global _dns_cache
+    if _dns_cache is None:
+        _dns_cache = DNSCache(Config.DNS_CACHE_TTL, Config.DNS_NEGATIVE_TTL, Config.DNS_CACHE_SIZE)
+    return _dns_cache
+
+async def preresolve_nodes(nodes: List[str]) -> Dict[str, Optional[str]]:
+    """测速前批量解析所有节点主机，解析时间不计入延迟"""
+    hosts = [parsed.host for parsed in map(parse_node, nodes) if parsed and parsed.host]
+    cache = get_dns_cache()
+    start = time.perf_counter()
+    resolved = await cache.resolve_many(hosts, Config.DNS_RESOLVE_CONCURRENCY)
+    failed = sum(1 for ip in resolved.values() if ip is None)
+    logging.info(f"[🌐] 预解析 {len(resolved)} 个主机，耗时 {(time.perf_counter() - start) * 1000:.0f}ms，"
+                 f"失败 {failed} 个，缓存命中 {cache.hits}/{cache.hits + cache.misses}")
+    return resolved
+
+# === 测速结果复用 ===
+class ProbeFreshnessIndex:
+    """按节点ID记录最近一次测速时间与延迟，TTL 内的重复测速直接复用结果
+    
+    节点ID取自规范节点身份，备注变化不影响命中；失败结果使用更短的 negative_ttl。
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, ttl: float = 1800, negative_ttl: float = 600):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries: Dict[str, tuple] = {}  # 节点ID -> (测速时刻epoch, 延迟ms)
+        self.hits = 0
+    
+    @staticmethod
+    def key_of(node: str) -> str:
+        parsed = parse_node(node)
+        content = "|".join(map(str, parsed.identity)) if parsed else node.strip()
+        return hashlib.md5(content.encode()).hexdigest()[:12]
+    
+    def lookup(self, node: str) -> Optional[float]:
+        """返回仍在有效期内的延迟(失败为inf)，过期或没有记录时返回None"""
+        entry = self.entries.get(self.key_of(node))
+        if entry is None:
+            return None
+        probed_at, latency = entry
+        ttl = self.ttl if latency < INF else self.negative_ttl
+        if time.time() - probed_at > ttl:
+            return None
+        self.hits += 1
+        return latency
+    
+    def record(self, node: str, latency: float):
+        self.entries[self.key_of(node)] = (time.time(), latency)
+    
+    @classmethod
+    def load(cls, path: str, ttl: float, negative_ttl: float) -> 'ProbeFreshnessIndex':
+        """从文件加载；文件不存在或损坏时返回空索引"""
+        index = cls(ttl, negative_ttl)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == cls.VERSION:
+                for node_id, (probed_at, latency) in data.get('entries', {}).items():
+                    index.entries[node_id] = (probed_at, INF if latency is None else latency)
+        except (OSError, ValueError, TypeError):
+            pass
+        return index
+    
+    def save(self, path: str):
+        """丢弃已过期的条目后原子写入文件"""
+        cutoff = time.time() - max(self.ttl, self.negative_ttl)
+        entries = {node_id: [probed_at, latency if latency < INF else None]
+                   for node_id, (probed_at, latency) in self.entries.items() if probed_at >= cutoff}
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': entries}, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+
+_freshness_index = None
+
+def get_freshness_index() -> Optional[ProbeFreshnessIndex]:
+    """获取全局测速结果索引，首次调用时从文件加载；关闭复用时返回None"""
+    global _freshness_index
+    if not Config.FRESHNESS_ENABLED:
+        return None
+    if _freshness_index is None:
+        _freshness_index = ProbeFreshnessIndex.load(
+            os.path.join(Config.BASE_DIR, Config.FRESHNESS_FILE),
+            Config.FRESHNESS_TTL, Config.FRESHNESS_NEGATIVE_TTL)
+    return _freshness_index
+
+def save_freshness_index():
+    """持久化全局测速结果索引"""
+    if _freshness_index is None:
+        return
+    try:
+        _freshness_index.save(os.path.join(Config.BASE_DIR, Config.FRESHNESS_FILE))
+    except OSError as e:
+        logging.warning(f"[⚠️] 保存测速结果索引失败: {e}")
+
 def test_latency(host: str, port: int = 443, timeout: float = 1.0) -> float:
-    """TCP ping测试，返回毫秒延迟"""
+    """TCP ping测试，返回毫秒延迟(不含DNS解析)"""
     try:
-        time.sleep(random.uniform(0.001, 0.005))
-        start = time.time()
-        sock = socket.create_connection((host, port), timeout)
+        ip = get_dns_cache().resolve_sync(host)
+        if ip is None:
+            logging.debug(f"[❌] 域名解析失败: {host}")
+            return float("inf")
+        start_ns = time.perf_counter_ns()
+        sock = socket.create_connection((ip, port), timeout)
+        latency = (time.perf_counter_ns() - start_ns) / 1e6
         sock.close()
-        latency = (time.time() - start) * 1000
         logging.debug(f"[📊] 节点延迟: {host}:{port} = {latency:.2f}ms")
         return latency
     except socket.timeout:
@@ -1274,49 +2512,37 @@ def test_latency(host: str, port: int = 443, timeout: float = 1.0) -> float:
 
 def parse_vmess(vmess_url: str) -> dict:
     """解析vmess节点字符串，返回包含节点信息的字典"""
-    try:
-        content = vmess_url[8:] if vmess_url.startswith("vmess://") else vmess_url
-        # 处理base64填充问题
-        padding = len(content) % 4
-        if padding:
-            content += '=' * (4 - padding)
-        # 解码并解析JSON
-        vmess_json = json.loads(base64.b64decode(content).decode('utf-8', errors='ignore'))
-        return vmess_json
-    except Exception:
-        return {}
+    if not vmess_url.startswith("vmess://"):
+        vmess_url = "vmess://" + vmess_url
+    node = parse_node(vmess_url)
+    return dict(node.fields) if node else {}
 
-async def check_google_html_async(proxy_url: str, timeout: float = 3.0) -> bool:
+def create_probe_engine(max_connections: Optional[int] = None) -> 'ProbeEngine':
+    """按全局配置创建探测引擎，max_connections 默认为 MAX_CONCURRENT_REQUESTS"""
+    return ProbeEngine(
+        max_connections=max_connections or Config.MAX_CONCURRENT_REQUESTS,
+        limit_per_host=Config.PROBE_LIMIT_PER_HOST,
+        dns_ttl=Config.PROBE_DNS_CACHE_TTL,
+        timeout=Config.CONNECTION_TIMEOUT
+    )
+
+async def check_google_html_async(proxy_url: str, timeout: float = 3.0, engine: 'ProbeEngine' = None) -> bool:
     """检查代理是否能访问Google并返回HTML内容"""
-    GOOGLE_URL = "https://www.google.com"
+    GOOGLE_URL = Config.CORE_CHECK_URL
     headers = {
         "User-Agent": "Mozilla/5.0",
         "Accept": "text/html"
     }
 
-    try:
-        timeout_cfg = aiohttp.ClientTimeout(total=timeout)
-        async with aiohttp.ClientSession(timeout=timeout_cfg) as session:
-            async with session.get(
-                GOOGLE_URL,
-                proxy=proxy_url,
-                headers=headers,
-                ssl=False
-            ) as resp:
-
-                if resp.status != 200:
-                    return False
+    if engine is not None:
+        return await engine.check_html(GOOGLE_URL, proxy_url, timeout, headers)
 
-                text = await resp.text()
-                return "<html" in text.lower()
-
-    except Exception:
-        return False
+    async with create_probe_engine() as own_engine:
+        return await own_engine.check_html(GOOGLE_URL, proxy_url, timeout, headers)
 
 async def node_king_score_async(
     proxy_url: str,
-    host: str,
-    port: int
+    engine: 'ProbeEngine' = None
 ) -> dict:
     """
     节点王评分函数
@@ -1329,127 +2555,853 @@ async def node_king_score_async(
     }
     """
 
-    # ① Google 硬性指标
-    google_ok = await check_google_html_async(proxy_url)
-
+    # ① Google 硬性指标，同时计时：经代理完成一次真实请求的耗时才反映节点可用速度
+    start_ns = time.perf_counter_ns()
+    google_ok = await check_google_html_async(proxy_url, engine=engine)
+    
     if not google_ok:
         return {
-            "proxy": proxy_url,
-            "latency": float("inf"),
-            "google_ok": False,
-            "score": 0
+            "proxy": proxy_url,
+            "latency": float("inf"),
+            "google_ok": False,
+            "score": 0
+        }
+    
+    # ② 延迟取代理请求耗时，而不是直连节点的TCP建连时间
+    latency = (time.perf_counter_ns() - start_ns) / 1e6
+    
+    # ③ 最终评分（可自行调整）
+    score = max(1, int(1000 - latency))
+
+    return {
+        "proxy": proxy_url,
+        "latency": latency,
+        "google_ok": True,
+        "score": score
+    }
+
+# === 本地代理核心进程池 ===
+# 各协议传输参数所在的字段：协议 -> (网络字段, 安全字段, 默认安全, SNI字段候选)
+_TRANSPORT_FIELDS = {
+    "vmess": ("net", "tls", "", ("sni",)),
+    "vless": ("type", "security", "", ("sni",)),
+    "trojan": ("type", "security", "tls", ("sni", "peer")),
+}
+
+def node_transport(node: ProxyNode) -> Optional[tuple]:
+    """取出节点的传输参数 (network, security, host, path, sni)，没有传输层配置的协议返回None"""
+    keys = _TRANSPORT_FIELDS.get(node.protocol)
+    if keys is None:
+        return None
+    network_key, security_key, default_security, sni_keys = keys
+    f = node.fields
+    sni = next((f[key] for key in sni_keys if f.get(key)), "")
+    return (f.get(network_key, "tcp") or "tcp", f.get(security_key, default_security),
+            f.get("host", ""), f.get("path", ""), sni)
+
+def _core_stream_settings(network: str, security: str, host: str = "", path: str = "",
+                          sni: str = "", fields: Optional[Dict[str, Any]] = None) -> dict:
+    """生成xray/v2ray的streamSettings"""
+    fields = fields or {}
+    network = network or "tcp"
+    stream = {"network": network}
+    if network == "ws":
+        stream["wsSettings"] = {"path": path or "/", "headers": {"Host": host} if host else {}}
+    elif network == "grpc":
+        stream["grpcSettings"] = {"serviceName": fields.get("serviceName", path)}
+    elif network in ("h2", "http"):
+        stream["network"] = "http"
+        stream["httpSettings"] = {"path": path or "/", "host": [host] if host else []}
+    
+    if security == "tls":
+        stream["security"] = "tls"
+        stream["tlsSettings"] = {"serverName": sni or host, "allowInsecure": True}
+    elif security == "reality":
+        stream["security"] = "reality"
+        stream["realitySettings"] = {
+            "serverName": sni,
+            "publicKey": fields.get("pbk", ""),
+            "shortId": fields.get("sid", ""),
+            "fingerprint": fields.get("fp", "chrome")
+        }
+    return stream
+
+
+def build_core_outbound(node: ProxyNode) -> Optional[dict]:
+    """将 ProxyNode 转为xray/v2ray出站配置，核心不支持的协议返回None"""
+    f = node.fields
+    if node.protocol == "vmess":
+        return {
+            "protocol": "vmess",
+            "settings": {"vnext": [{
+                "address": node.host,
+                "port": node.port,
+                "users": [{
+                    "id": node.credential,
+                    "alterId": int(f.get("aid", 0) or 0),
+                    "security": f.get("scy", "auto") or "auto"
+                }]
+            }]},
+            "streamSettings": _core_stream_settings(*node_transport(node), f)
+        }
+    if node.protocol == "vless":
+        return {
+            "protocol": "vless",
+            "settings": {"vnext": [{
+                "address": node.host,
+                "port": node.port,
+                "users": [{"id": node.credential, "encryption": "none", "flow": f.get("flow", "")}]
+            }]},
+            "streamSettings": _core_stream_settings(*node_transport(node), f)
+        }
+    if node.protocol == "trojan":
+        return {
+            "protocol": "trojan",
+            "settings": {"servers": [{"address": node.host, "port": node.port, "password": node.credential}]},
+            "streamSettings": _core_stream_settings(*node_transport(node), f)
+        }
+    if node.protocol == "ss":
+        return {
+            "protocol": "shadowsocks",
+            "settings": {"servers": [{
+                "address": node.host,
+                "port": node.port,
+                "method": f.get("method", ""),
+                "password": node.credential
+            }]}
+        }
+    return None
+
+# v2rayN 导出表：协议 -> (服务器类型, 伪装类型字段)
+_V2RAYN_SERVER_TYPES = {
+    "vmess": ("VMess", "type"),
+    "vless": ("VLESS", "headerType"),
+    "trojan": ("Trojan", "headerType"),
+    "ss": ("Shadowsocks", None),
+}
+
+def v2rayn_server_id(node: ProxyNode) -> str:
+    """由规范节点身份派生的稳定服务器ID，同一节点每次导出都相同"""
+    return hashlib.sha1("|".join(map(str, node.identity)).encode()).hexdigest()[:16]
+
+def build_v2rayn_server(node: ProxyNode, group_name: str) -> Optional[dict]:
+    """将 ProxyNode 转为v2rayN服务器条目，传输参数与核心出站共用 node_transport；不支持的协议返回None"""
+    spec = _V2RAYN_SERVER_TYPES.get(node.protocol)
+    if spec is None or not node.host or not node.port:
+        return None
+    server_type, header_key = spec
+    f = node.fields
+    server_id = v2rayn_server_id(node)
+    server = {
+        "id": server_id,
+        "remarks": node.remarks or f"{server_type}_{server_id[:6]}",
+        "group": group_name,
+        "type": server_type,
+        "address": node.host,
+        "port": node.port,
+        "allowInsecure": True
+    }
+    if node.protocol == "ss":
+        server.update({"password": node.credential, "security": f.get("method", ""), "network": "tcp"})
+        return server
+    
+    network, security, host, path, sni = node_transport(node)
+    server.update({
+        "network": network,
+        "headerType": f.get(header_key, "none") or "none",
+        "requestHost": host,
+        "path": path,
+        "streamSecurity": security,
+        "sni": sni,
+        "fingerprint": f.get("fp", "")
+    })
+    if node.protocol == "vmess":
+        server.update({"uuid": node.credential, "alterId": int(f.get("aid", 0) or 0),
+                       "security": f.get("scy", "auto") or "auto"})
+    elif node.protocol == "vless":
+        server.update({"uuid": node.credential, "security": f.get("encryption", "none") or "none",
+                       "flow": f.get("flow", "")})
+    else:
+        server["password"] = node.credential
+    if security == "reality":
+        server.update({"publicKey": f.get("pbk", ""), "shortId": f.get("sid", "")})
+    return server
+
+
+class CoreProxyPool:
+    """本地代理核心进程池：每个进程加载一批节点，每个节点独占一个本地HTTP入站端口
+    
+    aiohttp 只支持HTTP代理，因此入站使用http协议而不是socks。
+    设置 standin_proxy 后不启动任何核心，所有节点都通过该替身代理检查，便于本地测试。
+    """
+    
+    def __init__(self, executable: Optional[str] = None, pool_size: Optional[int] = None,
+                 batch_size: Optional[int] = None, base_port: Optional[int] = None,
+                 standin_proxy: Optional[str] = None):
+        self.standin_proxy = standin_proxy if standin_proxy is not None else Config.CORE_STANDIN_PROXY
+        self.executable = executable or (None if self.standin_proxy else self.find_executable())
+        self.pool_size = pool_size or Config.CORE_POOL_SIZE
+        self.batch_size = batch_size or Config.CORE_NODES_PER_PROCESS
+        self.base_port = base_port or Config.CORE_BASE_PORT
+    
+    @staticmethod
+    def find_executable() -> Optional[str]:
+        """在程序目录、v2rayN的bin目录和PATH中查找代理核心"""
+        suffix = ".exe" if PlatformAdapter.get_platform() == 'windows' else ""
+        for name in Config.CORE_EXECUTABLES:
+            for directory in (Config.BASE_DIR, os.path.join(Config.BASE_DIR, "bin", name),
+                              os.path.join(Config.BASE_DIR, "bin")):
+                candidate = os.path.join(directory, name + suffix)
+                if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                    return candidate
+            found = shutil.which(name)
+            if found:
+                return found
+        return None
+    
+    @property
+    def available(self) -> bool:
+        return bool(self.standin_proxy or self.executable)
+    
+    @staticmethod
+    def build_config(nodes: List[ProxyNode], base_port: int) -> dict:
+        """为一批节点生成核心配置：第i个节点走 127.0.0.1:base_port+i 的HTTP入站"""
+        inbounds, outbounds, rules = [], [], []
+        for i, node in enumerate(nodes):
+            outbound = build_core_outbound(node)
+            outbound["tag"] = f"out{i}"
+            outbounds.append(outbound)
+            inbounds.append({"tag": f"in{i}", "listen": "127.0.0.1", "port": base_port + i, "protocol": "http"})
+            rules.append({"type": "field", "inboundTag": [f"in{i}"], "outboundTag": f"out{i}"})
+        return {
+            "log": {"loglevel": "none"},
+            "inbounds": inbounds,
+            "outbounds": outbounds,
+            "routing": {"rules": rules}
+        }
+    
+    async def _wait_ready(self, process, port: int) -> bool:
+        """等待核心进程开始监听"""
+        deadline = time.monotonic() + Config.CORE_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.returncode is not None:
+                return False
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                await writer.wait_closed()
+                return True
+            except OSError:
+                await asyncio.sleep(0.1)
+        return False
+    
+    async def _stop(self, process):
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=3)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+    
+    async def _run_batch(self, slot: int, nodes: List[ProxyNode], check) -> list:
+        """启动一个核心进程承载这批节点，并发执行检查后关闭进程"""
+        base_port = self.base_port + slot * self.batch_size
+        fd, config_path = tempfile.mkstemp(prefix="core_", suffix=".json")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.build_config(nodes, base_port), f)
+        
+        kwargs = {}
+        if PlatformAdapter.get_platform() == 'windows':
+            kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.executable, "run", "-c", config_path,
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                **kwargs
+            )
+        except OSError as e:
+            logging.warning(f"[⚠️] 核心进程启动失败: {e}")
+            os.remove(config_path)
+            return []
+        try:
+            if not await self._wait_ready(process, base_port + len(nodes) - 1):
+                logging.warning(f"[⚠️] 核心进程未能就绪，跳过 {len(nodes)} 个节点")
+                return []
+            return await asyncio.gather(*(
+                check(node, f"http://127.0.0.1:{base_port + i}") for i, node in enumerate(nodes)
+            ))
+        finally:
+            await self._stop(process)
+            try:
+                os.remove(config_path)
+            except OSError:
+                pass
+    
+    async def verify(self, nodes: List[ProxyNode], check) -> list:
+        """对每个节点调用 check(node, proxy_url)，返回全部结果"""
+        if self.standin_proxy:
+            async def check_standin(node):
+                return await check(node, self.standin_proxy)
+            return [result async for result in iter_bounded(nodes, check_standin)]
+        
+        nodes = [node for node in nodes if build_core_outbound(node) is not None]
+        batches = [nodes[i:i + self.batch_size] for i in range(0, len(nodes), self.batch_size)]
+        slots = asyncio.Queue()
+        for slot in range(self.pool_size):
+            slots.put_nowait(slot)
+        
+        async def run(batch):
+            slot = await slots.get()
+            try:
+                return await self._run_batch(slot, batch, check)
+            finally:
+                slots.put_nowait(slot)
+        
+        results = []
+        for batch_results in await asyncio.gather(*(run(batch) for batch in batches)):
+            results.extend(batch_results)
+        return results
+
+
+async def verify_nodes_via_core(lines: List[str], engine: 'ProbeEngine' = None,
+                                pool: Optional[CoreProxyPool] = None) -> Optional[list]:
+    """通过本地核心逐节点做Google检查与评分，返回按评分排序的结果；没有可用核心时返回None"""
+    pool = pool or CoreProxyPool()
+    if not pool.available:
+        logging.warning("[⚠️] 未找到xray/v2ray核心，跳过逐节点Google检查")
+        return None
+    
+    nodes = [node for node in map(parse_node, lines) if node and node.host]
+    
+    async def verify(engine):
+        # 检查数不超过连接器上限，避免请求在连接池里排队时就耗尽超时，被误判为不可用
+        gate = asyncio.Semaphore(engine.max_connections)
+        
+        async def check(node, proxy_url):
+            async with gate:
+                result = await node_king_score_async(proxy_url, engine)
+            result["original_node"] = node.raw
+            return result
+        
+        return await pool.verify(nodes, check)
+    
+    if engine is None:
+        # 连接器按核心池同时承载的节点数配置，所有入站都能同时发起检查
+        async with create_probe_engine(pool.pool_size * pool.batch_size) as engine:
+            results = await verify(engine)
+    else:
+        results = await verify(engine)
+    
+    results = [r for r in results if r["google_ok"]]
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results
+
+# === 探测计时 ===
+class ProbeTiming:
+    """一次连接探测的纳秒时间戳：请求时刻、开始解析时刻、发起连接时刻、连接建立时刻"""
+    
+    __slots__ = ('requested_ns', 'resolve_ns', 'start_ns', 'connected_ns')
+    
+    def __init__(self, requested_ns: int, resolve_ns: int = 0, start_ns: int = 0, connected_ns: int = 0):
+        self.requested_ns = requested_ns
+        self.resolve_ns = resolve_ns
+        self.start_ns = start_ns
+        self.connected_ns = connected_ns
+    
+    @property
+    def ok(self) -> bool:
+        return self.connected_ns > 0
+    
+    @property
+    def queue_ms(self) -> float:
+        """从提交探测到开始解析的排队时间(并发窗口、事件循环调度)"""
+        return (self.resolve_ns - self.requested_ns) / 1e6 if self.resolve_ns else 0.0
+    
+    @property
+    def dns_ms(self) -> float:
+        """DNS解析耗时，命中缓存时接近0"""
+        return (self.start_ns - self.resolve_ns) / 1e6 if self.start_ns and self.resolve_ns else 0.0
+    
+    @property
+    def rtt_ms(self) -> float:
+        """发起连接到连接建立的网络耗时"""
+        return (self.connected_ns - self.start_ns) / 1e6 if self.ok else float('inf')
+
+
+class ProbeStats:
+    """汇总一轮测速的排队时间与网络耗时"""
+    
+    def __init__(self):
+        self.count = 0
+        self.ok = 0
+        self.queue_total = 0.0
+        self.queue_max = 0.0
+        self.dns_total = 0.0
+        self.rtt_total = 0.0
+        self.stage_totals: Dict[str, float] = {}
+        self.stage_ok: Dict[str, int] = {}
+        self.stage_fail: Dict[str, int] = {}
+    
+    def record(self, timing: ProbeTiming):
+        self.count += 1
+        queue_ms = timing.queue_ms
+        self.queue_total += queue_ms
+        self.queue_max = max(self.queue_max, queue_ms)
+        self.dns_total += timing.dns_ms
+        if timing.ok:
+            self.ok += 1
+            self.rtt_total += timing.rtt_ms
+    
+    def record_stages(self, stages: Dict[str, float]):
+        for name, ms in stages.items():
+            if ms < INF:
+                self.stage_ok[name] = self.stage_ok.get(name, 0) + 1
+                self.stage_totals[name] = self.stage_totals.get(name, 0.0) + ms
+            else:
+                self.stage_fail[name] = self.stage_fail.get(name, 0) + 1
+    
+    def merge(self, other: 'ProbeStats'):
+        """合并另一轮（如其他进程分片）的统计"""
+        self.count += other.count
+        self.ok += other.ok
+        self.queue_total += other.queue_total
+        self.queue_max = max(self.queue_max, other.queue_max)
+        self.dns_total += other.dns_total
+        self.rtt_total += other.rtt_total
+        for mine, theirs in ((self.stage_totals, other.stage_totals), (self.stage_ok, other.stage_ok),
+                             (self.stage_fail, other.stage_fail)):
+            for name, value in theirs.items():
+                mine[name] = mine.get(name, 0) + value
+    
+    def summary(self) -> str:
+        avg_queue = self.queue_total / self.count if self.count else 0.0
+        avg_dns = self.dns_total / self.count if self.count else 0.0
+        avg_rtt = self.rtt_total / self.ok if self.ok else 0.0
+        text = (f"{self.ok}/{self.count} 连通，平均网络耗时 {avg_rtt:.1f}ms，平均DNS {avg_dns:.1f}ms，"
+                f"平均排队 {avg_queue:.1f}ms (最长 {self.queue_max:.1f}ms)")
+        for name in sorted(set(self.stage_ok) | set(self.stage_fail)):
+            ok = self.stage_ok.get(name, 0)
+            avg = self.stage_totals.get(name, 0.0) / ok if ok else 0.0
+            text += f"，{name.upper()} {ok}/{ok + self.stage_fail.get(name, 0)} 通过 (平均 {avg:.1f}ms)"
+        return text
+
+
+# === 自适应并发 ===
+class AdaptiveConcurrency:
+    """AIMD并发窗口：建连耗时与失败率稳定时放大窗口，耗时膨胀、失败率上升或文件描述符紧张时减半
+    
+    用法: async with limiter: ...，拿到延迟后调用 limiter.observe(rtt_ms)
+    """
+    
+    FD_CHECK_EVERY = 32
+    EWMA_ALPHA = 0.1
+    SUCCESS_ALPHA = 0.01            # 成功率噪声大（免费节点大多是死节点），用更平滑的系数
+    SUCCESS_BASELINE_ALPHA = 0.002  # 成功率基线是更慢的长期均值，只对“下降”做出反应
+    SUCCESS_DROP = 0.3              # 成功率比基线相对下降多少视为拥塞（超时/丢SYN）
+    
+    def __init__(self, initial: int, minimum: int, maximum: int,
+                 inflate_ratio: float = 1.5, fd_reserve: int = 64):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.window = float(min(max(initial, self.minimum), self.maximum))
+        self.inflate_ratio = inflate_ratio
+        self.fd_reserve = fd_reserve
+        self.in_flight = 0
+        self.peak = int(self.window)
+        self.backoffs = 0
+        self._slow_start = True
+        self._ewma = 0.0
+        self._baseline = INF
+        self._success = 0.0
+        self._success_baseline = 0.0
+        self._observed = 0
+        self._since_backoff = 0
+        self._acquired = 0
+        self._condition = asyncio.Condition()
+        self._fd_limit = self._read_fd_limit()
+    
+    @staticmethod
+    def _read_fd_limit() -> int:
+        """当前进程的文件描述符软上限，Windows等无此限制时返回0"""
+        try:
+            import resource
+            limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        except (ImportError, ValueError, OSError):
+            return 0
+        return limit if limit > 0 else 0
+    
+    def _fd_pressure(self) -> bool:
+        if not self._fd_limit:
+            return False
+        try:
+            open_fds = psutil.Process().num_fds()
+        except (AttributeError, psutil.Error):
+            return False
+        return open_fds >= self._fd_limit - self.fd_reserve
+    
+    def _backoff(self, reason: str):
+        self.window = max(float(self.minimum), self.window / 2)
+        self._slow_start = False
+        self._since_backoff = 0
+        self._baseline = INF
+        self.backoffs += 1
+        logging.debug(f"[📉] 并发窗口减半至 {int(self.window)}: {reason}")
+    
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+            self._acquired += 1
+            if self._acquired % self.FD_CHECK_EVERY == 0 and self._fd_pressure():
+                self._backoff("文件描述符不足")
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify(max(1, int(self.window) - self.in_flight))
+    
+    def observe(self, rtt_ms: float):
+        """反馈一次探测结果：成功为建连耗时，失败/超时为inf"""
+        ok = rtt_ms < INF
+        hit = 1.0 if ok else 0.0
+        self._observed += 1
+        # 样本不足时系数取 1/n，即先按算术平均累积，避免首个样本决定成功率与基线
+        alpha = max(self.SUCCESS_ALPHA, 1 / self._observed)
+        self._success = alpha * hit + (1 - alpha) * self._success
+        congested = self._success < self._success_baseline * (1 - self.SUCCESS_DROP)
+        # 拥塞期间冻结基线，否则持续的拥塞丢包会被慢慢当成“正常”；窗口已到下限时照常跟随
+        if not congested or self.window <= self.minimum:
+            alpha = max(self.SUCCESS_BASELINE_ALPHA, 1 / self._observed)
+            self._success_baseline = alpha * hit + (1 - alpha) * self._success_baseline
+        if ok:
+            alpha = self.EWMA_ALPHA
+            self._ewma = rtt_ms if not self._ewma else alpha * rtt_ms + (1 - alpha) * self._ewma
+        self._since_backoff += 1
+        if self._since_backoff < self.minimum:
+            return
+        
+        if self._ewma:
+            self._baseline = min(self._baseline, self._ewma)
+        reason = ""
+        if self._ewma > self._baseline * self.inflate_ratio:
+            reason = f"建连耗时 {self._ewma:.0f}ms 超过基线 {self._baseline:.0f}ms"
+        elif congested:
+            reason = f"成功率 {self._success:.0%} 低于基线 {self._success_baseline:.0%}"
+        if reason:
+            # 窗口调整后至少观察一整个窗口的样本再决定是否继续回退
+            if self._since_backoff >= self.window:
+                self._backoff(reason)
+            return
+        if not ok:
+            return
+        
+        step = 1.0 if self._slow_start else 1.0 / self.window
+        self.window = min(float(self.maximum), self.window + step)
+        self.peak = max(self.peak, int(self.window))
+    
+    def snapshot(self) -> dict:
+        """当前并发窗口指标"""
+        return {
+            'window': int(self.window),
+            'in_flight': self.in_flight,
+            'peak': self.peak,
+            'backoffs': self.backoffs
         }
+    
+    def summary(self) -> str:
+        return f"并发窗口 {int(self.window)} (峰值 {self.peak}，回退 {self.backoffs} 次)"
 
-    # ② 延迟测试（复用已有逻辑）
-    latency = await test_latency_async(host, port)
 
-    if latency == float("inf"):
-        return {
-            "proxy": proxy_url,
-            "latency": latency,
-            "google_ok": True,
-            "score": 100  # 勉强保留
-        }
+def create_concurrency_limiter(maximum: Optional[int] = None) -> AdaptiveConcurrency:
+    """按全局配置创建并发控制器；关闭自适应时窗口固定为 MAX_CONCURRENT_REQUESTS"""
+    initial = Config.MAX_CONCURRENT_REQUESTS
+    if not Config.ADAPTIVE_CONCURRENCY:
+        return AdaptiveConcurrency(initial, initial, initial)
+    return AdaptiveConcurrency(initial, Config.CONCURRENCY_MIN, maximum or Config.CONCURRENCY_MAX,
+                               Config.CONCURRENCY_INFLATE_RATIO, Config.CONCURRENCY_FD_RESERVE)
 
-    # ③ 最终评分（可自行调整）
-    score = max(1, int(1000 - latency))
+# === 事件循环选择 ===
+_event_loop_impl = None
+
+def install_event_loop_policy() -> str:
+    """启动时选择一次事件循环实现并设为全局策略，返回 'uvloop' 或 'asyncio'"""
+    global _event_loop_impl
+    if _event_loop_impl is None:
+        if has_uvloop and Config.EVENT_LOOP != "asyncio":
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            _event_loop_impl = "uvloop"
+        else:
+            _event_loop_impl = "asyncio"
+        logging.info(f"[⚙️] 事件循环: {_event_loop_impl}")
+    return _event_loop_impl
+
+# === 有界任务调度 ===
+class _WorkerFailure:
+    __slots__ = ('error',)
+    
+    def __init__(self, error: BaseException):
+        self.error = error
 
-    return {
-        "proxy": proxy_url,
-        "latency": latency,
-        "google_ok": True,
-        "score": score
-    }
 
-async def node_king_benchmark_async(nodes: list) -> list:
+async def iter_bounded(items, worker: Callable, limiter: Optional[AdaptiveConcurrency] = None,
+                       queue_size: Optional[int] = None) -> AsyncIterator:
+    """有界队列工作池：惰性读取 items（同步或异步可迭代），按完成顺序产出 worker 的结果
+    
+    调用方跳出 async for 循环后应 await aclose()，未开始和进行中的任务会立即被取消。
     """
-    并发跑“节点王”的调度器
-    nodes 示例：
-    [
-        {
-            "proxy": "socks5://127.0.0.1:10808",
-            "host": "example.com",
-            "port": 443,
-            "original_node": "vmess://..."
-        }
-    ]
+    limiter = limiter or create_concurrency_limiter()
+    queue_size = queue_size or Config.SCHEDULER_QUEUE_SIZE
+    pending = asyncio.Queue(maxsize=queue_size)
+    finished = asyncio.Queue(maxsize=queue_size)
+    done = object()
+    worker_count = limiter.maximum
+    
+    async def feed():
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                await pending.put(item)
+        else:
+            for item in items:
+                await pending.put(item)
+    
+    async def feeder():
+        try:
+            await feed()
+        except Exception as e:
+            await finished.put(_WorkerFailure(e))
+        # 被取消时不会走到这里，避免在已满的队列上阻塞
+        for _ in range(worker_count):
+            await pending.put(done)
+    
+    async def run():
+        while True:
+            item = await pending.get()
+            if item is done:
+                await finished.put(done)
+                return
+            try:
+                async with limiter:
+                    result = await worker(item)
+            except Exception as e:
+                result = _WorkerFailure(e)
+            await finished.put(result)
+    
+    tasks = [asyncio.create_task(feeder())]
+    tasks.extend(asyncio.create_task(run()) for _ in range(worker_count))
+    try:
+        remaining = worker_count
+        while remaining:
+            result = await finished.get()
+            if result is done:
+                remaining -= 1
+            elif isinstance(result, _WorkerFailure):
+                raise result.error
+            else:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+_ProactorLoop = getattr(asyncio, 'ProactorEventLoop', ()) if has_async else ()
+
+def _start_connect(sock: socket.socket, ip: str, port: int) -> bool:
+    """在非阻塞套接字上发起连接，立即连通返回 True，进行中返回 False，其余错误抛出 OSError"""
+    err = sock.connect_ex((ip, port))
+    if err == 0:
+        return True
+    if err not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+        raise OSError(err, os.strerror(err))
+    return False
+
+def _probe_socket(ip: str) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ':' in ip else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    return sock
+
+
+class BatchConnectProber:
+    """批量TCP建连探测器：所有半开连接注册在同一个选择器上（Linux为epoll、BSD为kqueue）
+    
+    只把选择器自身的描述符挂到事件循环，一次就绪回调批量处理所有完成的连接并记录完成时刻，
+    不创建传输/流对象，也不为每个连接单独注册循环回调。
     """
+    
+    def __init__(self, loop):
+        self.loop = loop
+        self.selector = selectors.DefaultSelector()
+        self._attached = False
+    
+    @staticmethod
+    def supported() -> bool:
+        """选择器需要能被事件循环监听（有fileno），Windows的select实现不满足"""
+        return hasattr(selectors.DefaultSelector, 'fileno')
+    
+    def _detach_if_idle(self):
+        if self._attached and not self.selector.get_map():
+            self.loop.remove_reader(self.selector.fileno())
+            self._attached = False
+    
+    def _drain(self):
+        connected_ns = time.perf_counter_ns()
+        for key, _ in self.selector.select(0):
+            self.selector.unregister(key.fileobj)
+            future = key.data
+            if future.done():
+                continue
+            err = key.fileobj.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                future.set_exception(OSError(err, os.strerror(err)))
+            else:
+                future.set_result(connected_ns)
+        self._detach_if_idle()
+    
+    async def connect(self, ip: str, port: int) -> int:
+        """建连并返回完成时刻(perf_counter_ns)，失败抛出 OSError"""
+        sock = _probe_socket(ip)
+        try:
+            if _start_connect(sock, ip, port):
+                return time.perf_counter_ns()
+            future = self.loop.create_future()
+            self.selector.register(sock, selectors.EVENT_WRITE, future)
+            if not self._attached:
+                self.loop.add_reader(self.selector.fileno(), self._drain)
+                self._attached = True
+            try:
+                return await future
+            finally:
+                if sock in self.selector.get_map():
+                    # 超时取消时连接仍是半开状态，先注销再关闭
+                    self.selector.unregister(sock)
+                    self._detach_if_idle()
+        finally:
+            sock.close()
 
-    semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
 
-    async def runner(node):
-        async with semaphore:
-            result = await node_king_score_async(
-                node["proxy"],
-                node["host"],
-                node["port"]
-            )
-            # 添加原始节点信息
-            result["original_node"] = node["original_node"]
-            return result
+_batch_probers = weakref.WeakKeyDictionary() if has_async else None
 
-    tasks = [runner(n) for n in nodes]
-    results = await asyncio.gather(*tasks)
+def get_batch_prober() -> Optional[BatchConnectProber]:
+    """当前事件循环的批量探测器；配置为 loop、平台或循环不支持时返回None"""
+    if Config.PROBE_BACKEND != "batch" or not BatchConnectProber.supported():
+        return None
+    loop = asyncio.get_running_loop()
+    if isinstance(loop, _ProactorLoop):
+        return None
+    prober = _batch_probers.get(loop)
+    if prober is None:
+        prober = _batch_probers[loop] = BatchConnectProber(loop)
+    return prober
 
-    # ① 先淘汰 Google 不通的
-    results = [r for r in results if r["google_ok"]]
+async def connect_stamped_async(ip: str, port: int) -> int:
+    """非阻塞建连，在套接字可写的回调里记录完成时刻(perf_counter_ns)
+    
+    时间戳取自事件循环处理就绪事件的那一刻，不包含之后唤醒协程的调度延迟。
+    默认交给批量探测器处理，不支持时每个连接单独注册到事件循环。
+    """
+    prober = get_batch_prober()
+    if prober is not None:
+        return await prober.connect(ip, port)
+    
+    loop = asyncio.get_running_loop()
+    sock = _probe_socket(ip)
+    fd = sock.fileno()
+    try:
+        if isinstance(loop, _ProactorLoop):
+            # Windows Proactor 循环不支持 add_writer，只能在 await 返回后取时间戳
+            await loop.sock_connect(sock, (ip, port))
+            return time.perf_counter_ns()
+        
+        if _start_connect(sock, ip, port):
+            return time.perf_counter_ns()
+        
+        done = loop.create_future()
+        
+        def on_writable():
+            connected_ns = time.perf_counter_ns()
+            loop.remove_writer(fd)
+            if done.done():
+                return
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err:
+                done.set_exception(OSError(err, os.strerror(err)))
+            else:
+                done.set_result(connected_ns)
+        
+        loop.add_writer(fd, on_writable)
+        try:
+            return await done
+        finally:
+            loop.remove_writer(fd)
+    finally:
+        sock.close()
 
-    # ② 按 score 排序
-    results.sort(key=lambda x: x["score"], reverse=True)
+async def measure_connect_async(host: str, port: int, timeout: float = 1.0,
+                                requested_ns: Optional[int] = None) -> ProbeTiming:
+    """测量到节点的TCP建连耗时，排队、DNS解析分别计时，不计入网络耗时"""
+    timing = ProbeTiming(requested_ns or time.perf_counter_ns())
+    timing.resolve_ns = time.perf_counter_ns()
+    ip = await get_dns_cache().resolve(host)
+    if ip is None:
+        return timing
+    
+    timing.start_ns = time.perf_counter_ns()
+    try:
+        timing.connected_ns = await asyncio.wait_for(connect_stamped_async(ip, port), timeout=timeout)
+    except Exception:
+        pass
+    return timing
 
-    return results
+async def sample_connect_async(host: str, port: int, timeout: float = 1.0, samples: int = 1,
+                               interval: float = 0.0, requested_ns: Optional[int] = None) -> List[ProbeTiming]:
+    """按间隔错开发起多次建连（不等待前一次结束），返回每次的计时"""
+    async def one(i):
+        if i:
+            await asyncio.sleep(i * interval)
+        return await measure_connect_async(host, port, timeout, requested_ns if i == 0 else None)
+    
+    return list(await asyncio.gather(*(one(i) for i in range(max(1, samples)))))
 
 async def test_latency_async(host: str, port: int = 443, timeout: float = 1.0) -> float:
-    """异步TCP ping测试，返回毫秒延迟"""
+    """异步TCP ping测试，返回毫秒延迟(不含DNS解析与排队时间)"""
     if not has_async:
         return test_latency(host, port, timeout)
-        
-    try:
-        await asyncio.sleep(random.uniform(0.001, 0.005))
-        start = time.time()
-        reader, writer = await asyncio.wait_for(
-            asyncio.open_connection(host, port),
-            timeout=timeout
-        )
-        writer.close()
-        await writer.wait_closed()
-        latency = (time.time() - start) * 1000
-        logging.debug(f"[⚡] 异步节点延迟: {host}:{port} = {latency:.2f}ms")
-        return latency
-    except Exception:
-        return float("inf")
+    
+    timing = await measure_connect_async(host, port, timeout)
+    if timing.ok:
+        logging.debug(f"[⚡] 异步节点延迟: {host}:{port} = {timing.rtt_ms:.2f}ms")
+    return timing.rtt_ms
 
 async def benchmark_nodes_async(nodes):
-    """并发测速所有节点，返回排序后的节点列表和最优节点"""
+    """并发测速所有节点，返回排序后的节点列表和最优节点；TTL 内测过的节点直接复用结果"""
     if not has_async:
         return nodes[:min(len(nodes), Config.MAX_NODES)], None
         
+    limiter = create_concurrency_limiter()
+    freshness = get_freshness_index()
+    hits_before = freshness.hits if freshness else 0
+    
     async def process_node(node):
-        if node.startswith("vmess://"):
-            try:
-                vmess_content = node[8:]
-                padding = len(vmess_content) % 4
-                if padding:
-                    vmess_content += '=' * (4 - padding)
-                vmess_json = json.loads(base64.b64decode(vmess_content).decode('utf-8', errors='ignore'))
-                host = vmess_json.get("add", "")
-                port = int(vmess_json.get("port", 443))
-                if host and port:
-                    latency = await test_latency_async(host, port)
-                    if latency < Config.MAX_LATENCY:
-                        return latency, node
-            except Exception:
-                pass
+        parsed = parse_node(node)
+        if parsed and parsed.host and parsed.port:
+            latency = freshness.lookup(node) if freshness else None
+            if latency is None:
+                latency = await test_latency_async(parsed.host, parsed.port)
+                limiter.observe(latency)
+                if freshness:
+                    freshness.record(node, latency)
+            if latency < Config.MAX_LATENCY:
+                return latency, node
         return None, None
     
-    semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
-    
-    async def bounded_process_node(node):
-        async with semaphore:
-            return await process_node(node)
-    
-    node_tasks = [bounded_process_node(node) for node in nodes]
-    task_results = await asyncio.gather(*node_tasks)
+    task_results = [result async for result in iter_bounded(nodes, process_node, limiter)]
+    logging.info(f"[📈] {limiter.summary()}")
+    if freshness:
+        reused = freshness.hits - hits_before
+        logging.info(f"[♻️] 复用 {reused} 个节点的近期测速结果，其余 {len(nodes) - reused} 个重新测速")
+        save_freshness_index()
     
     results = [(latency, node) for latency, node in task_results if latency is not None]
     results.sort(key=lambda x: x[0])
@@ -1469,100 +3421,346 @@ async def benchmark_nodes_async(nodes):
     logging.info(f"[🎯] 已从{len(nodes)}个节点中筛选出{len(top_nodes)}个低延迟节点")
     return top_nodes, best_node
 
+_probe_ssl_context = None
+
+def get_probe_ssl_context() -> ssl.SSLContext:
+    """分层探测用的TLS上下文：只验证握手能否完成，不校验证书（免费节点多为自签或伪装SNI）"""
+    global _probe_ssl_context
+    if _probe_ssl_context is None:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        _probe_ssl_context = context
+    return _probe_ssl_context
+
+def _ws_upgrade_request(path: str, host: str) -> bytes:
+    key = base64.b64encode(os.urandom(16)).decode()
+    return (f"GET {path or '/'} HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode()
+
+async def probe_stages_async(node: ProxyNode, timeout: float = 3.0) -> Dict[str, float]:
+    """TCP之后的分层探测：按节点SNI做TLS握手，再按需做WebSocket升级，逐级计时
+    
+    传输参数取自 build_core_outbound 的 streamSettings，与核心实际使用的一致。
+    返回节点用到的阶段耗时 {'tls': ms, 'ws': ms}；某一级失败时记为inf，后续阶段不再执行。
+    """
+    outbound = build_core_outbound(node) or {}
+    stream = outbound.get("streamSettings", {})
+    security = stream.get("security")
+    ws = stream.get("wsSettings") if stream.get("network") == "ws" else None
+    stages = {}
+    if not security and ws is None:
+        return stages
+    
+    stage = "tls" if security else "ws"
+    ip = await get_dns_cache().resolve(node.host)
+    if ip is None:
+        stages[stage] = INF
+        return stages
+    
+    tls_settings = stream.get("tlsSettings") or stream.get("realitySettings") or {}
+    sni = tls_settings.get("serverName") or node.host
+    loop = asyncio.get_running_loop()
+    sock = _probe_socket(ip)
+    writer = None
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, node.port)), timeout)
+        if security:
+            context = get_probe_ssl_context()
+            start_ns = time.perf_counter_ns()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                sock=sock, ssl=context, server_hostname=sni), timeout)
+            stages["tls"] = (time.perf_counter_ns() - start_ns) / 1e6
+            stage = "ws"
+        if ws is not None:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(sock=sock)
+            host = ws.get("headers", {}).get("Host") or sni
+            start_ns = time.perf_counter_ns()
+            writer.write(_ws_upgrade_request(ws.get("path", "/"), host))
+            status = await asyncio.wait_for(reader.readline(), timeout)
+            parts = status.split()
+            # 首字节到达即停表，只有 101 Switching Protocols 才算升级成功
+            stages["ws"] = (time.perf_counter_ns() - start_ns) / 1e6 if parts[1:2] == [b"101"] else INF
+    except (OSError, asyncio.TimeoutError):
+        stages[stage] = INF
+    finally:
+        if writer is not None:
+            writer.close()
+        else:
+            sock.close()
+    return stages
+
+async def probe_node_for_king(node: str, king_system: Optional[NodeKingSystem] = None,
+                              requested_ns: Optional[int] = None,
+                              stats: Optional[ProbeStats] = None) -> tuple:
+    """多次建连测试单个节点，连通后再做TLS/WebSocket分层探测，把结果计入节点王系统，返回 (node, 中位延迟, success)
+    
+    requested_ns 为节点进入队列的时刻，排队时间单独汇总到 stats，不计入延迟。
+    """
+    parsed = parse_node(node)
+    if parsed is None or not parsed.host:
+        return node, float('inf'), False
+    
+    timeout = random.uniform(Config.TEST_TIMEOUT_MIN, Config.TEST_TIMEOUT_MAX)
+    timings = await sample_connect_async(parsed.host, parsed.port, timeout, Config.PROBE_SAMPLES,
+                                         Config.PROBE_SAMPLE_INTERVAL, requested_ns)
+    if stats is not None:
+        for timing in timings:
+            stats.record(timing)
+    samples = [timing.rtt_ms for timing in timings]
+    ok = sorted(ms for ms in samples if ms < float('inf'))
+    latency = ok[(len(ok) - 1) // 2] if ok else float('inf')
+    success = bool(ok)
+    
+    # 只有TCP连通的节点才进入更贵的TLS/WebSocket阶段
+    stages = None
+    if success and Config.STAGE_PROBE_ENABLED:
+        stages = await probe_stages_async(parsed, Config.STAGE_PROBE_TIMEOUT)
+        if stats is not None:
+            stats.record_stages(stages)
+        success = all(ms < INF for ms in stages.values())
+        if not success:
+            # 分层探测失败即整体记为失败，TCP样本不能再进入延迟分布和丢包率
+            samples = [INF] * len(samples)
+    
+    if king_system is not None:
+        king_system.update(node, latency, success, samples, stages)
+    
+    return node, latency, success
+
+async def measure_throughput_async(engine: 'ProbeEngine', url: str, proxy_url: str,
+                                   max_bytes: int, max_seconds: float) -> float:
+    """经代理下载有界负载，返回首字节之后的持续吞吐(Mbps)，失败返回0"""
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=Config.CONNECTION_TIMEOUT, sock_read=max_seconds)
+    received = first_size = 0
+    first_ns = last_ns = 0
+    try:
+        async with engine.session.get(url, proxy=proxy_url, timeout=timeout) as response:
+            if response.status != 200:
+                return 0.0
+            async for chunk in response.content.iter_chunked(Config.STREAM_CHUNK_SIZE):
+                last_ns = time.perf_counter_ns()
+                if not first_ns:
+                    first_ns, first_size = last_ns, len(chunk)
+                received += len(chunk)
+                if received >= max_bytes or last_ns - first_ns >= max_seconds * 1e9:
+                    break
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+        if not first_ns:
+            return 0.0
+    # 首个数据块只用来起表，TTFB 不计入吞吐
+    elapsed = (last_ns - first_ns) / 1e9
+    bits = (received - first_size) * 8
+    return bits / elapsed / 1e6 if elapsed > 0 and bits > 0 else 0.0
+
+async def bandwidth_stage_async(candidates: List[str], king_system: Optional[NodeKingSystem] = None,
+                                pool: Optional[CoreProxyPool] = None) -> Dict[str, float]:
+    """经本地核心逐个测试候选节点的吞吐并计入节点王系统，返回 {节点: Mbps}；没有可用核心时跳过"""
+    pool = pool or CoreProxyPool()
+    if not candidates or not pool.available:
+        logging.info("[📶] 未找到xray/v2ray核心，跳过带宽测试")
+        return {}
+    
+    nodes = [node for node in map(parse_node, candidates) if node and node.host]
+    # 同时下载会互相抢占本机带宽，逐个测试
+    gate = asyncio.Semaphore(1)
+    async with create_probe_engine(pool.pool_size * pool.batch_size) as engine:
+        async def check(node, proxy_url):
+            async with gate:
+                mbps = await measure_throughput_async(engine, Config.BANDWIDTH_URL, proxy_url,
+                                                      Config.BANDWIDTH_MAX_BYTES, Config.BANDWIDTH_MAX_SECONDS)
+            return node.raw, mbps
+        
+        results = dict(await pool.verify(nodes, check))
+    
+    if king_system is not None:
+        for node, mbps in results.items():
+            king_system.record_throughput(node, mbps)
+    if results:
+        best = max(results.values())
+        logging.info(f"[📶] 带宽测试完成: {sum(1 for v in results.values() if v > 0)}/{len(results)} 个节点可下载，"
+                     f"最高 {best:.1f}Mbps")
+    return results
+
+async def crown_king_async(alive: List[str], king_system: NodeKingSystem) -> Optional[str]:
+    """先对按得分排名靠前的存活节点做带宽测试，再选出节点王"""
+    if Config.BANDWIDTH_TEST_ENABLED and alive:
+        candidates = king_system.order_by_prior(alive)[:Config.BANDWIDTH_TOP_N]
+        await bandwidth_stage_async(candidates, king_system)
+    return crown_king(alive, king_system)
+
+def crown_king(alive: List[str], king_system: NodeKingSystem) -> Optional[str]:
+    """选出最佳节点王（包括历史和当前），存活列表按得分排序并把节点王放到最前面"""
+    king_node = None
+    # 🆕 使用最佳节点王（包括历史和当前）
+    best_king = king_system.get_best_king_overall()
+    
+    if best_king:
+        king_node = best_king['node']
+        if best_king.get('is_revived'):
+            logging.info(f"[👑] 已重新激活历史节点王: {best_king['node_id'][:8]} "
+                        f"延迟:{best_king['latency']:.1f}ms 得分:{best_king['score']:.1f}")
+        else:
+            logging.info(f"[👑] 使用最佳节点王: {best_king['node_id'][:8]} "
+                        f"延迟:{best_king['latency']:.1f}ms 得分:{best_king['score']:.1f}")
+    else:
+        # 回退到选择新的节点王
+        king_info = king_system.select_king()
+        if king_info:
+            king_node = king_info['node']
+    
+    # 其余节点按得分排序，节点王放在最前面
+    alive[:] = king_system.order_by_prior(alive)
+    if king_node and king_node in alive:
+        alive.remove(king_node)
+        alive.insert(0, king_node)
+    
+    # 日常检查和保存
+    if random.random() < 0.3:
+        king_system.daily_check()
+    
+    king_system.save()
+    
+    stats = king_system.stats()
+    logging.info(f"[测速] {len(alive)}个节点存活，平均延迟:{stats['avg_latency']:.1f}ms")
+    return king_node
+
+class _ResultRecorder:
+    """代替 NodeKingSystem，只记录 update 调用，由调用方统一合并（分片子进程、流式流水线）"""
+    
+    def __init__(self):
+        self.entries = []
+    
+    def update(self, node_str: str, latency: float, success: bool, samples: Optional[List[float]] = None,
+               stages: Optional[Dict[str, float]] = None):
+        self.entries.append((node_str, latency, success, samples, stages))
+
+
+async def _probe_shard_async(nodes: List[str], maximum: int) -> tuple:
+    recorder = _ResultRecorder()
+    stats = ProbeStats()
+    limiter = create_concurrency_limiter(maximum)
+    await preresolve_nodes(nodes)
+    
+    async def test(node):
+        result = await probe_node_for_king(node, recorder, time.perf_counter_ns(), stats)
+        limiter.observe(result[1])
+        return result
+    
+    async for _ in iter_bounded(nodes, test, limiter):
+        pass
+    return recorder.entries, stats
+
+def _probe_shard(nodes: List[str], maximum: int) -> tuple:
+    """分片子进程入口：独立事件循环、独立DNS缓存与并发窗口，返回 (测速记录, ProbeStats)"""
+    install_event_loop_policy()  # spawn 出的子进程不继承父进程的循环策略
+    return asyncio.run(_probe_shard_async(nodes, maximum))
+
+async def sharded_benchmark_nodes_async(nodes: List[str], king_system: NodeKingSystem = None) -> tuple:
+    """多进程分片测速：节点轮流分到各进程，解析与探测回调分摊到多个核心，结果一次性合并进节点王系统"""
+    processes = max(1, min(Config.SHARD_PROCESSES or os.cpu_count() or 1, len(nodes)))
+    shards = [nodes[i::processes] for i in range(processes)]
+    # 各进程共享全局并发上限，避免总连接数随核数成倍增长
+    maximum = max(Config.CONCURRENCY_MIN, Config.CONCURRENCY_MAX // processes)
+    logging.info(f"[🧩] {len(nodes)} 个节点分为 {processes} 片并行测速")
+    
+    loop = asyncio.get_running_loop()
+    # 统一用 spawn，子进程不继承父进程的事件循环与线程状态，各平台行为与 Windows 一致
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        shard_results = await asyncio.gather(*(
+            loop.run_in_executor(executor, _probe_shard, shard, maximum) for shard in shards
+        ))
+    
+    entries = []
+    stats = ProbeStats()
+    for shard_entries, shard_stats in shard_results:
+        entries.extend(shard_entries)
+        stats.merge(shard_stats)
+    logging.info(f"[⏱️] 测速统计: {stats.summary()}")
+    
+    freshness = get_freshness_index()
+    if freshness:
+        for node, latency, success, *_ in entries:
+            freshness.record(node, latency if success else INF)
+        save_freshness_index()
+    
+    use_king_system = Config.NODE_KING_ENABLED and king_system is not None
+    if use_king_system:
+        king_system.update_many(entries)
+    
+    passed = sorted((latency, node) for node, latency, success, *_ in entries
+                    if success and latency < Config.MAX_TEST_LATENCY)
+    alive = [node for _, node in passed]
+    king_node = await crown_king_async(alive, king_system) if use_king_system else None
+    return alive[:Config.MAX_NODES], king_node
+
 async def enhanced_benchmark_nodes_async(nodes: List[str], king_system: NodeKingSystem = None) -> tuple:
-    """增强版节点测速 - 集成节点王机制（使用最佳节点王）"""
+    """增强版节点测速 - 集成节点王机制（使用最佳节点王）
+    
+    开启 EARLY_EXIT_ENABLED 时按历史得分先测强节点，找到目标数量的可用节点或超出时间预算即停止；
+    时间预算在每个结果返回时检查，最多超出一次探测的超时时间。
+    """
     if not nodes:
         return [], None
     
-    use_king_system = Config.NODE_KING_ENABLED and king_system is not None
-    
-    async def test_node(node: str):
-        """测试单个节点"""
-        host, port = None, 443
-        try:
-            if node.startswith("vmess://"):
-                content = node[8:]
-                padding = len(content) % 4
-                if padding:
-                    content += '=' * (4 - padding)
-                data = json.loads(base64.b64decode(content).decode('utf-8'))
-                host = data.get("add", "")
-                port = int(data.get("port", 443))
-        except:
-            pass
-        
-        if not host:
-            return node, float('inf'), False
-        
-        timeout = random.uniform(Config.TEST_TIMEOUT_MIN, Config.TEST_TIMEOUT_MAX)
-        start = time.time()
-        success = False
-        
-        try:
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(host, port),
-                timeout=timeout
-            )
-            writer.close()
-            await writer.wait_closed()
-            success = True
-        except:
-            success = False
-        
-        latency = (time.time() - start) * 1000 if success else float('inf')
-        
-        if use_king_system:
-            king_system.update(node, latency, success)
-        
-        return node, latency, success
+    if Config.SHARD_ENABLED and len(nodes) >= Config.SHARD_MIN_NODES:
+        return await sharded_benchmark_nodes_async(nodes, king_system)
     
-    semaphore = asyncio.Semaphore(min(Config.MAX_CONCURRENT_REQUESTS, 50))
+    use_king_system = Config.NODE_KING_ENABLED and king_system is not None
+    tracker = king_system if use_king_system else None
     
-    async def bounded_test(node):
-        async with semaphore:
-            return await test_node(node)
+    early_exit = Config.EARLY_EXIT_ENABLED
+    target = (Config.EARLY_EXIT_TARGET or Config.MAX_NODES) if early_exit else 0
+    budget = Config.BENCHMARK_TIME_BUDGET if early_exit else 0
+    deadline = time.monotonic() + budget if budget > 0 else INF
+    if early_exit and use_king_system:
+        nodes = king_system.order_by_prior(nodes, Config.EARLY_EXIT_EXPLORE)
     
-    tasks = [bounded_test(node) for node in nodes]
-    results = await asyncio.gather(*tasks)
+    limiter = create_concurrency_limiter()
+    if not early_exit:
+        # 提前结束时大部分节点不会被测到，改为探测时按需解析
+        await preresolve_nodes(nodes)
+    stats = ProbeStats()
     
     alive = []
-    for node, latency, success in results:
-        if success and latency < Config.MAX_TEST_LATENCY:
-            alive.append(node)
+    probed = set()
+    freshness = get_freshness_index()
+    
+    async def test(item):
+        node, requested_ns = item
+        result = await probe_node_for_king(node, tracker, requested_ns, stats)
+        probed.add(node)
+        limiter.observe(result[1])
+        if freshness:
+            freshness.record(node, result[1] if result[2] else INF)
+        return result
+    
+    # 生成器在节点真正入队时才取时间戳，排队时间从入队算起
+    queued = ((node, time.perf_counter_ns()) for node in nodes)
+    results = iter_bounded(queued, test, limiter)
+    try:
+        async for node, latency, success in results:
+            if success and latency < Config.MAX_TEST_LATENCY:
+                alive.append(node)
+                if target and len(alive) >= target:
+                    logging.info(f"[🎯] 已找到 {len(alive)} 个可用节点，提前结束测速")
+                    break
+            if time.monotonic() >= deadline:
+                logging.info(f"[⏰] 测速时间预算 {budget:.0f}s 已用完，已找到 {len(alive)} 个可用节点")
+                break
+    finally:
+        # 立即取消剩余任务，而不是等生成器被回收
+        await results.aclose()
+    logging.info(f"[⏱️] 测速统计: {stats.summary()}，{limiter.summary()}")
+    save_freshness_index()
     
     king_node = None
     if use_king_system:
-        # 🆕 使用最佳节点王（包括历史和当前）
-        best_king = king_system.get_best_king_overall()
-        
-        if best_king:
-            king_node = best_king['node']
-            if best_king.get('is_revived'):
-                logging.info(f"[👑] 已重新激活历史节点王: {best_king['node_id'][:8]} "
-                            f"延迟:{best_king['latency']:.1f}ms 得分:{best_king['score']:.1f}")
-            else:
-                logging.info(f"[👑] 使用最佳节点王: {best_king['node_id'][:8]} "
-                            f"延迟:{best_king['latency']:.1f}ms 得分:{best_king['score']:.1f}")
-        else:
-            # 回退到选择新的节点王
-            king_info = king_system.select_king()
-            if king_info:
-                king_node = king_info['node']
-        
-        # 确保节点王在最前面
-        if king_node and king_node in alive:
-            if king_node in alive:
-                alive.remove(king_node)
-            alive.insert(0, king_node)
-        
-        # 日常检查和保存
-        if random.random() < 0.3:
-            king_system.daily_check()
-        
-        king_system.save()
-        
-        stats = king_system.stats()
-        logging.info(f"[测速] {len(alive)}个节点存活，平均延迟:{stats['avg_latency']:.1f}ms")
+        if len(probed) < len(nodes):
+            king_system.mark_seen([node for node in nodes if node not in probed])
+        king_node = await crown_king_async(alive, king_system)
     
     return alive[:Config.MAX_NODES], king_node
 
@@ -1713,6 +3911,93 @@ def extract_node_url(node_page_url: str) -> Optional[str]:
     
     return None
 
+# === 流式订阅解析 ===
+_BASE64_ALPHABET = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=-_ \r\n\t')
+_URLSAFE_TO_STD = bytes.maketrans(b'-_', b'+/')
+
+class SubscriptionStreamDecoder:
+    """订阅内容增量解码器：自动识别base64/明文，分块输入、逐行输出"""
+    
+    HEAD_BYTES = 64
+    
+    def __init__(self):
+        self.mode = None        # 'base64' 或 'plain'，由开头内容判定
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._head = b''
+        self._b64_rest = b''
+        self._text = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._line_rest = ''
+    
+    def feed(self, chunk: bytes) -> List[str]:
+        """输入一个数据块，返回其中已完整的行"""
+        self.bytes_in += len(chunk)
+        if self.mode is None:
+            self._head += chunk
+            if len(self._head.lstrip()) < self.HEAD_BYTES:
+                return []
+            chunk, self._head = self._head, b''
+            self._detect(chunk)
+        return self._split(self._decode(chunk, final=False))
+    
+    def finish(self) -> List[str]:
+        """输入结束，返回剩余的行"""
+        chunk = b''
+        if self.mode is None:
+            chunk, self._head = self._head, b''
+            self._detect(chunk)
+        lines = self._split(self._decode(chunk, final=True))
+        tail = self._line_rest.strip()
+        self._line_rest = ''
+        if tail:
+            lines.append(tail)
+        return lines
+    
+    def _detect(self, head: bytes):
+        sample = head.lstrip()[:self.HEAD_BYTES]
+        is_base64 = bool(sample) and all(b in _BASE64_ALPHABET for b in sample)
+        self.mode = 'base64' if is_base64 else 'plain'
+    
+    def _decode(self, chunk: bytes, final: bool) -> str:
+        if self.mode == 'base64':
+            data = self._b64_rest + b''.join(chunk.split()).translate(_URLSAFE_TO_STD)
+            if final:
+                data += b'=' * (-len(data) % 4)
+                cut = len(data)
+            else:
+                cut = len(data) - len(data) % 4
+            data, self._b64_rest = data[:cut], data[cut:]
+            try:
+                chunk = base64.b64decode(data)
+            except Exception as e:
+                logging.warning(f"[⚠️] base64解码失败: {e}，跳过该数据块")
+                chunk = b''
+        self.bytes_out += len(chunk)
+        return self._text.decode(chunk, final)
+    
+    def _split(self, text: str) -> List[str]:
+        if not text:
+            return []
+        parts = (self._line_rest + text).split('\n')
+        self._line_rest = parts.pop()
+        return [line.strip() for line in parts if line.strip()]
+
+def iter_subscription_lines(response, decoder: Optional[SubscriptionStreamDecoder] = None):
+    """从 requests 流式响应中逐行产出节点链接"""
+    decoder = decoder or SubscriptionStreamDecoder()
+    for chunk in response.iter_content(chunk_size=Config.STREAM_CHUNK_SIZE):
+        yield from decoder.feed(chunk)
+    yield from decoder.finish()
+
+async def aiter_subscription_lines(response, decoder: Optional[SubscriptionStreamDecoder] = None):
+    """从 aiohttp 响应中异步逐行产出节点链接"""
+    decoder = decoder or SubscriptionStreamDecoder()
+    async for chunk in response.content.iter_chunked(Config.STREAM_CHUNK_SIZE):
+        for line in decoder.feed(chunk):
+            yield line
+    for line in decoder.finish():
+        yield line
+
 @smart_retry(max_retries=3)
 def download_nodes_file(node_url: str) -> (bool, List[str]):
     """下载节点文件并保存到本地"""
@@ -1724,100 +4009,26 @@ def download_nodes_file(node_url: str) -> (bool, List[str]):
         
         time.sleep(random.uniform(0.5, 1.5))
         
-        response = requests.get(node_url, headers=headers, timeout=15)
+        response = requests.get(node_url, headers=headers, timeout=15, stream=True)
         response.raise_for_status()
         
-        content_length = len(response.text)
-        logging.info(f"[📥] 成功下载节点文件，大小: {content_length / 1024:.2f}KB")
-        
-        # 尝试解码base64内容
-        downloaded_content = response.text.strip()
-        lines = []
-        
-        # 检查是否是base64编码的内容（vless://、vmess://等协议通常不会以base64开头）
-        try:
-            if not (downloaded_content.startswith("vless://") or downloaded_content.startswith("vmess://") or 
-                    downloaded_content.startswith("trojan://") or downloaded_content.startswith("ss://")):
-                # 尝试base64解码
-                decoded_bytes = base64.b64decode(downloaded_content)
-                decoded_content = decoded_bytes.decode('utf-8')
-                logging.info(f"[✅] 成功解码base64内容，解码后大小: {len(decoded_content) / 1024:.2f}KB")
-                
-                # 解码后再分割行
-                lines = decoded_content.strip().split('\n')
-            else:
-                # 如果已经是直接的节点链接格式，直接分割
-                lines = downloaded_content.split('\n')
-        except Exception as e:
-            logging.warning(f"[⚠️] base64解码失败: {e}，尝试直接处理")
-            lines = downloaded_content.split('\n')
-        
-        # 过滤空行
-        lines = [line.strip() for line in lines if line.strip()]
-        
-        logging.info(f"[📋] 共解析到 {len(lines)} 个节点")
-        
+        # 分块读取、增量解码、逐行去重，不在内存中保留整份订阅
+        decoder = SubscriptionStreamDecoder()
+        dedup = NodeDeduplicator()
         unique_lines = []
-        seen_node_identifiers = set()
+        total_lines = 0
         
-        for line in lines:
-            if not line.strip():
-                continue
-                
-            node_identifier = None
-            
-            if line.startswith("vmess://"):
-                try:
-                    vmess_content = line[8:]
-                    padding = len(vmess_content) % 4
-                    if padding:
-                        vmess_content += '=' * (4 - padding)
-                    
-                    vmess_json = json.loads(base64.b64decode(vmess_content).decode('utf-8', errors='ignore'))
-                    address = vmess_json.get("add", "")
-                    port = str(vmess_json.get("port", ""))
-                    if address and port:
-                        node_identifier = f"{address}:{port}"
-                except Exception:
-                    pass
-            
-            elif line.startswith("trojan://"):
-                try:
-                    pattern = r'trojan://[^@]+@([^:]+):(\d+)'
-                    match = re.search(pattern, line)
-                    if match:
-                        address = match.group(1)
-                        port = match.group(2)
-                        node_identifier = f"{address}:{port}"
-                except Exception:
-                    pass
-            
-            elif line.startswith("ss://"):
-                try:
-                    ss_content = line[5:]
-                    if '#' in ss_content:
-                        ss_content = ss_content.split('#')[0]
-                    padding = len(ss_content) % 4
-                    if padding:
-                        ss_content += '=' * (4 - padding)
-                    
-                    decoded = base64.b64decode(ss_content).decode('utf-8', errors='ignore')
-                    pattern = r'[^@]+@([^:]+):(\d+)'
-                    match = re.search(pattern, decoded)
-                    if match:
-                        address = match.group(1)
-                        port = match.group(2)
-                        node_identifier = f"{address}:{port}"
-                except Exception:
-                    pass
-            
-            if node_identifier and node_identifier not in seen_node_identifiers:
-                seen_node_identifiers.add(node_identifier)
-                unique_lines.append(line)
-            elif not node_identifier and line not in unique_lines:
-                unique_lines.append(line)
+        with response:
+            for line in iter_subscription_lines(response, decoder):
+                total_lines += 1
+                if dedup.accept(line):
+                    unique_lines.append(line)
+        dedup.close()
         
-        unique_content = '\n'.join(unique_lines)
+        logging.info(f"[📥] 成功下载节点文件，大小: {decoder.bytes_in / 1024:.2f}KB")
+        if decoder.mode == 'base64':
+            logging.info(f"[✅] 成功解码base64内容，解码后大小: {decoder.bytes_out / 1024:.2f}KB")
+        logging.info(f"[📋] 共解析到 {total_lines} 个节点")
         
         if Config.ENABLE_NODE_FILTERING and len(unique_lines) > Config.MAX_NODES:
             if has_async and Config.ENABLE_SPEED_TEST:
@@ -1829,9 +4040,9 @@ def download_nodes_file(node_url: str) -> (bool, List[str]):
         
         unique_content = '\n'.join(unique_lines)
         
-        if len(unique_lines) < len(lines):
-            removed_count = len(lines) - len(unique_lines)
-            logging.info(f"[🧹] 节点去重完成，从{len(lines)}个节点中去除了{removed_count}个重复/低质量节点")
+        if len(unique_lines) < total_lines:
+            removed_count = total_lines - len(unique_lines)
+            logging.info(f"[🧹] 节点去重完成，从{total_lines}个节点中去除了{removed_count}个重复/低质量节点")
         
         nodes_path = get_nodes_path()
         
@@ -1850,15 +4061,6 @@ def download_nodes_file(node_url: str) -> (bool, List[str]):
         logging.error(f"[❌] 保存节点文件失败: {e}")
         return False, []
 
-_global_connection_pool = None
-
-def get_connection_pool() -> ConnectionPool:
-    """获取全局连接池实例"""
-    global _global_connection_pool
-    if _global_connection_pool is None:
-        _global_connection_pool = ConnectionPool(max_connections=Config.MAX_CONCURRENT_REQUESTS)
-    return _global_connection_pool
-
 async def download_nodes_file_async(node_url: str) -> bool:
     """异步下载节点文件并保存到本地"""
     if not has_async:
@@ -1871,77 +4073,61 @@ async def download_nodes_file_async(node_url: str) -> bool:
         
         headers = get_random_headers(stealth=True)
         
-        # 使用连接池获取会话
-        pool = get_connection_pool()
-        session = await pool.acquire()
-        try:
-            async with session.get(node_url, headers=headers, timeout=10) as response:
-                response.raise_for_status()
-                content = await response.text()
-                content_length = len(content)
-                logging.info(f"[📥] 成功下载节点文件，大小: {content_length / 1024:.2f}KB")
-        finally:
-            pool.release()
-        
-        lines = content.strip().split('\n')
-        logging.info(f"[📝] 共解析到 {len(lines)} 行内容")
-        
-        unique_lines = []
-        seen_node_identifiers = set()
-        valid_protocols = ['vmess://', 'vless://', 'trojan://', 'shadowsocks://']
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+        # 下载共用一个探测引擎，逐节点检查另建按核心池规模配置的引擎
+        async with create_probe_engine() as engine:
+            session = await engine.acquire()
+            try:
+                async with session.get(node_url, headers=headers, timeout=10) as response:
+                    response.raise_for_status()
+                    content = await response.text()
+                    content_length = len(content)
+                    logging.info(f"[📥] 成功下载节点文件，大小: {content_length / 1024:.2f}KB")
+            finally:
+                engine.release()
+        
+            lines = content.strip().split('\n')
+            logging.info(f"[📝] 共解析到 {len(lines)} 行内容")
+        
+            unique_lines = []
+            dedup = NodeDeduplicator()
+        
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
             
-            # 检查是否为有效的节点协议
-            if not any(line.startswith(protocol) for protocol in valid_protocols):
-                continue
+                # 检查是否为有效的节点协议
+                if not line.startswith(SUPPORTED_NODE_SCHEMES):
+                    continue
             
-            # 去重处理
-            if line not in unique_lines:
-                unique_lines.append(line)
+                # 去重处理
+                if dedup.accept(line):
+                    unique_lines.append(line)
+            dedup.close()
         
-        logging.info(f"[🔍] 去重后剩余 {len(unique_lines)} 个有效节点")
+            logging.info(f"[🔍] 去重后剩余 {len(unique_lines)} 个有效节点")
         
-        # 如果没有有效节点，直接返回
-        if not unique_lines:
-            logging.warning("[⚠️] 没有找到有效的节点")
-            return False
+            # 如果没有有效节点，直接返回
+            if not unique_lines:
+                logging.warning("[⚠️] 没有找到有效的节点")
+                return False
         
-        # 使用节点王评分系统进行筛选
-        if Config.ENABLE_NODE_FILTERING and has_async:
-            logging.info("[🧠] 正在使用节点王评分系统筛选节点...")
-            
-            # 准备需要测试的节点
-            nodes_to_test = []
-            for node in unique_lines:
-                if node.startswith("vmess://"):
-                    vmess = parse_vmess(node)
-                    if vmess and "add" in vmess and "port" in vmess:
-                        nodes_to_test.append({
-                            "proxy": "socks5://127.0.0.1:10808",
-                            "host": vmess["add"],
-                            "port": int(vmess["port"]),
-                            "original_node": node
-                        })
-            
-            # 如果有可测试的节点，进行评分
-            if nodes_to_test:
-                logging.info(f"[🧪] 正在测试 {len(nodes_to_test)} 个vmess节点...")
-                results = await node_king_benchmark_async(nodes_to_test)
+            # 使用节点王评分系统进行筛选
+            if Config.ENABLE_NODE_FILTERING and has_async:
+                logging.info("[🧠] 正在使用节点王评分系统筛选节点...")
+                
+                # 每个节点经由本地核心的独立入站端口测试
+                logging.info(f"[🧪] 正在通过本地核心测试 {len(unique_lines)} 个节点...")
+                results = await verify_nodes_via_core(unique_lines)
                 
                 if results:
                     logging.info(f"[✅] 测试完成，{len(results)} 个节点通过验证")
                     # 按评分排序并取前MAX_NODES个
                     unique_lines = [result["original_node"] for result in results[:Config.MAX_NODES]]
                     logging.info(f"[🏆] 最优节点: 评分 {results[0]['score']:.1f}，延迟 {results[0]['latency']:.2f}ms")
-                else:
+                elif results is not None:
                     logging.warning("[⚠️] 没有节点通过Google检查，将使用原始节点列表")
-            else:
-                logging.info("[ℹ️] 没有可测试的vmess节点，将使用原始节点列表")
-        
+
         # 保存节点到文件
         nodes_path = get_nodes_path()
         async with aiofiles.open(nodes_path, 'w', encoding='utf-8') as f:
@@ -1950,7 +4136,7 @@ async def download_nodes_file_async(node_url: str) -> bool:
         logging.info(f"[✅] 节点文件已保存到 {nodes_path}，共 {len(unique_lines)} 个节点")
         
         # 清理内存
-        del content, lines, seen_node_identifiers
+        del content, lines, dedup
         import gc
         gc.collect()
         
@@ -1960,6 +4146,66 @@ async def download_nodes_file_async(node_url: str) -> bool:
         logging.error(f"[❌] 异步下载失败: {e}")
         return False
 
+@smart_retry_async(max_retries=3)
+async def stream_download_and_benchmark_async(node_url: str, king_system: NodeKingSystem = None) -> tuple:
+    """流式流水线：边下载边解析去重，节点一到达就交给测速协程，返回 (存活节点, 节点王, 去重后全部节点)"""
+    use_king_system = Config.NODE_KING_ENABLED and king_system is not None
+    # 下载中途失败会整体重试，测速结果先暂存，完整读完后才计入节点王系统，避免重复计数
+    recorder = _ResultRecorder() if use_king_system else None
+    
+    unique_lines = []
+    results = {}
+    decoder = SubscriptionStreamDecoder()
+    dedup = NodeDeduplicator()
+    stats = ProbeStats()
+    limiter = create_concurrency_limiter()
+    
+    async def produce(engine):
+        headers = get_random_headers(stealth=True)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=Config.CONNECTION_TIMEOUT)
+        async with engine.session.get(node_url, headers=headers, timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in aiter_subscription_lines(response, decoder):
+                if not dedup.accept(line):
+                    continue
+                unique_lines.append(line)
+                yield line, time.perf_counter_ns()
+    
+    fake_logging()
+    logging.info(f"[⚡] 正在流式下载并测速: {node_url[:20]}...")
+    freshness = get_freshness_index()
+    
+    async def test(item):
+        node, requested_ns = item
+        result = await probe_node_for_king(node, recorder, requested_ns, stats)
+        limiter.observe(result[1])
+        if freshness:
+            freshness.record(node, result[1] if result[2] else INF)
+        return result
+    
+    completed = False
+    try:
+        # 引擎只用于下载订阅，测速直接走 connect_stamped_async
+        async with create_probe_engine() as engine:
+            # 下载必须读完才能返回完整节点列表，这里不提前结束
+            async for node, latency, success in iter_bounded(produce(engine), test, limiter,
+                                                             Config.STREAM_QUEUE_SIZE):
+                results[node] = success and latency < Config.MAX_TEST_LATENCY
+        completed = True
+    finally:
+        # 失败时不保存布隆过滤器，否则重试会把本次读到的节点全部当作跨天重复丢弃
+        dedup.close(save=completed)
+    
+    logging.info(f"[📥] 流式下载完成，大小: {decoder.bytes_in / 1024:.2f}KB，去重后 {len(unique_lines)} 个节点")
+    logging.info(f"[⏱️] 测速统计: {stats.summary()}，{limiter.summary()}")
+    save_freshness_index()
+    if use_king_system:
+        king_system.update_many(recorder.entries)
+    
+    alive = [node for node in unique_lines if results.get(node)]
+    king_node = await crown_king_async(alive, king_system) if use_king_system else None
+    return alive[:Config.MAX_NODES], king_node, unique_lines
+
 def handle_unexpected_error(exctype, value, traceback):
     """处理未捕获的异常，确保程序优雅退出"""
     logging.error(f"[💥] 发生未预期的错误: {exctype.__name__}: {value}")
@@ -1980,6 +4226,8 @@ def main():
     """程序主入口函数 - 集成节点王机制"""
     setup_logging()
     logging.info("开始运行 - 节点王残酷淘汰系统")
+    if has_async:
+        install_event_loop_policy()
     
     king_system = None
     if Config.NODE_KING_ENABLED:
@@ -2007,26 +4255,43 @@ def main():
         logging.error("[错误] 未找到节点文件")
         sys.exit(1)
     
-    success, raw_nodes = download_nodes_file(node_url)
-    if not success:
-        logging.error("[错误] 下载节点失败")
-        sys.exit(1)
-    
-    logging.info(f"[下载] 共{len(raw_nodes)}个节点")
-    
-    logging.info("[测速] 开始节点测速")
-    
-    if has_async and Config.ENABLE_SPEED_TEST:
-        import asyncio
+    # 提前结束要给完整节点列表排序、分片要按总数切分，这两种模式只能先下载再测速
+    streaming = (Config.ENABLE_STREAMING_PIPELINE and not Config.EARLY_EXIT_ENABLED
+                 and not Config.SHARD_ENABLED)
+    if has_async and Config.ENABLE_SPEED_TEST and streaming:
+        logging.info("[测速] 开始流式下载并测速")
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
-        alive_nodes, king_node = loop.run_until_complete(
-            enhanced_benchmark_nodes_async(raw_nodes, king_system)
-        )
+        try:
+            alive_nodes, king_node, raw_nodes = loop.run_until_complete(
+                stream_download_and_benchmark_async(node_url, king_system)
+            )
+        except Exception as e:
+            logging.error(f"[错误] 下载节点失败: {e}")
+            sys.exit(1)
+        
+        logging.info(f"[下载] 共{len(raw_nodes)}个节点")
     else:
-        alive_nodes = raw_nodes[:Config.MAX_NODES]
-        king_node = None
+        success, raw_nodes = download_nodes_file(node_url)
+        if not success:
+            logging.error("[错误] 下载节点失败")
+            sys.exit(1)
+        
+        logging.info(f"[下载] 共{len(raw_nodes)}个节点")
+        
+        logging.info("[测速] 开始节点测速")
+        
+        if has_async and Config.ENABLE_SPEED_TEST:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            
+            alive_nodes, king_node = loop.run_until_complete(
+                enhanced_benchmark_nodes_async(raw_nodes, king_system)
+            )
+        else:
+            alive_nodes = raw_nodes[:Config.MAX_NODES]
+            king_node = None
     
     nodes_path = get_nodes_path()
     with open(nodes_path, 'w', encoding='utf-8') as f:
@@ -2043,15 +4308,23 @@ def main():
             logging.info(f"[👑] 最佳节点王: {best_king['node_id'][:8]} {king_type}{king_status}")
             logging.info(f"      得分:{best_king['score']:.1f} 延迟:{best_king['latency']:.1f}ms")
     
-    if not add_nodes_to_mibei_group(king_node):
-        logging.warning("[警告] 添加节点到分组失败")
-    
-    if king_node:
-        if set_best_node_as_default(king_node, "节点王"):
-            logging.info("[成功] 节点王已设为默认节点")
-    
-    if update_v2rayn_subscription(node_url):
-        logging.info("[成功] 订阅已更新")
+    # 分组、默认节点与订阅在同一个事务里修改，配置只读写一次
+    config_tx = V2rayNConfigTransaction.open()
+    if config_tx:
+        if not add_nodes_to_mibei_group(king_node, config_tx):
+            logging.warning("[警告] 添加节点到分组失败")
+        
+        if king_node:
+            if set_best_node_as_default(king_node, "节点王", config_tx):
+                logging.info("[成功] 节点王已设为默认节点")
+        
+        if update_v2rayn_subscription(node_url, config_tx):
+            logging.info("[成功] 订阅已更新")
+        
+        if not config_tx.commit():
+            logging.warning("[警告] 配置写回失败")
+    else:
+        logging.warning("[警告] 找不到v2rayN配置文件，跳过节点导入与订阅更新")
     
     if restart_v2rayn():
         logging.info("[成功] v2rayN已重启")
@@ -2085,10 +4358,14 @@ def update_and_restart_if_needed():
     if not success:
         return
     
-    if not add_nodes_to_mibei_group(best_node):
+    config_tx = V2rayNConfigTransaction.open()
+    if not config_tx:
+        return
+    
+    if not add_nodes_to_mibei_group(best_node, config_tx):
         logging.warning("添加节点到米贝分组失败，但继续执行后续步骤")
     
-    if update_v2rayn_subscription(node_url):
+    if update_v2rayn_subscription(node_url, config_tx) and config_tx.commit():
         restart_v2rayn()
 
 def generate_silent_bat_and_vbs(script_name: str = "v2ray_auto_updater.py", bat_name: str = "run_v2ray_silent.bat", vbs_name: str = "silent_runner.vbs"):
@@ -2399,42 +4676,13 @@ def parse_proxy_node(node: str) -> Dict[str, Any]:
         "remarks": ""
     }
     
-    try:
-        if node.startswith("vmess://"):
-            info["protocol"] = "vmess"
-            vmess_content = node[8:]
-            padding = len(vmess_content) % 4
-            if padding:
-                vmess_content += '=' * (4 - padding)
-            vmess_json = json.loads(base64.b64decode(vmess_content).decode('utf-8', errors='ignore'))
-            info["ip"] = vmess_json.get("add")
-            info["port"] = vmess_json.get("port")
-            info["remarks"] = vmess_json.get("ps", "")
-        elif node.startswith("trojan://"):
-            info["protocol"] = "trojan"
-            pattern = r'trojan://[^@]+@([^:]+):(\d+)(?:#(.*))?'
-            match = re.search(pattern, node)
-            if match:
-                info["ip"] = match.group(1)
-                info["port"] = int(match.group(2))
-                info["remarks"] = match.group(3) or ""
-        elif node.startswith("ss://"):
-            info["protocol"] = "ss"
-            ss_content = node[5:]
-            if '#' in ss_content:
-                ss_content, _ = ss_content.split('#', 1)
-            padding = len(ss_content) % 4
-            if padding:
-                ss_content += '=' * (4 - padding)
-            decoded = base64.b64decode(ss_content).decode('utf-8', errors='ignore')
-            pattern = r'[^:]+:[^@]+@([^:]+):(\d+)'
-            match = re.search(pattern, decoded)
-            if match:
-                info["ip"] = match.group(1)
-                info["port"] = int(match.group(2))
-    except Exception as e:
-        logging.debug(f"解析节点失败: {e}")
-    
+    parsed = parse_node(node)
+    if parsed:
+        info["protocol"] = parsed.protocol
+        info["ip"] = parsed.host
+        info["port"] = parsed.port
+        info["remarks"] = parsed.remarks
+
     return info
 
 def merge_nodes(new_nodes: List[str], existing_nodes: List[str]) -> List[str]:
@@ -2577,4 +4825,5 @@ def ultimate_stealth():
     logging.info(random.choice(stealth_messages))
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包后的可执行文件以 spawn 启动分片子进程时需要
     main()
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""带宽测试：经本地替身代理下载有界负载，吞吐计入节点王系统"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+CHUNK = 64 * 1024
+CHUNKS = 64
+PAYLOAD_URL = "http://bandwidth.invalid/payload"
+
+
+async def start_standin_proxy(requests: list):
+    """本地HTTP服务兼作替身代理：代理请求使用绝对URI，按路径分发到下载负载"""
+    async def payload(request):
+        requests.append(str(request.url))
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for _ in range(CHUNKS):
+            await response.write(b"x" * CHUNK)
+            await asyncio.sleep(0.002)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/payload", payload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def bandwidth_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.Config, 'BANDWIDTH_URL', PAYLOAD_URL)
+    monkeypatch.setattr(nodes.Config, 'BANDWIDTH_MAX_BYTES', CHUNK * CHUNKS)
+
+
+def test_measure_throughput_through_proxy(bandwidth_config):
+    async def run():
+        requests = []
+        runner, proxy_url = await start_standin_proxy(requests)
+        try:
+            async with nodes.create_probe_engine(4) as engine:
+                mbps = await nodes.measure_throughput_async(engine, PAYLOAD_URL, proxy_url,
+                                                            CHUNK * CHUNKS, 8.0)
+        finally:
+            await runner.cleanup()
+        return mbps, requests
+
+    mbps, requests = asyncio.run(run())
+    assert requests == [PAYLOAD_URL]
+    # 负载按约 2ms 一块写出，吞吐有上限；只校验量级而不是具体数值
+    assert 1 < mbps < 10000
+
+
+def test_bandwidth_stage_records_throughput(bandwidth_config):
+    links = [f"trojan://pw{i}@h{i}.example:443#n{i}" for i in range(3)]
+    king_system = nodes.NodeKingSystem()
+    for link in links:
+        king_system.update(link, 50.0, True)
+
+    async def run():
+        requests = []
+        runner, proxy_url = await start_standin_proxy(requests)
+        try:
+            results = await nodes.bandwidth_stage_async(links, king_system,
+                                                        nodes.CoreProxyPool(standin_proxy=proxy_url))
+        finally:
+            await runner.cleanup()
+        return results, requests
+
+    results, requests = asyncio.run(run())
+    assert set(results) == set(links) and all(mbps > 0 for mbps in results.values())
+    assert len(requests) == len(links)
+    s = king_system.nodes
+    for link in links:
+        assert s.throughput_mbps[s.row_of(king_system.get_id(link))] == pytest.approx(results[link])
+
+
+def test_bandwidth_stage_skips_without_core(bandwidth_config, monkeypatch):
+    monkeypatch.setattr(nodes.CoreProxyPool, 'find_executable', staticmethod(lambda: None))
+    pool = nodes.CoreProxyPool(standin_proxy="")
+    assert asyncio.run(nodes.bandwidth_stage_async(["trojan://pw@h.example:443"], None, pool)) == {}
@@ -0,0 +1,144 @@
+"""批量评分引擎差分测试：BatchScorer 的 NumPy 路径与纯Python路径都必须与原 _calculate_score 逐位一致"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+INF = float('inf')
+
+
+def reference_score(data: dict) -> float:
+    """原 NodeKingSystem._calculate_score 公式（逐行字典版），作为对照实现"""
+    success_score = data['success_rate'] * 40 if data['tests'] > 0 else 0
+
+    speed_score = 0
+    if data['avg_latency'] < float('inf'):
+        if data['avg_latency'] <= 100:
+            speed_score = 30
+        elif data['avg_latency'] <= 500:
+            speed_score = 30 * (1 - (data['avg_latency'] - 100) / 400)
+
+    stability_score = 0
+    if (data['best_latency'] < float('inf') and
+        data['worst_latency'] > 0 and
+        data['worst_latency'] - data['best_latency'] <= 100):
+        stability_score = 20
+    elif (data['best_latency'] < float('inf') and
+          data['worst_latency'] > 0):
+        latency_range = data['worst_latency'] - data['best_latency']
+        if latency_range <= 300:
+            stability_score = 20 * (1 - (latency_range - 100) / 200)
+
+    persistence_score = min(10, data['age_days'])
+    penalty = data['consecutive_fails'] * 5
+    return max(0, success_score + speed_score + stability_score + persistence_score - penalty)
+
+
+def random_row(rng: random.Random) -> dict:
+    """随机生成一行原始计数与延迟列，刻意覆盖 inf、0 以及各分段边界值"""
+    tests = rng.choice([0, 1, 5, rng.randint(0, 500)])
+    success = rng.choice([0, tests, rng.randint(0, tests)])
+    if success == 0 or rng.random() < 0.2:
+        best, worst, count, avg = INF, 0.0, 0, INF
+    else:
+        best = rng.choice([0.0, 1.0, 50.0, rng.uniform(0, 800)])
+        worst = best + rng.choice([0.0, 100.0, 300.0, rng.uniform(0, 600)])
+        count = rng.randint(1, success)
+        avg = rng.choice([100.0, 500.0, best, worst, rng.uniform(best, worst)])
+    return {
+        'tests': tests,
+        'success': success,
+        'total_latency': avg * count if count else 0.0,
+        'latency_count': count,
+        'best_latency': best,
+        'worst_latency': worst,
+        'age_days': rng.randint(0, 30),
+        'consecutive_fails': rng.choice([0, 0, 1, rng.randint(0, 30)]),
+    }
+
+
+def build_store(rows: list) -> 'nodes.NodeStatsStore':
+    store = nodes.NodeStatsStore()
+    for i, data in enumerate(rows):
+        row = store.add(f"node{i}", f"trojan://pw@h{i}.example:443", 0.0)
+        for name, value in data.items():
+            getattr(store, name)[row] = value
+    return store
+
+
+def reference_rows(store: 'nodes.NodeStatsStore') -> list:
+    """按原公式需要的字段读回存储（float 列已按存储精度取整，成功率与平均延迟由计数推导）"""
+    return [{
+        'tests': store.tests[row],
+        'success_rate': store.success_rate(row),
+        'avg_latency': store.avg_latency(row),
+        'best_latency': store.best_latency[row],
+        'worst_latency': store.worst_latency[row],
+        'age_days': store.age_days[row],
+        'consecutive_fails': store.consecutive_fails[row],
+    } for row in range(len(store))]
+
+
+@pytest.fixture
+def rows():
+    rng = random.Random(20240101)
+    return [random_row(rng) for _ in range(5000)]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def scorer_path(request, monkeypatch):
+    if request.param == 'numpy' and not nodes.has_numpy:
+        pytest.skip("numpy未安装")
+    monkeypatch.setattr(nodes, 'has_numpy', request.param == 'numpy')
+    return request.param
+
+
+def test_batch_scores_match_reference(rows, scorer_path):
+    store = build_store(rows)
+    expected = [reference_score(data) for data in reference_rows(store)]
+    scores = nodes.BatchScorer.score_all(store)
+    assert scores == expected
+    assert list(store.score) == expected
+
+
+def test_p95_replaces_average_latency(rows, scorer_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'SCORE_USE_P95', True)
+    rng = random.Random(7)
+    store = build_store(rows)
+    for row in range(len(store)):
+        store.p95_latency[row] = rng.choice([0.0, 100.0, 500.0, rng.uniform(1, 800)])
+    expected = [reference_score(dict(data, avg_latency=p95) if p95 > 0 else data)
+                for data, p95 in zip(reference_rows(store), store.p95_latency)]
+    assert nodes.BatchScorer.score_all(store) == expected
+
+
+def test_scalar_formula_matches_reference(rows):
+    for data in reference_rows(build_store(rows)):
+        assert nodes._score_values(data['tests'], data['success_rate'], data['avg_latency'],
+                                   data['best_latency'], data['worst_latency'], data['age_days'],
+                                   data['consecutive_fails']) == reference_score(data)
+
+
+def test_throughput_term_is_capped(rows, scorer_path):
+    rng = random.Random(11)
+    store = build_store(rows)
+    for row in range(len(store)):
+        store.throughput_mbps[row] = rng.choice([0.0, 0.0, 5.0, nodes.Config.THROUGHPUT_FULL_MBPS, 500.0])
+    full, cap = nodes.Config.THROUGHPUT_FULL_MBPS, nodes.Config.THROUGHPUT_SCORE_MAX
+    expected = [max(0, reference_score(dict(data, consecutive_fails=0)) - data['consecutive_fails'] * 5
+                    + (min(cap, cap * value / full) if value > 0 else 0))
+                for data, value in zip(reference_rows(store), store.throughput_mbps)]
+    assert nodes.BatchScorer.score_all(store) == pytest.approx(expected)
+
+
+def test_derived_columns_match_counts():
+    store = build_store([{'tests': 8, 'success': 6, 'total_latency': 450.0, 'latency_count': 3}])
+    assert store.success_rate(0) == 0.75
+    assert store.avg_latency(0) == 150.0
+    empty = build_store([{}])
+    assert (empty.success_rate(0), empty.avg_latency(0)) == (0.0, INF)
@@ -0,0 +1,52 @@
+"""逐节点核心验证：设置 CORE_STANDIN_PROXY 后不启动核心，所有检查都经本地替身代理完成"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+CHECK_URL = "http://check.invalid/page"
+LINKS = [f"trojan://pw{i}@h{i}.example:443#n{i}" for i in range(6)]
+
+
+async def run_verify(monkeypatch, body: str):
+    """本地HTTP服务兼作替身代理：代理请求使用绝对URI，按路径分发"""
+    requests = []
+
+    async def page(request):
+        requests.append(str(request.url))
+        return web.Response(text=body, content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/page", page)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    monkeypatch.setattr(nodes.Config, 'CORE_STANDIN_PROXY', f"http://127.0.0.1:{runner.addresses[0][1]}")
+    monkeypatch.setattr(nodes.Config, 'CORE_CHECK_URL', CHECK_URL)
+    try:
+        results = await nodes.verify_nodes_via_core(LINKS)
+    finally:
+        await runner.cleanup()
+    return results, requests
+
+
+def test_verify_through_standin_proxy(monkeypatch):
+    results, requests = asyncio.run(run_verify(monkeypatch, "<html><body>ok</body></html>"))
+    assert requests == [CHECK_URL] * len(LINKS)
+    assert sorted(r["original_node"] for r in results) == sorted(LINKS)
+    assert all(r["google_ok"] and r["latency"] < float("inf") for r in results)
+    assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+
+
+def test_verify_drops_nodes_failing_the_check(monkeypatch):
+    results, requests = asyncio.run(run_verify(monkeypatch, "blocked"))
+    assert len(requests) == len(LINKS)
+    assert results == []
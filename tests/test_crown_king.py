@@ -0,0 +1,33 @@
+"""节点王加冕：存活列表按得分排序，节点王在最前面，写入 nodes.txt 的前 MAX_NODES 个即为得分最高的节点"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+
+@pytest.fixture
+def king_system(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.random, 'random', lambda: 1.0)  # 跳过随机触发的每日检查
+    return nodes.NodeKingSystem()
+
+
+def test_alive_is_sorted_by_score_with_king_first(king_system):
+    links = [f"trojan://pw{i}@n{i}.example.com:443#n{i}" for i in range(6)]
+    # 延迟越低得分越高：n0 最好，n5 最差
+    for i, link in enumerate(links):
+        for _ in range(3):
+            king_system.update(link, 80.0 + 60 * i, True)
+
+    alive = [links[i] for i in (3, 5, 0, 2, 4, 1)]
+    king_node = nodes.crown_king(alive, king_system)
+
+    assert king_node == alive[0]
+    scores = nodes.BatchScorer.score_all(king_system.nodes)
+    rest = [scores[king_system.nodes.row_of(king_system.get_id(node))] for node in alive[1:]]
+    assert rest == sorted(rest, reverse=True)
+    assert alive[-1] == links[5]
@@ -0,0 +1,52 @@
+"""提前结束测速：排名靠后、本轮没测到的已知节点不能被每日检查当作未活跃淘汰"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+NODE_COUNT = 40
+
+
+@pytest.fixture
+def early_exit_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.Config, 'EARLY_EXIT_ENABLED', True)
+    monkeypatch.setattr(nodes.Config, 'EARLY_EXIT_TARGET', 2)
+    monkeypatch.setattr(nodes.Config, 'ADAPTIVE_CONCURRENCY', False)
+    monkeypatch.setattr(nodes.Config, 'MAX_CONCURRENT_REQUESTS', 2)
+    monkeypatch.setattr(nodes.Config, 'FRESHNESS_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'PROBE_SAMPLE_INTERVAL', 0.0)
+    monkeypatch.setattr(nodes.Config, 'STAGE_PROBE_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'BANDWIDTH_TEST_ENABLED', False)
+
+
+async def run_benchmark(king_system) -> list:
+    server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0,
+                                        backlog=1024)
+    port = server.sockets[0].getsockname()[1]
+    links = [f"trojan://pw{i}@127.0.0.1:{port}#n{i}" for i in range(NODE_COUNT)]
+    stale = time.time() - (nodes.Config.NODE_INACTIVE_DAYS + 1) * 86400
+    for link in links:
+        row = king_system.nodes.add(king_system.get_id(link), link, stale)
+        king_system.nodes.tests[row] = 1
+    try:
+        await nodes.enhanced_benchmark_nodes_async(links, king_system)
+    finally:
+        server.close()
+        await server.wait_closed()
+    return links
+
+
+def test_skipped_nodes_survive_daily_check(early_exit_config):
+    king_system = nodes.NodeKingSystem()
+    links = asyncio.run(run_benchmark(king_system))
+    assert min(king_system.nodes.tests) == 1, "提前结束时应有节点没被测到"
+    king_system.daily_check()
+    assert len(king_system.nodes) == len(links)
+    assert len(king_system.dead) == 0
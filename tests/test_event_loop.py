@@ -0,0 +1,63 @@
+"""事件循环实现对比：同一批本地节点分别在标准 asyncio 与 uvloop 下跑 enhanced_benchmark_nodes_async
+
+用 python -m pytest tests/test_event_loop.py -s 运行可看到两种实现的耗时。
+"""
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+NODE_COUNT = 300
+
+
+@pytest.fixture(params=['asyncio', 'uvloop'])
+def loop_impl(request, monkeypatch):
+    if request.param == 'uvloop' and not nodes.has_uvloop:
+        pytest.skip("uvloop未安装")
+    monkeypatch.setattr(nodes.Config, 'EVENT_LOOP', request.param)
+    monkeypatch.setattr(nodes, '_event_loop_impl', None)
+    yield nodes.install_event_loop_policy()
+    asyncio.set_event_loop_policy(None)
+
+
+@pytest.fixture
+def isolated_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.Config, 'EARLY_EXIT_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'FRESHNESS_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'PROBE_SAMPLE_INTERVAL', 0.0)
+    # 本地监听只接受TCP连接，不做TLS/WebSocket阶段
+    monkeypatch.setattr(nodes.Config, 'STAGE_PROBE_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'BANDWIDTH_TEST_ENABLED', False)
+
+
+async def run_benchmark() -> tuple:
+    server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0,
+                                        backlog=1024)
+    port = server.sockets[0].getsockname()[1]
+    links = [f"trojan://pw{i}@127.0.0.1:{port}#n{i}" for i in range(NODE_COUNT)]
+    try:
+        start = time.perf_counter()
+        alive, _ = await nodes.enhanced_benchmark_nodes_async(links, None)
+        return alive, time.perf_counter() - start
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_enhanced_benchmark_under_loop(loop_impl, isolated_config):
+    loop = asyncio.new_event_loop()
+    try:
+        if loop_impl == 'uvloop':
+            assert type(loop).__module__.startswith('uvloop')
+        alive, elapsed = loop.run_until_complete(run_benchmark())
+    finally:
+        loop.close()
+    assert len(alive) == min(NODE_COUNT, nodes.Config.MAX_NODES)
+    print(f"\n{loop_impl}: {NODE_COUNT} 个节点测速耗时 {elapsed * 1000:.0f}ms")
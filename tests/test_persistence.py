@@ -0,0 +1,150 @@
+"""节点王持久化：日志重放、半截尾部截断、压缩、损坏快照保留、旧版状态迁移"""
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+LINK_A = "trojan://pw-a@a.example.com:443#a"
+LINK_B = "trojan://pw-b@b.example.com:443#b"
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def reload() -> nodes.NodeKingSystem:
+    king_system = nodes.NodeKingSystem()
+    king_system.nodes  # 触发延迟加载
+    return king_system
+
+
+def test_journal_replay(base_dir):
+    king_system = nodes.NodeKingSystem()
+    king_system.update(LINK_A, 120.0, True)
+    king_system.update(LINK_A, nodes.INF, False)
+    king_system.save()
+    assert not os.path.exists(king_system.data_file), "增量保存不应写快照"
+
+    restored = reload()
+    s = restored.nodes
+    row = s.row_of(restored.get_id(LINK_A))
+    assert row >= 0
+    assert (s.tests[row], s.success[row], s.fails[row]) == (2, 1, 1)
+    assert s.best_latency[row] == pytest.approx(120.0)
+
+
+def test_uncommitted_tail_is_dropped_and_truncated(base_dir):
+    king_system = nodes.NodeKingSystem()
+    king_system.update(LINK_A, 120.0, True)
+    king_system.save()
+    committed_size = os.path.getsize(king_system.journal_file)
+
+    # 模拟写到一半崩溃：一条完整但未提交的记录，加半行
+    pending = {'s': 'nodes', 'id': king_system.get_id(LINK_B),
+               'd': {'node': LINK_B, 'tests': 1, 'success': 1}}
+    with open(king_system.journal_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(pending) + '\n' + '{"s": "nodes", "id": "tru')
+
+    restored = reload()
+    assert restored.get_id(LINK_A) in restored.nodes
+    assert restored.get_id(LINK_B) not in restored.nodes
+    assert os.path.getsize(restored.journal_file) == committed_size
+
+    # 截断后继续追加，下次加载仍能完整重放
+    restored.update(LINK_B, 80.0, True)
+    restored.save()
+    again = reload()
+    assert again.get_id(LINK_A) in again.nodes
+    assert again.get_id(LINK_B) in again.nodes
+
+
+def test_compaction_writes_snapshot_and_clears_journal(base_dir, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'NODE_KING_COMPACT_ENTRIES', 2)
+    king_system = nodes.NodeKingSystem()
+    king_system.update(LINK_A, 120.0, True)
+    king_system.update(LINK_B, 80.0, True)
+    king_system.save()
+
+    assert os.path.getsize(king_system.journal_file) == 0
+    with open(king_system.data_file, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    assert snapshot['schema_version'] == nodes.Config.NODE_KING_SCHEMA_VERSION
+    assert set(snapshot['nodes']) == {king_system.get_id(LINK_A), king_system.get_id(LINK_B)}
+
+    restored = reload()
+    s = restored.nodes
+    assert s.best_latency[s.row_of(restored.get_id(LINK_B))] == pytest.approx(80.0)
+
+
+def test_corrupt_snapshot_is_preserved(base_dir):
+    king_system = nodes.NodeKingSystem()
+    king_system.update(LINK_A, 120.0, True)
+    king_system.save()
+    garbage = '{"nodes": {"broken'
+    with open(king_system.data_file, 'w', encoding='utf-8') as f:
+        f.write(garbage)
+
+    restored = reload()
+    backups = [p for p in os.listdir(base_dir) if '.corrupt-' in p]
+    assert len(backups) == 1
+    with open(os.path.join(base_dir, backups[0]), 'r', encoding='utf-8') as f:
+        assert f.read() == garbage
+    # 快照损坏不影响已提交的日志
+    assert restored.get_id(LINK_A) in restored.nodes
+
+
+def test_newer_schema_is_read_only(base_dir):
+    king_system = nodes.NodeKingSystem()
+    content = json.dumps({'schema_version': nodes.Config.NODE_KING_SCHEMA_VERSION + 1, 'nodes': {}})
+    with open(king_system.data_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+    restored = reload()
+    restored.update(LINK_A, 120.0, True)
+    restored.save()
+    restored.compact()
+    with open(restored.data_file, 'r', encoding='utf-8') as f:
+        assert f.read() == content
+    assert not os.path.exists(restored.journal_file)
+
+
+def test_legacy_config_is_migrated(base_dir):
+    recent = datetime.fromtimestamp(time.time() - 86400).isoformat()
+    legacy = {
+        'nodes': {'id-a': {'node': LINK_A, 'create_time': recent, 'last_active': recent,
+                           'tests': 4, 'success': 3, 'fails': 1, 'best_latency': 90.0,
+                           'avg_latency': 110.0, 'success_rate': 0.75, 'score': 70.0}},
+        'kings': {'id-a': {'node': LINK_A, 'score': 70.0, 'avg_latency': 110.0}},
+        'dead': {'id-b': {'node': LINK_B, 'death_time': recent, 'death_reason': '连续失败'}},
+        # v2rayN 自身的配置字段，迁移时必须原样保留
+        'outbounds': [{'tag': 'proxy'}],
+    }
+    legacy_path = base_dir / nodes.Config.LEGACY_NODE_KING_FILE
+    legacy_path.write_text(json.dumps(legacy, ensure_ascii=False), encoding='utf-8')
+    original = legacy_path.read_bytes()
+
+    king_system = reload()
+    s = king_system.nodes
+    row = s.row_of('id-a')
+    assert row >= 0 and (s.tests[row], s.success[row]) == (4, 3)
+    assert s.create_time[row] == pytest.approx(datetime.fromisoformat(recent).timestamp())
+    assert 'id-a' in king_system.kings
+    assert 'id-b' in king_system.dead
+    assert legacy_path.read_bytes() == original
+
+    # 迁移结果写入新文件，之后不再读取旧文件
+    with open(king_system.data_file, 'r', encoding='utf-8') as f:
+        assert json.load(f)['schema_version'] == nodes.Config.NODE_KING_SCHEMA_VERSION
+    legacy_path.unlink()
+    restored = reload()
+    assert restored.nodes.row_of('id-a') >= 0
+    assert 'id-b' in restored.dead
@@ -0,0 +1,43 @@
+"""分层探测：TCP连通但TLS握手失败的节点记为失败，其TCP样本不能计入延迟统计"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+
+@pytest.fixture
+def stage_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.Config, 'STAGE_PROBE_ENABLED', True)
+    monkeypatch.setattr(nodes.Config, 'STAGE_PROBE_TIMEOUT', 1.0)
+    monkeypatch.setattr(nodes.Config, 'PROBE_SAMPLE_INTERVAL', 0.0)
+
+
+async def probe_plain_tcp(king_system):
+    # 只接受TCP连接、不回应TLS握手的服务
+    server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    link = f"trojan://pw@127.0.0.1:{port}#tls"
+    try:
+        return link, await nodes.probe_node_for_king(link, king_system)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def test_failed_stage_discards_tcp_samples(stage_config):
+    king_system = nodes.NodeKingSystem()
+    link, (_, latency, success) = asyncio.run(probe_plain_tcp(king_system))
+    assert latency < float('inf') and not success
+
+    s = king_system.nodes
+    row = s.row_of(king_system.get_id(link))
+    assert (s.tests[row], s.fails[row], s.success[row]) == (1, 1, 0)
+    assert s.sketches[row] is None
+    assert s.latency_quantile(row, 0.95) == 0.0
+    assert s.loss_rate[row] == 1.0
@@ -0,0 +1,73 @@
+"""流式流水线重试：下载中途失败后整体重试，节点王统计与跨天去重过滤器都不能带上失败那一次的结果"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+NODE_COUNT = 40
+
+
+@pytest.fixture
+def stream_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.Config, 'ENABLE_STEALTH', False)
+    monkeypatch.setattr(nodes.Config, 'DEDUP_BLOOM_ENABLED', True)
+    monkeypatch.setattr(nodes.Config, 'FRESHNESS_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'PROBE_SAMPLE_INTERVAL', 0.0)
+    monkeypatch.setattr(nodes.Config, 'STAGE_PROBE_ENABLED', False)
+    monkeypatch.setattr(nodes.Config, 'BANDWIDTH_TEST_ENABLED', False)
+    monkeypatch.setattr(nodes, 'fake_logging', lambda: None)
+
+
+async def run_pipeline(king_system):
+    probe_server = await asyncio.start_server(lambda reader, writer: writer.close(), '127.0.0.1', 0,
+                                              backlog=1024)
+    probe_port = probe_server.sockets[0].getsockname()[1]
+    body = "".join(f"trojan://pw{i}@127.0.0.1:{probe_port}#n{i}\n" for i in range(NODE_COUNT)).encode()
+    attempts = []
+
+    async def subscription(request):
+        attempts.append(1)
+        response = web.StreamResponse(headers={"Content-Length": str(len(body))})
+        await response.prepare(request)
+        if len(attempts) == 1:
+            # 第一次只发一半就断开连接
+            await response.write(body[:len(body) // 2])
+            await asyncio.sleep(0.2)
+            request.transport.close()
+            return response
+        await response.write(body)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/nodes.txt", subscription)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/nodes.txt"
+    try:
+        result = await nodes.stream_download_and_benchmark_async(url, king_system)
+    finally:
+        await runner.cleanup()
+        probe_server.close()
+        await probe_server.wait_closed()
+    return result, len(attempts)
+
+
+def test_retry_does_not_double_count(stream_config):
+    king_system = nodes.NodeKingSystem()
+    (alive, _, unique_lines), attempts = asyncio.run(run_pipeline(king_system))
+    assert attempts == 2
+    assert len(unique_lines) == NODE_COUNT
+    assert len(alive) == min(NODE_COUNT, nodes.Config.MAX_NODES)
+    s = king_system.nodes
+    assert len(s) == NODE_COUNT
+    assert set(s.tests) == {1}
@@ -0,0 +1,132 @@
+"""v2rayN 配置事务：分组替换、默认节点与订阅修改只读写一次配置文件"""
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Automatic_cawling_mibei_Nodes as nodes  # noqa: E402
+
+NODE_LINES = ["trojan://pw@a.example:443#a", "trojan://pw@b.example:8443#b"]
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({
+        "index": 0,
+        "servers": [
+            {"group": "其他", "address": "keep.example", "port": 1},
+            {"group": "米贝", "address": "old.example", "port": 2},
+        ],
+    }), encoding="utf-8")
+    (tmp_path / nodes.Config.NODES_FILE).write_text("\n".join(NODE_LINES), encoding="utf-8")
+    monkeypatch.setattr(nodes.Config, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(nodes.Config, 'ENABLE_STEALTH', False)
+    monkeypatch.setattr(nodes.Config, 'ENABLE_SPEED_TEST', False)
+    monkeypatch.setattr(nodes.Config, 'ENABLE_NODE_FILTERING', False)
+    monkeypatch.setattr(nodes, 'find_v2rayn_installation', lambda *args: str(tmp_path))
+    monkeypatch.setattr(nodes, 'get_config_path', lambda v2rayn_dir=None: str(path))
+    return path
+
+
+def test_transaction_writes_once(config_file, monkeypatch):
+    writes = []
+    real_write = nodes.safe_file_operations
+    monkeypatch.setattr(nodes, 'safe_file_operations',
+                        lambda *args, **kwargs: writes.append(args[0]) or real_write(*args, **kwargs))
+
+    tx = nodes.V2rayNConfigTransaction.open()
+    assert nodes.add_nodes_to_mibei_group(None, tx)
+    assert nodes.update_v2rayn_subscription("https://example.com/sub", tx)
+    assert writes == []
+    assert tx.commit()
+    assert writes == [str(config_file)]
+
+    data = json.loads(config_file.read_text(encoding="utf-8"))
+    groups = [server["group"] for server in data["servers"]]
+    assert groups == ["其他", "米贝", "米贝"]
+    assert data["subscriptions"][0]["url"] == "https://example.com/sub"
+    assert not os.path.exists(str(config_file) + ".tmp")
+
+
+def test_default_node_uses_index(config_file):
+    tx = nodes.V2rayNConfigTransaction.open()
+    tx.sync_group("米贝", [{"id": "b", "group": "米贝", "address": "b.example", "port": 8443}])
+    assert tx.find_server("米贝", "b.example", 8443) == 1
+    assert nodes.set_best_node_as_default(NODE_LINES[1], "米贝", tx)
+    assert not nodes.set_best_node_as_default(NODE_LINES[0], "米贝", tx)
+    assert tx.commit()
+    assert json.loads(config_file.read_text(encoding="utf-8"))["index"] == 1
+
+
+def test_export_reuses_benchmark_latencies(monkeypatch):
+    monkeypatch.setattr(nodes.Config, 'ENABLE_SPEED_TEST', True)
+    monkeypatch.setattr(nodes.Config, 'IGNORE_LATENCY_TEST', False)
+    monkeypatch.setattr(nodes, 'test_latency', lambda *args, **kwargs: pytest.fail("导出时不应再测速"))
+    monkeypatch.setattr(nodes.time, 'sleep', lambda seconds: pytest.fail("导出时不应休眠"))
+    lines = [f"trojan://pw@h{i}.example:443#n{i}" for i in range(250)]
+    latencies = {line: 50.0 for line in lines}
+    latencies[lines[0]] = nodes.Config.MAX_LATENCY + 1
+    servers = nodes.build_export_servers(lines, "米贝", latencies)
+    assert len(servers) == len(lines) - 1
+
+
+VMESS = "vmess://" + base64.b64encode(json.dumps({
+    "v": "2", "ps": "vm", "add": "vm.example", "port": "443", "id": "uuid-1", "aid": "0",
+    "net": "ws", "host": "cdn.example", "path": "/ws", "tls": "tls", "sni": "sni.example"}).encode()).decode()
+EXPORT_LINES = [
+    VMESS,
+    "vless://uuid-2@vl.example:443?type=grpc&security=reality&sni=r.example&pbk=KEY&sid=ab&flow=xtls-rprx-vision#vl",
+    "trojan://secret@tj.example:8443?peer=peer.example#tj",
+    "ss://" + base64.b64encode(b"aes-256-gcm:sspw").decode() + "@ss.example:8388#ss",
+]
+
+
+@pytest.mark.parametrize("line", EXPORT_LINES)
+def test_converter_matches_core_outbound(line):
+    node = nodes.parse_node(line)
+    server = nodes.build_v2rayn_server(node, "米贝")
+    settings = nodes.build_core_outbound(node)["settings"]
+    target = (settings.get("vnext") or settings.get("servers"))[0]
+    assert (server["address"], server["port"]) == (target["address"], target["port"])
+    credential = target.get("password") or target["users"][0]["id"]
+    assert server.get("uuid", server.get("password")) == credential
+    assert server["remarks"] == node.remarks
+
+
+def test_converter_stream_fields():
+    vmess, vless, trojan, ss = (nodes.build_v2rayn_server(nodes.parse_node(line), "米贝")
+                                for line in EXPORT_LINES)
+    assert (vmess["network"], vmess["requestHost"], vmess["path"], vmess["streamSecurity"]) == \
+        ("ws", "cdn.example", "/ws", "tls")
+    assert (vless["type"], vless["network"], vless["flow"], vless["publicKey"]) == \
+        ("VLESS", "grpc", "xtls-rprx-vision", "KEY")
+    assert (trojan["streamSecurity"], trojan["sni"]) == ("tls", "peer.example")
+    assert ss["security"] == "aes-256-gcm"
+    assert nodes.build_v2rayn_server(nodes.parse_node("hysteria2://pw@hy.example:443"), "米贝") is None
+
+
+def test_sync_group_is_stable_and_keeps_selection(config_file):
+    lines = [f"trojan://pw@h{i}.example:443#n{i}" for i in range(5)]
+    servers = nodes.build_export_servers(lines, "米贝")
+    tx = nodes.V2rayNConfigTransaction.open()
+    assert tx.sync_group("米贝", servers) == (5, 1, 0)
+    tx.set_default(tx.find_server("米贝", "h3.example", 443))
+    assert tx.commit()
+
+    # 同一批节点再次导出：ID不变，不产生任何写入
+    tx = nodes.V2rayNConfigTransaction.open()
+    assert tx.sync_group("米贝", nodes.build_export_servers(lines, "米贝")) == (0, 0, 0)
+    assert not tx.dirty
+
+    # 前面的节点被淘汰后，选中的节点下标变化但仍保持选中
+    tx.sync_group("米贝", nodes.build_export_servers(lines[2:] + ["trojan://pw@new.example:443"], "米贝"))
+    selected = tx.data["servers"][tx.data["index"]]
+    assert selected["address"] == "h3.example"
+    exported = [server["id"] for server in tx.data["servers"] if server["group"] == "米贝"]
+    assert len(exported) == len(set(exported)) == 4
+